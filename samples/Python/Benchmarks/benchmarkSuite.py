@@ -0,0 +1,374 @@
+from requests import Session
+from requests.auth import HTTPBasicAuth
+from zeep.transports import Transport
+from zeep import Client, Settings
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import io
+import json
+import logging
+import os
+import queue
+import requests
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import click
+
+for scriptDirectory in ["Common", "IOS+", "IPS", "Cross-product"]:
+    sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), "..", scriptDirectory))
+import mockWebServices
+import pager
+import wsdlCache
+from sessionManager import SessionManager
+from requestScheduler import RequestScheduler, InstallTransientStatusHook
+from latencyStats import Percentile
+import orderCreate
+import orderPadSubscription
+import ipsUpload
+import portfolioAlerter
+
+# Runs the Python samples' client paths against the local mock server in Common/mockWebServices.py, so their
+# throughput and resource use can be compared between changes without touching production servers. The mock server
+# runs in this process, and each scenario runs in a child process of its own so that its CPU time and peak memory can
+# be measured on their own. Within a scenario, every HTTP request is timed by operation. Results can be written to a
+# JSON report and compared against the report of an earlier run.
+
+IRESS_NAMESPACE = "http://webservices.iress.com.au/v4/"
+
+BENCHMARK_USERNAME = "benchmark"
+BENCHMARK_COMPANYNAME = "mock"
+BENCHMARK_PASSWORD = "benchmark"
+BENCHMARK_IOSPLUS_SERVER = "IOSPLUSBENCHMARK"
+BENCHMARK_IPS_SERVER = "IPSBENCHMARK"
+
+# Operations with fewer requests than this in a run are too noisy to compare latency percentiles for
+MINIMUM_COMPARED_REQUESTS = 20
+
+def logInfo(message):
+    logger = logging.getLogger(__name__)
+    logger.info(message)
+
+def logError(message):
+    logger = logging.getLogger(__name__)
+    logger.error(message)
+
+# Times every HTTP request made through requests, by the operation named in its SOAPAction header
+class RequestTimings:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = {}
+        self.errorCounts = {}
+
+    def record(self, operationName, latency, failed):
+        with self.lock:
+            self.latencies.setdefault(operationName, []).append(latency)
+            self.errorCounts[operationName] = self.errorCounts.get(operationName, 0) + (1 if failed else 0)
+
+    def install(self):
+        originalSend = requests.Session.send
+        timings = self
+
+        def TimedSend(session, request, **kwargs):
+            operationName = request.headers.get("SOAPAction", "").strip('"').rsplit("/", 1)[-1] or request.method
+            startTime = time.perf_counter()
+            try:
+                response = originalSend(session, request, **kwargs)
+            except:
+                timings.record(operationName, time.perf_counter() - startTime, True)
+                raise
+            timings.record(operationName, time.perf_counter() - startTime, response.status_code != 200)
+            return response
+
+        requests.Session.send = TimedSend
+
+    def summarise(self):
+        operations = {}
+        for operationName, latencies in self.latencies.items():
+            sortedLatencies = sorted(latencies)
+            operations[operationName] = { "Requests": len(sortedLatencies), "Errors": self.errorCounts[operationName], "p50": Percentile(sortedLatencies, 50), "p95": Percentile(sortedLatencies, 95), "p99": Percentile(sortedLatencies, 99), "Max": sortedLatencies[-1] }
+        return operations
+
+def BuildClient(endpoint, service, server, methodList, operationTimeout=None):
+    session = Session()
+    session.auth = HTTPBasicAuth(BENCHMARK_USERNAME + "@" + BENCHMARK_COMPANYNAME, BENCHMARK_PASSWORD)
+    client = Client(wsdlCache.GetWsdl(session, endpoint, service, server, methodList, cacheDirectory=None), settings=Settings(strict = False, xml_huge_tree = True), transport=Transport(session=session, operation_timeout=operationTimeout))
+    client.set_ns_prefix("ns0", IRESS_NAMESPACE)
+    return client, client.type_factory(IRESS_NAMESPACE)
+
+def StartSessions(client, clientFactory, endpoint, service, server):
+    sessionManager = SessionManager(client, clientFactory, endpoint, BENCHMARK_USERNAME, BENCHMARK_COMPANYNAME, BENCHMARK_PASSWORD, service=service, server=server, storePath=None)
+    sessionManager.getSessionKeys()
+    return sessionManager
+
+# Each scenario returns the number of units of work it completed and the number of those that failed
+
+def RunOrderCreate(endpoint, settings):
+    # orderCreate.py: OrderCreate3 batches across a pool of workers
+    iosPlusClient, iosPlusClientFactory = BuildClient(endpoint, "IOSPlus", BENCHMARK_IOSPLUS_SERVER, "OrderCreate3")
+    sessionManager = StartSessions(iosPlusClient, iosPlusClientFactory, endpoint, "IOSPLUS", BENCHMARK_IOSPLUS_SERVER)
+    scheduler = RequestScheduler(maxConcurrency=settings["workers"])
+    schedulerKey = ("IOSPLUS", BENCHMARK_IOSPLUS_SERVER)
+    workerState = threading.local()
+
+    def InitialiseWorker():
+        workerSession = Session()
+        workerSession.auth = iosPlusClient.transport.session.auth
+        InstallTransientStatusHook(workerSession)
+        sessionManager.installRestartHook(workerSession)
+        workerState.client = Client(iosPlusClient.wsdl, settings=iosPlusClient.settings, transport=Transport(session=workerSession))
+        workerState.client.set_ns_prefix("ns0", IRESS_NAMESPACE)
+
+    def CreateBatch(batch):
+        return orderCreate.CreateOrderBatch(workerState.client, iosPlusClientFactory, sessionManager.getServiceSessionKey(), batch, scheduler, schedulerKey)
+
+    orders = (orderCreate.PendingOrder(i, "1", "BENCHMARK", "BHP", "ASX", "DESK", 100, 100) for i in range(1, settings["orders"] + 1))
+    with ThreadPoolExecutor(max_workers=settings["workers"], initializer=InitialiseWorker) as executor:
+        failedCount = sum(executor.map(CreateBatch, orderCreate.BatchOrders(orders, settings["batchsize"])))
+    sessionManager.close()
+    return settings["orders"], failedCount
+
+def RunPortfolioAlerter(endpoint, settings):
+    # portfolioAlerter.py: wipe the existing alerts, then fan out the position retrieval and batch an alert for every
+    # position
+    iressClient, iressClientFactory = BuildClient(endpoint, "IRESS", "", "AlertCreate,AlertGet,AlertDelete")
+    iosPlusClient, iosPlusClientFactory = BuildClient(endpoint, "IOSPlus", BENCHMARK_IOSPLUS_SERVER, "PortfolioGet,PortfolioPositionDetailGet")
+    sessionManager = StartSessions(iosPlusClient, iosPlusClientFactory, endpoint, "IOSPLUS", BENCHMARK_IOSPLUS_SERVER)
+    scheduler = RequestScheduler(maxConcurrency=settings["parallelism"])
+    portfolioAlerter.WipeExistingAlerts(iressClient, iressClientFactory, scheduler, sessionManager.getIressSessionKey(), settings["pagesize"])
+
+    positionQueue = queue.Queue(maxsize=settings["parallelism"] * 4)
+    retrievalSummary = { "PortfolioCount": 0, "Failed": False }
+    retrievalThread = threading.Thread(target=portfolioAlerter.RetrievePortfolioPositions, args=(iosPlusClient, iosPlusClientFactory, scheduler, ("IOSPLUS", BENCHMARK_IOSPLUS_SERVER), sessionManager, settings["portfoliogroupsize"], settings["parallelism"], positionQueue, retrievalSummary, settings["pagesize"]), daemon=True)
+    retrievalThread.start()
+
+    alertCount = 0
+    alertsCreatedCount = 0
+    pendingAlerts = []
+    while True:
+        portfolioPositionDetailGetDataRows = positionQueue.get()
+        if portfolioPositionDetailGetDataRows is portfolioAlerter.END_OF_POSITIONS:
+            break
+        for portfolioPositionDetailGetDataRow in portfolioPositionDetailGetDataRows:
+            pendingAlerts.append(portfolioAlerter.PendingAlert("<=", portfolioPositionDetailGetDataRow.SecurityCode, portfolioPositionDetailGetDataRow.Exchange, 0.95 * portfolioPositionDetailGetDataRow.AveragePriceStartOfDay, portfolioPositionDetailGetDataRow.PortfolioCode, "PortfolioCode - {}".format(portfolioPositionDetailGetDataRow.PortfolioCode)))
+            if len(pendingAlerts) == settings["alertbatchsize"]:
+                alertsCreatedCount = alertsCreatedCount + portfolioAlerter.CreateQuoteAlerts(iressClient, iressClientFactory, scheduler, sessionManager.getIressSessionKey(), pendingAlerts)
+                alertCount = alertCount + len(pendingAlerts)
+                pendingAlerts = []
+    if pendingAlerts:
+        alertsCreatedCount = alertsCreatedCount + portfolioAlerter.CreateQuoteAlerts(iressClient, iressClientFactory, scheduler, sessionManager.getIressSessionKey(), pendingAlerts)
+        alertCount = alertCount + len(pendingAlerts)
+
+    retrievalThread.join()
+    sessionManager.close()
+    return alertCount, alertCount - alertsCreatedCount + (1 if retrievalSummary["Failed"] else 0)
+
+def RunPagedRead(endpoint, settings):
+    # Common/pager.py: page through the order pad with zeep deserialising every DataRow
+    iosPlusClient, iosPlusClientFactory = BuildClient(endpoint, "IOSPlus", BENCHMARK_IOSPLUS_SERVER, "OrderPadGetByAccount")
+    sessionManager = StartSessions(iosPlusClient, iosPlusClientFactory, endpoint, "IOSPLUS", BENCHMARK_IOSPLUS_SERVER)
+    accountCodes = ["BENCHMARK{:04d}".format(accountIndex) for accountIndex in range(settings["accounts"])]
+    orderPadGetByAccountInputParameters = iosPlusClientFactory.OrderPadGetByAccountInputParameters(AccountCodeArray={"AccountCode": accountCodes}, OrderFilter=1, DestinationExclude=False, RetrieveSecurityDescription=False)
+    rowCount = 0
+    for orderPadGetByAccountDataRow in pager.GetDataRows(lambda pagingHeader: iosPlusClient.service.OrderPadGetByAccount(iosPlusClientFactory.OrderPadGetByAccountInput(Header=iosPlusClientFactory.OrderPadGetByAccountInputHeader(ServiceSessionKey=sessionManager.getServiceSessionKey(), **pagingHeader), Parameters=orderPadGetByAccountInputParameters)), settings["pagesize"]):
+        rowCount = rowCount + 1
+    sessionManager.close()
+    return rowCount, 0
+
+def RunOrderPadSnapshot(endpoint, settings):
+    # orderPadSubscription.py: the same order pad through the raw response decoder
+    iosPlusClient, iosPlusClientFactory = BuildClient(endpoint, "IOSPlus", BENCHMARK_IOSPLUS_SERVER, "OrderPadGetByAccount,OrderPadGetByAccountUpdates")
+    sessionManager = StartSessions(iosPlusClient, iosPlusClientFactory, endpoint, "IOSPLUS", BENCHMARK_IOSPLUS_SERVER)
+    accountCodes = ["BENCHMARK{:04d}".format(accountIndex) for accountIndex in range(settings["accounts"])]
+    subscription = orderPadSubscription.OrderPadSubscription(iosPlusClient, iosPlusClientFactory, sessionManager, accountCodes, pageSize=settings["pagesize"])
+    asyncio.run(subscription.takeSnapshot())
+    sessionManager.close()
+    return len(subscription.orderBook.orders), 0
+
+def RunOrderPadUpdates(endpoint, settings):
+    # orderPadSubscription.py: snapshot then long-poll for updates for the duration of the scenario
+    iosPlusClient, iosPlusClientFactory = BuildClient(endpoint, "IOSPlus", BENCHMARK_IOSPLUS_SERVER, "OrderPadGetByAccount,OrderPadGetByAccountUpdates", settings["pollTimeout"] + 30)
+    sessionManager = StartSessions(iosPlusClient, iosPlusClientFactory, endpoint, "IOSPLUS", BENCHMARK_IOSPLUS_SERVER)
+    accountCodes = ["BENCHMARK{:04d}".format(accountIndex) for accountIndex in range(settings["accounts"])]
+    orderBook = orderPadSubscription.OrderBook()
+    changes = []
+    orderBook.addCallback(lambda changeType, order, previousOrder: changes.append(changeType) if changeType == orderPadSubscription.ORDER_CHANGED else None)
+    subscription = orderPadSubscription.OrderPadSubscription(iosPlusClient, iosPlusClientFactory, sessionManager, accountCodes, orderBook, settings["pollTimeout"], settings["pagesize"])
+
+    async def RunForDuration():
+        subscriptionTask = asyncio.create_task(subscription.run())
+        await asyncio.sleep(settings["duration"])
+        subscription.stop()
+        await subscriptionTask
+
+    asyncio.run(RunForDuration())
+    sessionManager.close()
+    return len(changes), 0
+
+def RunIpsUpload(endpoint, settings):
+    # ipsUpload.py: send a generated file in parallel chunks, run it and page through its errors
+    ipsClient, ipsClientFactory = BuildClient(endpoint, "IPS", BENCHMARK_IPS_SERVER, "IPSUploadCreate1,IPSUploadDataSet1,IPSUploadRun1,IPSUploadSummaryGet2,IPSUploadErrorGet1")
+    sessionManager = StartSessions(ipsClient, ipsClientFactory, endpoint, "IPS", BENCHMARK_IPS_SERVER)
+    uploadFile = io.StringIO("".join("BENCHMARK{0},\"Benchmark security {0}\",ASX\n".format(lineNumber) for lineNumber in range(1, settings["uploadlines"] + 1)))
+
+    # A failed call fails the whole upload, as it does in ipsUpload.py
+    try:
+        uploadId = ipsUpload.CreateUpload(ipsClient, ipsClientFactory, sessionManager.getServiceSessionKey(), "Security List", "benchmark", ",", '"')
+        lineMap = ipsUpload.SendUploadFile(ipsClient, ipsClientFactory, sessionManager, uploadId, ipsUpload.ReadUploadLines(uploadFile, '"'), settings["chunklines"], 1000000, settings["parallelism"])
+        ipsUpload.RunUpload(ipsClient, ipsClientFactory, sessionManager.getServiceSessionKey(), uploadId)
+        uploadSummary = ipsUpload.WaitForUploadRun(ipsClient, ipsClientFactory, sessionManager, uploadId, None, 60)
+        for sourceLineNumber, errorRow in ipsUpload.GetUploadErrors(ipsClient, ipsClientFactory, sessionManager.getServiceSessionKey(), uploadSummary.LastRunUploadRunID, lineMap, settings["pagesize"]):
+            pass
+    except Exception as ex:
+        logError("Upload failed. Error: {}".format(str(ex)))
+        return 0, settings["uploadlines"]
+    finally:
+        sessionManager.close()
+    return lineMap.lineCount, settings["uploadlines"] - lineMap.lineCount
+
+# The scenarios, in the order they are run, with the unit of work each reports throughput in
+SCENARIOS = {
+    "orderCreate": (RunOrderCreate, "orders"),
+    "portfolioAlerter": (RunPortfolioAlerter, "alerts"),
+    "pagedRead": (RunPagedRead, "rows"),
+    "orderPadSnapshot": (RunOrderPadSnapshot, "rows"),
+    "orderPadUpdates": (RunOrderPadUpdates, "changes"),
+    "ipsUpload": (RunIpsUpload, "lines"),
+}
+
+def RunScenario(scenarioName, endpoint, settings):
+    # Run in the child process. Prints the scenario's result as JSON.
+    timings = RequestTimings()
+    timings.install()
+    scenario, unitName = SCENARIOS[scenarioName]
+    startTime = time.perf_counter()
+    unitCount, errorCount = scenario(endpoint, settings)
+    wallTime = time.perf_counter() - startTime
+    print(json.dumps({ "Scenario": scenarioName, "Units": unitCount, "UnitName": unitName, "Errors": errorCount, "WallTime": wallTime, "Throughput": unitCount / wallTime if wallTime > 0 else 0.0, "Operations": timings.summarise() }))
+
+def RunScenarioProcess(scenarioName, endpoint, settings):
+    # Run a scenario in a child process and add its CPU time and peak memory to the result
+    process = subprocess.Popen([sys.executable, os.path.realpath(__file__), "--scenario", scenarioName, "--endpoint", endpoint, "--settings", json.dumps(settings)], stdout=subprocess.PIPE)
+    output = process.stdout.read()
+    process.stdout.close()
+    cpuTime = None
+    peakMemory = None
+    if hasattr(os, "wait4"):
+        processId, waitStatus, resourceUsage = os.wait4(process.pid, 0)
+        process.returncode = os.waitstatus_to_exitcode(waitStatus)
+        cpuTime = resourceUsage.ru_utime + resourceUsage.ru_stime
+        peakMemory = resourceUsage.ru_maxrss if sys.platform == "darwin" else resourceUsage.ru_maxrss * 1024 # Bytes on macOS, KB elsewhere
+    else:
+        process.wait()
+    if process.returncode != 0:
+        raise Exception("Scenario {} failed with exit code {}".format(scenarioName, process.returncode))
+
+    result = json.loads(output.decode("utf-8").strip().splitlines()[-1])
+    result["CpuTime"] = cpuTime
+    result["PeakMemoryMB"] = peakMemory / (1024 * 1024) if peakMemory is not None else None
+    return result
+
+def LogResult(result):
+    cpuTime = "{:.2f}s".format(result["CpuTime"]) if result["CpuTime"] is not None else "n/a"
+    peakMemory = "{:.1f} MB".format(result["PeakMemoryMB"]) if result["PeakMemoryMB"] is not None else "n/a"
+    logInfo("{}: {} {} in {:.2f}s, {:.1f} {}/sec, {} failed, CPU {}, peak memory {}".format(result["Scenario"], result["Units"], result["UnitName"], result["WallTime"], result["Throughput"], result["UnitName"], result["Errors"], cpuTime, peakMemory))
+    for operationName, operation in sorted(result["Operations"].items()):
+        logInfo("  {:<30} {:6} requests {:4} errors  p50: {:.4f}s p95: {:.4f}s p99: {:.4f}s max: {:.4f}s".format(operationName, operation["Requests"], operation["Errors"], operation["p50"], operation["p95"], operation["p99"], operation["Max"]))
+
+def CompareWithBaseline(results, baselineResults, threshold):
+    # Log each scenario whose throughput fell, or whose p95 latency for a frequent operation rose, by more than
+    # threshold percent. Returns the number of regressions.
+    regressionCount = 0
+    for scenarioName, result in results.items():
+        baselineResult = baselineResults.get(scenarioName)
+        if baselineResult is None:
+            continue
+        throughputChange = 100.0 * (result["Throughput"] - baselineResult["Throughput"]) / baselineResult["Throughput"] if baselineResult["Throughput"] else 0.0
+        logInfo("{}: throughput {:.1f} {}/sec against {:.1f} in the baseline ({:+.1f}%)".format(scenarioName, result["Throughput"], result["UnitName"], baselineResult["Throughput"], throughputChange))
+        if throughputChange < -threshold:
+            logError("{}: throughput regressed by {:.1f}%".format(scenarioName, -throughputChange))
+            regressionCount = regressionCount + 1
+        for operationName, operation in result["Operations"].items():
+            baselineOperation = baselineResult["Operations"].get(operationName)
+            if not baselineOperation or min(operation["Requests"], baselineOperation["Requests"]) < MINIMUM_COMPARED_REQUESTS:
+                continue
+            if baselineOperation["p95"] > 0 and 100.0 * (operation["p95"] - baselineOperation["p95"]) / baselineOperation["p95"] > threshold:
+                logError("{}: {} p95 latency regressed from {:.4f}s to {:.4f}s".format(scenarioName, operationName, baselineOperation["p95"], operation["p95"]))
+                regressionCount = regressionCount + 1
+    return regressionCount
+
+@click.command()
+@click.option('--scenarios', '-s', help='Comma separated scenarios to run, from {}.'.format(", ".join(SCENARIOS)), default=",".join(SCENARIOS))
+@click.option('--repeat', '-n', help='The number of times to run each scenario. The run with the median throughput is reported.', default=1)
+@click.option('--latency', '-l', help='Artificial server latency to add to each response, in milliseconds.', default=5.0)
+@click.option('--jitter', '-j', help='Random extra server latency of up to this many milliseconds to add to each response.', default=0.0)
+@click.option('--errorrate', help='The share of calls, from 0 to 1, the mock server answers with a SOAP fault.', default=0.0)
+@click.option('--seed', help='The seed for the mock server\'s generated values and injected errors.', default=1)
+@click.option('--orders', help='The number of orders to create in the orderCreate scenario.', default=2000)
+@click.option('--workers', help='The number of concurrent workers in the orderCreate scenario.', default=8)
+@click.option('--batchsize', help='The number of orders in each OrderCreate3 request.', default=10)
+@click.option('--portfolios', help='The number of portfolios, and of existing alerts, the mock server returns.', default=500)
+@click.option('--rowsperitem', help='The number of positions per portfolio, and of orders per account, the mock server returns.', default=5)
+@click.option('--portfoliogroupsize', help='The number of portfolio codes in each PortfolioPositionDetailGet request.', default=50)
+@click.option('--alertbatchsize', help='The number of alerts in each AlertCreate request.', default=100)
+@click.option('--accounts', help='The number of account codes to request the order pad of.', default=400)
+@click.option('--pagesize', help='The number of rows in each page of the paged requests.', default=500)
+@click.option('--duration', help='The number of seconds to receive order pad updates for.', default=5.0)
+@click.option('--uploadlines', help='The number of lines to upload in the ipsUpload scenario.', default=20000)
+@click.option('--chunklines', help='The number of lines in each IPSUploadDataSet1 request.', default=1000)
+@click.option('--parallelism', help='The number of concurrent requests for PortfolioPositionDetailGet and IPSUploadDataSet1.', default=4)
+@click.option('--output', '-o', help='The file to write the JSON report of the results to.', default=None)
+@click.option('--baseline', '-b', help='A JSON report from an earlier run to compare the results against.', default=None)
+@click.option('--threshold', '-t', help='The percentage change from the baseline to report as a regression.', default=10.0)
+@click.option('--scenario', hidden=True, default=None)
+@click.option('--endpoint', hidden=True, default=None)
+@click.option('--settings', hidden=True, default=None)
+def main(scenarios, repeat, latency, jitter, errorrate, seed, orders, workers, batchsize, portfolios, rowsperitem, portfoliogroupsize, alertbatchsize, accounts, pagesize, duration, uploadlines, chunklines, parallelism, output, baseline, threshold, scenario, endpoint, settings):
+    # A child process running a single scenario only reports its warnings and errors, leaving stdout to the result
+    if scenario:
+        logging.basicConfig(level=logging.WARNING, format='%(asctime)s.%(msecs)03d %(message)s', datefmt='%Y-%m-%d %H:%M:%S')
+        RunScenario(scenario, endpoint, json.loads(settings))
+        return
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s.%(msecs)03d %(message)s', datefmt='%Y-%m-%d %H:%M:%S')
+    scenarioNames = [scenarioName.strip() for scenarioName in scenarios.split(",") if scenarioName.strip()]
+    unknownScenarioNames = [scenarioName for scenarioName in scenarioNames if scenarioName not in SCENARIOS]
+    if unknownScenarioNames:
+        logError("Unknown scenarios: {}".format(", ".join(unknownScenarioNames)))
+        sys.exit(2)
+
+    # Long-polls return changed rows after a short wait, and upload runs finish straight away, so neither scenario is
+    # dominated by waiting
+    mockServerSettings = { "latency": latency / 1000, "jitter": jitter / 1000, "errorRate": errorrate, "rowCount": portfolios, "rowsPerItem": rowsperitem, "updateInterval": 0.05, "updateRows": 10, "ipsRunTime": 0.0, "ipsErrorEvery": 100, "seed": seed }
+    scenarioSettings = { "orders": orders, "workers": workers, "batchsize": batchsize, "portfoliogroupsize": portfoliogroupsize, "alertbatchsize": alertbatchsize, "accounts": accounts, "pagesize": pagesize, "duration": duration, "pollTimeout": 25, "uploadlines": uploadlines, "chunklines": chunklines, "parallelism": parallelism }
+    mockServer, mockEndpoint = mockWebServices.StartMockServer(**mockServerSettings)
+    logInfo("Mock Web Services endpoint: {}".format(mockEndpoint))
+
+    results = {}
+    try:
+        for scenarioName in scenarioNames:
+            scenarioRuns = [RunScenarioProcess(scenarioName, mockEndpoint, scenarioSettings) for _ in range(repeat)]
+            medianThroughput = statistics.median_low([scenarioRun["Throughput"] for scenarioRun in scenarioRuns])
+            results[scenarioName] = next(scenarioRun for scenarioRun in scenarioRuns if scenarioRun["Throughput"] == medianThroughput)
+            LogResult(results[scenarioName])
+    finally:
+        mockServer.shutdown()
+
+    if output:
+        with open(output, "w") as outputFile:
+            json.dump({ "MockServer": mockServerSettings, "Settings": scenarioSettings, "Results": results }, outputFile, indent=2)
+        logInfo("Wrote the results to {}".format(output))
+
+    if baseline:
+        with open(baseline) as baselineFile:
+            baselineResults = json.load(baselineFile)["Results"]
+        if CompareWithBaseline(results, baselineResults, threshold):
+            sys.exit(1)
+
+def runMain():
+    main()
+
+if __name__ == "__main__":
+    runMain()
@@ -0,0 +1,112 @@
+from requests.models import Response
+from zeep import Client, Settings
+from lxml import etree
+import copy
+import logging
+import os
+import sys
+import tempfile
+import time
+import click
+
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), "..", "Common"))
+import rawResponse
+from standInWsdl import IRESS_NAMESPACE, BuildStandInWsdl, InferXsdType
+
+# Compares decoding the sample responses in "samples/SOAP XML" with zeep against the raw iterparse path in
+# Common/rawResponse.py. Each sample's DataRow is replicated to make a wide result set, and a reduced WSDL for it is
+# built from the fields and values of the sample, so zeep deserialises the same response it would get from a server.
+
+SAMPLES_DIRECTORY = os.path.join(os.path.dirname(os.path.realpath(__file__)), "..", "..", "SOAP XML")
+DEFAULT_SAMPLES = "IOS+/OrderPadGetByAccount_response.xml,IPS/IPSTransactionGetByAccount5_response.xml,IOS+/BookingGetByOrganization2_response.xml"
+
+def logInfo(message):
+    logger = logging.getLogger(__name__)
+    logger.info(message)
+
+def BuildSampleResponse(sampleFileName, rowCount):
+    # Return the operation name, the DataRow fields as (name, xsd type), and the sample response with its DataRow
+    # replicated rowCount times.
+    parser = etree.XMLParser(recover=True, remove_blank_text=True)
+    with open(sampleFileName, "rb") as sampleFile:
+        responseEnvelope = etree.fromstring(sampleFile.read(), parser)
+
+    responseElement = responseEnvelope.find("{http://schemas.xmlsoap.org/soap/envelope/}Body")[0]
+    operationName = etree.QName(responseElement).localname[:-len("Response")]
+    dataRows = next(responseEnvelope.iter("{%s}DataRows" % IRESS_NAMESPACE))
+    sampleDataRow = dataRows[0]
+
+    # Fields with nested content are left to the schema's xsd:any. Some samples are truncated part way through a
+    # DataRow, which recovery parsing turns into elements that are not field names, so those are dropped.
+    dataRowFields = [(etree.QName(field).localname, InferXsdType(field.text)) for field in sampleDataRow if isinstance(field.tag, str) and len(field) == 0 and etree.QName(field).localname.isidentifier()]
+
+    for dataRow in list(dataRows):
+        dataRows.remove(dataRow)
+    for _ in range(rowCount):
+        dataRows.append(copy.deepcopy(sampleDataRow))
+    return operationName, dataRowFields, etree.tostring(responseEnvelope, xml_declaration=True, encoding="utf-8")
+
+def TimeRepeated(function, repeat):
+    startTime = time.perf_counter()
+    for _ in range(repeat):
+        function()
+    return (time.perf_counter() - startTime) / repeat
+
+def BenchmarkSample(sampleFileName, rowCount, repeat, fieldCount):
+    operationName, dataRowFields, responseContent = BuildSampleResponse(sampleFileName, rowCount)
+    operations = { operationName: { "SessionKeyField": "ServiceSessionKey", "Parameters": [], "DataRow": dataRowFields } }
+
+    with tempfile.NamedTemporaryFile("w", suffix=".wsdl", delete=False) as wsdlFile:
+        wsdlFile.write(BuildStandInWsdl("http://127.0.0.1/v4/soap.aspx", operations))
+    try:
+        client = Client(wsdlFile.name, settings=Settings(strict=False, xml_huge_tree=True))
+    finally:
+        os.remove(wsdlFile.name)
+    binding = client.service._binding
+    operation = binding.get(operationName)
+
+    response = Response()
+    response.status_code = 200
+    response.headers["Content-Type"] = "text/xml; charset=utf-8"
+    response._content = responseContent
+
+    allFields = [fieldName for fieldName, fieldType in dataRowFields]
+    allCoercions = { fieldName: rawResponse.XSD_COERCIONS[fieldType] for fieldName, fieldType in dataRowFields if fieldType in rawResponse.XSD_COERCIONS }
+    someFields = allFields[:fieldCount]
+    someCoercions = { fieldName: coercion for fieldName, coercion in allCoercions.items() if fieldName in someFields }
+    allFieldsRow = rawResponse.RowSchema(operationName + "Row", allFields)
+    someFieldsRow = rawResponse.RowSchema(operationName + "Row", someFields)
+
+    # Check the raw path decodes the same number of rows as zeep before timing anything
+    zeepRows = binding.process_reply(client, operation, response).Result.DataRows.DataRow
+    rawRows = list(rawResponse.DecodeRows(responseContent, allFieldsRow, allCoercions))
+    if len(zeepRows) != len(rawRows):
+        raise Exception("zeep decoded {} rows but the raw decoder decoded {}".format(len(zeepRows), len(rawRows)))
+
+    timings = [
+        ("zeep", TimeRepeated(lambda: binding.process_reply(client, operation, response), repeat)),
+        ("raw rows, all {} fields".format(len(allFields)), TimeRepeated(lambda: list(rawResponse.DecodeRows(responseContent, allFieldsRow, allCoercions)), repeat)),
+        ("raw rows, {} fields".format(len(someFields)), TimeRepeated(lambda: list(rawResponse.DecodeRows(responseContent, someFieldsRow, someCoercions)), repeat)),
+        ("raw columns, {} fields".format(len(someFields)), TimeRepeated(lambda: rawResponse.DecodeColumns(responseContent, someFields, someCoercions), repeat)),
+    ]
+
+    logInfo("{}: {} rows of {} fields, {:.0f} KB per response".format(operationName, rowCount, len(allFields), len(responseContent) / 1024))
+    zeepTime = timings[0][1]
+    for name, timeTaken in timings:
+        logInfo("  {:<28} {:8.2f} ms per response {:10.0f} rows/sec {:6.1f}x".format(name, timeTaken * 1000, rowCount / timeTaken, zeepTime / timeTaken))
+
+@click.command()
+@click.option('--samples', '-s', help='Comma separated sample response files, relative to "samples/SOAP XML".', default=DEFAULT_SAMPLES)
+@click.option('--rows', '-r', help='The number of DataRows to replicate each sample to.', default=1000)
+@click.option('--repeat', '-n', help='The number of times to decode each response.', default=5)
+@click.option('--fields', '-f', help='The number of fields to request in the narrow raw decodes.', default=5)
+def main(samples, rows, repeat, fields):
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s.%(msecs)03d %(message)s', datefmt='%Y-%m-%d %H:%M:%S')
+    for sample in samples.split(","):
+        BenchmarkSample(os.path.join(SAMPLES_DIRECTORY, sample.strip()), rows, repeat, fields)
+
+def runMain():
+    main()
+
+if __name__ == "__main__":
+    runMain()
@@ -0,0 +1,10 @@
+import math
+
+# Latency statistics shared by the scripts that report tail latency, such as orderCreate.py, and by the benchmark suite.
+
+def Percentile(sortedValues, percent):
+    # Nearest-rank percentile of an already sorted list.
+    if not sortedValues:
+        return 0.0
+    rank = max(1, math.ceil(percent / 100.0 * len(sortedValues)))
+    return sortedValues[min(rank, len(sortedValues)) - 1]
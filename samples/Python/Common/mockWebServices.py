@@ -0,0 +1,644 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+from xml.sax.saxutils import escape
+from lxml import etree
+from datetime import date, datetime, timedelta
+import glob
+import itertools
+import logging
+import os
+import random
+import threading
+import time
+import uuid
+import zlib
+import click
+
+from standInWsdl import IRESS_NAMESPACE, INTEGER_PATTERN, BuildStandInWsdl, InferXsdType
+import wsdlCache
+from requestScheduler import TokenBucket
+
+# Local mock of the Web Services V4 endpoint, for load testing and benchmarking without touching production IRESS or
+# IOS+ servers. GETs to wsdl.aspx are answered with a cached WSDL that supports the requested methods, such as the ones
+# under samples/C#/iosplus-download/WebServices, or otherwise with a WSDL generated for them. POSTs are answered for
+# every operation described by those WSDLs, by the request/response pairs in samples/SOAP XML, or by EXPLICIT_OPERATIONS.
+#
+# Each response is built from the operation's DataRow fields. Values come from the sample response where there is one,
+# and are generated otherwise. Result sets are paged by the request's PageSize under its RequestID, with StatusCode 1
+# while there is more data and 2 at the end, or 3 when the request was made with Updates=true. ...Updates operations
+# long-poll a watching RequestID for up to its Timeout and return changed rows. Latency, and SOAP faults for a share of
+# the requests, can be injected. Calls over a throttle rate, and a share of the others, can be answered with HTTP 503
+# as a busy server would. A write repeated with the RequestID of one that completed is answered with the same response
+# rather than written again, so retried creates can be checked for duplicates. With a session lifetime, session keys
+# that are unknown, older than the lifetime or kicked by a later login of the same user are answered with a fault, as
+# a real server answers sessions that have ended.
+
+SOAP_ENVELOPE_NAMESPACE = "http://schemas.xmlsoap.org/soap/envelope/"
+WSDL_NAMESPACE = "http://schemas.xmlsoap.org/wsdl/"
+WSDL_SOAP_NAMESPACE = "http://schemas.xmlsoap.org/wsdl/soap/"
+XSD_NAMESPACE = "http://www.w3.org/2001/XMLSchema"
+XSI_NIL = "{http://www.w3.org/2001/XMLSchema-instance}nil"
+
+SAMPLES_DIRECTORY = os.path.join(os.path.dirname(os.path.realpath(__file__)), "..", "..", "SOAP XML")
+DEFAULT_WSDL_DIRECTORIES = [os.path.join(os.path.dirname(os.path.realpath(__file__)), "..", "..", "C#", "iosplus-download", "WebServices")]
+
+STATUS_MORE_DATA_AVAILABLE = 1
+STATUS_COMPLETE = 2
+STATUS_WATCHING_FOR_UPDATES = 3
+
+DEFAULT_PAGE_SIZE = 1000
+
+# Number fields and IDs that identify a row are numbered from here, so the rows of a result set are distinct
+KEY_BASE = 138084514
+
+SESSION_OPERATIONS = ["IRESSSessionStart", "ServiceSessionStart"]
+
+# Operations that return one DataRow per item of their request arrays, rather than a result set
+WRITE_OPERATION_WORDS = ["Create", "Delete", "Amend", "Cancel"]
+
+# The number of DataRows to return for each item of a request array, for operations where it is not rowsPerItem
+ROWS_PER_ITEM = { "PricingQuoteGet": 1, "SecurityInformationGet": 1 }
+
+SECURITY_CODES = ["BHP", "CBA", "NAB", "WBC", "ANZ", "CSL", "WES", "WOW", "RIO", "TLS", "MQG", "FMG", "WDS", "GMG", "TCL", "STO"]
+
+# Generated values for fields that need a realistic value, by field name. Called with the row index and a Random.
+FIELD_VALUES = {
+    "Exchange": lambda index, generator: "ASX",
+    "SecurityCode": lambda index, generator: SECURITY_CODES[index % len(SECURITY_CODES)],
+    "PortfolioCode": lambda index, generator: "P{:05d}".format(index),
+    "ErrorNumber": lambda index, generator: "0",
+    "ErrorMessage": lambda index, generator: "",
+    "ErrorDescription": lambda index, generator: "",
+    "AlertType": lambda index, generator: "Quote",
+    "AlertFieldNames": lambda index, generator: "Security;Last",
+    "AlertFieldOperators": lambda index, generator: "==;<=",
+    "AlertFieldValues": lambda index, generator: "{}.ASX;{:.3f}".format(SECURITY_CODES[index % len(SECURITY_CODES)], generator.uniform(1, 100)),
+    "AlertMemo": lambda index, generator: "PortfolioCode - P{:05d}".format(index),
+}
+
+# Operations the scripts use that have neither a sample nor a cached WSDL, in the format of standInWsdl.py
+EXPLICIT_OPERATIONS = {
+    "IRESSSessionStart": {
+        "SessionKeyField": "SessionKey",
+        "Parameters": [("UserName", "xsd:string", None), ("CompanyName", "xsd:string", None), ("Password", "xsd:string", None), ("ApplicationID", "xsd:string", None), ("ApplicationLabel", "xsd:string", None), ("PreviousSessionKey", "xsd:string", None), ("SessionTimeout", "xsd:int", None), ("AuthenticationType", "xsd:string", None), ("SessionNumberToKick", "xsd:int", None), ("KickLikeSessions", "xsd:boolean", None), ("Locale", "xsd:string", None), ("LocalePrivateUseSubtags", "xsd:string", None)],
+        "DataRow": [("IRESSSessionKey", "xsd:string"), ("UserToken", "xsd:string"), ("LastLoggedInDateTime", "xsd:dateTime"), ("PasswordExpiryDays", "xsd:int")],
+    },
+    "ServiceSessionStart": {
+        "SessionKeyField": "ServiceSessionKey",
+        "Parameters": [("IRESSSessionKey", "xsd:string", None), ("Service", "xsd:string", None), ("Server", "xsd:string", None), ("AllowSessionToEndOnAccessChanges", "xsd:boolean", None)],
+        "DataRow": [("ServiceSessionKey", "xsd:string")],
+    },
+    "OrderCreate3": {
+        "SessionKeyField": "ServiceSessionKey",
+        "Parameters": [("ParentOrderNumberArray", "xsd:long", "ParentOrderNumber"), ("SideCodeArray", "xsd:string", "SideCode"), ("AccountCodeArray", "xsd:string", "AccountCode"), ("SecurityCodeArray", "xsd:string", "SecurityCode"), ("ExchangeArray", "xsd:string", "Exchange"), ("DestinationArray", "xsd:string", "Destination"), ("OrderMatchIDArray", "xsd:string", "OrderMatchID"), ("OrderVolumeArray", "xsd:double", "OrderVolume"), ("OrderPriceArray", "xsd:double", "OrderPrice"), ("PricingInstructionsArray", "xsd:string", "PricingInstructions"), ("LifetimeArray", "xsd:string", "Lifetime"), ("ExpiryDateTimeArray", "xsd:dateTime", "ExpiryDateTime"), ("ExecutionInstructionsArray", "xsd:string", "ExecutionInstructions"), ("WorkArray", "xsd:boolean", "Work"), ("AcknowledgeOrderArray", "xsd:boolean", "AcknowledgeOrder"), ("CurrencyArray", "xsd:string", "Currency"), ("SubDestinationArray", "xsd:string", "SubDestination"), ("PrimaryClientOrderIDArray", "xsd:string", "PrimaryClientOrderID"), ("SecondaryClientOrderIDArray", "xsd:string", "SecondaryClientOrderID"), ("OrderGroupArray", "xsd:string", "OrderGroup"), ("OrderDetailsArray", "xsd:string", "OrderDetails"), ("CustomColumnsArray", "xsd:string", "CustomColumns"), ("OrderGiverArray", "xsd:string", "OrderGiver"), ("OrderTakerArray", "xsd:string", "OrderTaker"), ("IgnoreLimitWarningsArray", "xsd:boolean", "IgnoreLimitWarnings"), ("TrailerCodeOnMaskArray", "xsd:string", "TrailerCodeOnMask"), ("OrderTagArray", "xsd:string", "OrderTag"), ("UseDefaultOrderAttributesArray", "xsd:boolean", "UseDefaultOrderAttributes"), ("BasketNameArray", "xsd:string", "BasketName"), ("IsLegArray", "xsd:boolean", "IsLeg"), ("TradingPassword", "xsd:string", None)],
+        "DataRow": [("OrderNumber", "xsd:long"), ("ErrorNumber", "xsd:int"), ("ErrorMessage", "xsd:string"), ("OrderValidationNumber", "xsd:int"), ("BreachAction", "xsd:int"), ("BreachMessage", "xsd:string"), ("ExecutionInstructions", "xsd:string"), ("ExecutionInstructionsDictionary", "tns:IRESSDictionary"), ("CustomColumns", "xsd:string"), ("CustomColumnsDictionary", "tns:IRESSDictionary"), ("ExtraDetails", "xsd:string")],
+    },
+    "AlertCreate": {
+        "SessionKeyField": "SessionKey",
+        "Parameters": [("AlertTypeArray", "xsd:string", "AlertType"), ("AlertFieldNamesArray", "xsd:string", "AlertFieldNames"), ("AlertFieldOperatorsArray", "xsd:string", "AlertFieldOperators"), ("AlertFieldValuesArray", "xsd:string", "AlertFieldValues"), ("ReactivateTimeArray", "xsd:int", "ReactivateTime"), ("AlertMemoArray", "xsd:string", "AlertMemo"), ("UseMessageManagerNotificationsArray", "xsd:boolean", "UseMessageManagerNotifications")],
+        "DataRow": [("AlertID", "xsd:long"), ("ErrorNumber", "xsd:int"), ("ErrorDescription", "xsd:string")],
+    },
+    "AlertGet": {
+        "SessionKeyField": "SessionKey",
+        "Parameters": [],
+        "DataRow": [("AlertID", "xsd:long"), ("AlertType", "xsd:string"), ("AlertFieldNames", "xsd:string"), ("AlertFieldOperators", "xsd:string"), ("AlertFieldValues", "xsd:string"), ("AlertMemo", "xsd:string")],
+    },
+    "AlertDelete": {
+        "SessionKeyField": "SessionKey",
+        "Parameters": [("AlertIDArray", "xsd:long", "AlertID")],
+        "DataRow": [("AlertID", "xsd:long"), ("ErrorNumber", "xsd:int"), ("ErrorDescription", "xsd:string")],
+    },
+    "PortfolioGet": {
+        "SessionKeyField": "ServiceSessionKey",
+        "Parameters": [("AccessMode", "xsd:int", None), ("FilterBy", "xsd:int", None), ("FilterMode", "xsd:int", None), ("FilterText", "xsd:string", None), ("IncludeInactive", "xsd:boolean", None)],
+        "DataRow": [("PortfolioCode", "xsd:string"), ("PortfolioName", "xsd:string"), ("AccountCode", "xsd:string")],
+    },
+    "PortfolioPositionDetailGet": {
+        "SessionKeyField": "ServiceSessionKey",
+        "Parameters": [("AccessMode", "xsd:int", None), ("PortfolioCodeArray", "xsd:string", "PortfolioCode"), ("IncludePositionsFromPortfoliosWithSameCashAccountArray", "xsd:boolean", "IncludePositionsFromPortfoliosWithSameCashAccount")],
+        "DataRow": [("PortfolioCode", "xsd:string"), ("SecurityCode", "xsd:string"), ("Exchange", "xsd:string"), ("AveragePriceStartOfDay", "xsd:double"), ("VolumeStartOfDay", "xsd:double"), ("ActualValue", "xsd:double")],
+    },
+    "IPSUploadErrorGet1": {
+        "SessionKeyField": "ServiceSessionKey",
+        "Parameters": [("UploadRunID", "xsd:long", None)],
+        "DataRow": [("LineNumber", "xsd:int"), ("ErrorMessage", "xsd:string")],
+    },
+}
+
+def LocalName(element):
+    return etree.QName(element).localname
+
+def IressElement(name):
+    return "{%s}%s" % (IRESS_NAMESPACE, name)
+
+def IsKeyField(fieldName):
+    return fieldName.endswith(("Number", "ID")) and "Error" not in fieldName
+
+def IsSupportedType(fieldType):
+    return bool(fieldType) and (fieldType.startswith("xsd:") or fieldType == "tns:IRESSDictionary")
+
+def ReadSample(fileName):
+    # Some samples carry merge conflict markers, which are skipped, or trailing characters after the envelope, which
+    # recovery parsing copes with.
+    with open(fileName, "rb") as sampleFile:
+        content = sampleFile.read()
+    if b"<<<<<<<" in content:
+        return None
+    return etree.fromstring(content, etree.XMLParser(recover=True, remove_blank_text=True))
+
+def ReadOperationsFromSamples(samplesDirectory):
+    # Return the operation definitions and sample DataRows, as dicts of field name to text, from the request/response
+    # pairs in samplesDirectory.
+    operations = {}
+    sampleRows = {}
+    for requestFileName in sorted(glob.glob(os.path.join(samplesDirectory, "*", "*_[Rr]equest.xml"))):
+        requestEnvelope = ReadSample(requestFileName)
+        responseFileName = requestFileName.replace("_request.xml", "_response.xml").replace("_Request.xml", "_Response.xml")
+        responseEnvelope = ReadSample(responseFileName) if os.path.isfile(responseFileName) else None
+        if requestEnvelope is None or responseEnvelope is None:
+            continue
+
+        operationElement = requestEnvelope.find("{%s}Body" % SOAP_ENVELOPE_NAMESPACE)[0]
+        operationName = LocalName(operationElement)
+        headerElement = operationElement.find("{0}Input/{0}Header".format("{%s}" % IRESS_NAMESPACE))
+        parametersElement = operationElement.find("{0}Input/{0}Parameters".format("{%s}" % IRESS_NAMESPACE))
+        if operationName in operations or headerElement is None or parametersElement is None:
+            continue
+
+        parameters = []
+        for parameterElement in parametersElement:
+            if not isinstance(parameterElement.tag, str) or not LocalName(parameterElement).isidentifier():
+                continue
+            parameterName = LocalName(parameterElement)
+            if parameterName.endswith("Array"):
+                itemElements = [itemElement for itemElement in parameterElement if isinstance(itemElement.tag, str)]
+                itemName = LocalName(itemElements[0]) if itemElements else parameterName[:-len("Array")]
+                parameters.append((parameterName, InferXsdType(itemElements[0].text) if itemElements else "xsd:string", itemName))
+            elif len(parameterElement) == 0:
+                parameters.append((parameterName, "xsd:string" if parameterElement.get(XSI_NIL) == "true" else InferXsdType(parameterElement.text), None))
+
+        dataRowFields = []
+        rows = []
+        for dataRowElement in responseEnvelope.iter(IressElement("DataRow")):
+            fieldElements = [fieldElement for fieldElement in dataRowElement if isinstance(fieldElement.tag, str) and len(fieldElement) == 0 and LocalName(fieldElement).isidentifier()]
+            if not dataRowFields:
+                dataRowFields = [(LocalName(fieldElement), InferXsdType(fieldElement.text)) for fieldElement in fieldElements]
+            rows.append({ LocalName(fieldElement): fieldElement.text or "" for fieldElement in fieldElements })
+
+        operations[operationName] = { "SessionKeyField": LocalName(headerElement[0]), "Parameters": parameters, "DataRow": dataRowFields }
+        sampleRows[operationName] = rows
+    return operations, sampleRows
+
+def ReadOperationsFromWsdl(wsdlFileName):
+    # Return the operation definitions described by a WSDL generated by wsdl.aspx
+    wsdlRoot = etree.parse(wsdlFileName).getroot()
+    complexTypes = { complexType.get("name"): complexType for complexType in wsdlRoot.iter("{%s}complexType" % XSD_NAMESPACE) if complexType.get("name") }
+    sequenceElements = "{0}sequence/{0}element".format("{%s}" % XSD_NAMESPACE)
+
+    operations = {}
+    for operationElement in wsdlRoot.iterfind("{0}portType/{0}operation".format("{%s}" % WSDL_NAMESPACE)):
+        operationName = operationElement.get("name")
+        headerType = complexTypes.get(operationName + "InputHeader")
+        parametersType = complexTypes.get(operationName + "InputParameters")
+        dataRowType = complexTypes.get(operationName + "DataRow")
+        if headerType is None or parametersType is None or dataRowType is None:
+            continue
+
+        parameters = []
+        for parameterElement in parametersType.iterfind(sequenceElements):
+            itemElement = parameterElement.find("{0}complexType/{0}sequence/{0}element".format("{%s}" % XSD_NAMESPACE))
+            if itemElement is not None:
+                parameters.append((parameterElement.get("name"), itemElement.get("type") if IsSupportedType(itemElement.get("type")) else "xsd:string", itemElement.get("name")))
+            elif parameterElement.get("name"):
+                parameters.append((parameterElement.get("name"), parameterElement.get("type") if IsSupportedType(parameterElement.get("type")) else "xsd:string", None))
+
+        dataRowFields = [(fieldElement.get("name"), fieldElement.get("type")) for fieldElement in dataRowType.iterfind(sequenceElements) if IsSupportedType(fieldElement.get("type"))]
+        operations[operationName] = { "SessionKeyField": headerType.find(sequenceElements).get("name"), "Parameters": parameters, "DataRow": dataRowFields }
+    return operations
+
+def FormatValue(value):
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
+
+def BuildResponse(operationName, requestId, statusCode, rows):
+    soapElement = "{%s}%%s" % SOAP_ENVELOPE_NAMESPACE
+    envelope = etree.Element(soapElement % "Envelope", nsmap={ "soap": SOAP_ENVELOPE_NAMESPACE })
+    responseElement = etree.SubElement(etree.SubElement(envelope, soapElement % "Body"), IressElement(operationName + "Response"), nsmap={ None: IRESS_NAMESPACE })
+    resultElement = etree.SubElement(etree.SubElement(responseElement, IressElement("Output")), IressElement("Result"))
+    headerElement = etree.SubElement(resultElement, IressElement("Header"))
+    etree.SubElement(headerElement, IressElement("RequestID")).text = requestId
+    etree.SubElement(headerElement, IressElement("StatusCode")).text = str(statusCode)
+    etree.SubElement(headerElement, IressElement("WebServiceTimeStamp")).text = datetime.now().replace(microsecond=0).isoformat()
+    etree.SubElement(headerElement, IressElement("PagingBookmark"))
+    etree.SubElement(resultElement, IressElement("HeaderRow"))
+    dataRowsElement = etree.SubElement(resultElement, IressElement("DataRows"))
+    for row in rows:
+        dataRowElement = etree.SubElement(dataRowsElement, IressElement("DataRow"))
+        for fieldName, value in row:
+            etree.SubElement(dataRowElement, IressElement(fieldName)).text = value
+    etree.SubElement(resultElement, IressElement("ErrorRows"))
+    return etree.tostring(envelope, xml_declaration=True, encoding="utf-8")
+
+def BuildFault(faultString):
+    return '<?xml version="1.0" encoding="utf-8"?><soap:Envelope xmlns:soap="{}"><soap:Body><soap:Fault><faultcode>soap:Server</faultcode><faultstring>{}</faultstring></soap:Fault></soap:Body></soap:Envelope>'.format(SOAP_ENVELOPE_NAMESPACE, escape(faultString)).encode("utf-8")
+
+class MockRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True # The headers and body are written separately, which would otherwise add a delayed ACK
+
+    def log_message(self, format, *args):
+        logging.debug("Mock server: " + format % args)
+
+    def sendBody(self, statusCode, body):
+        self.send_response(statusCode)
+        self.send_header("Content-Type", "text/xml; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        query = parse_qs(urlparse(self.path).query)
+        address = "http://{}:{}/v4/soap.aspx".format(*self.server.server_address[:2])
+        self.sendBody(200, self.server.buildWsdl(query.get("svc", ["IRESS"])[0], query.get("mf", [""])[0], address))
+
+    def do_POST(self):
+        requestEnvelope = etree.fromstring(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+        operationElement = requestEnvelope.find("{%s}Body" % SOAP_ENVELOPE_NAMESPACE)[0]
+        statusCode, body = self.server.answerOperation(LocalName(operationElement), operationElement)
+        self.sendBody(statusCode, body)
+
+class MockServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, serverAddress, latency=0.0, jitter=0.0, errorRate=0.0, errorOperations=None, busyRate=0.0, throttleRate=0.0, sessionLifetime=0.0, rowCount=100, rowsPerItem=5, updateInterval=1.0, updateRows=1, ipsRunTime=1.0, ipsErrorEvery=0, seed=1, samplesDirectory=SAMPLES_DIRECTORY, wsdlDirectories=DEFAULT_WSDL_DIRECTORIES):
+        ThreadingHTTPServer.__init__(self, serverAddress, MockRequestHandler)
+        self.latency = latency
+        self.jitter = jitter
+        self.errorRate = errorRate
+        self.errorOperations = errorOperations
+        self.busyRate = busyRate
+        self.throttleBucket = TokenBucket(throttleRate) if throttleRate > 0 else None
+        self.sessionLifetime = sessionLifetime
+        self.rowCount = rowCount
+        self.rowsPerItem = rowsPerItem
+        self.updateInterval = updateInterval
+        self.updateRows = updateRows
+        self.ipsRunTime = ipsRunTime
+        self.ipsErrorEvery = ipsErrorEvery
+        self.random = random.Random(seed)
+        self.wsdlDirectories = [wsdlDirectory for wsdlDirectory in wsdlDirectories if os.path.isdir(wsdlDirectory)]
+
+        # Definitions from the cached WSDLs take precedence over the ones inferred from the samples
+        self.operations, self.sampleRows = ReadOperationsFromSamples(samplesDirectory)
+        for wsdlDirectory in self.wsdlDirectories:
+            for wsdlFileName in sorted(glob.glob(os.path.join(wsdlDirectory, "*.wsdl"))):
+                self.operations.update(ReadOperationsFromWsdl(wsdlFileName))
+        self.operations.update(EXPLICIT_OPERATIONS)
+
+        self.lock = threading.Lock()
+        self.keyNumbers = itertools.count(KEY_BASE)
+        self.resultSets = {}
+        self.writeResponses = {}
+        self.sessions = {}
+        self.uploads = {}
+        self.cachedWsdls = {}
+        self.handlers = {
+            "IRESSSessionStart": self.answerSessionStart,
+            "ServiceSessionStart": self.answerSessionStart,
+            "IPSUploadCreate1": self.answerUploadCreate,
+            "IPSUploadDataSet1": self.answerUploadDataSet,
+            "IPSUploadRun1": self.answerUploadRun,
+            "IPSUploadSummaryGet2": self.answerUploadSummaryGet,
+            "IPSUploadErrorGet1": self.answerUploadErrorGet,
+            "TimeSeriesGet2": self.answerTimeSeriesGet,
+            "SecurityInformationGet": self.answerSecurityInformationGet,
+        }
+
+    def buildWsdl(self, service, methodList, address):
+        # Serve a cached WSDL that supports every requested method, pointed at this server, or generate one
+        if methodList.strip():
+            for wsdlDirectory in self.wsdlDirectories:
+                wsdlFileName = wsdlCache.FindOfflineWsdl(wsdlDirectory, methodList)
+                if wsdlFileName:
+                    with self.lock:
+                        if (wsdlFileName, address) not in self.cachedWsdls:
+                            wsdlRoot = etree.parse(wsdlFileName).getroot()
+                            for addressElement in wsdlRoot.iter("{%s}address" % WSDL_SOAP_NAMESPACE):
+                                addressElement.set("location", address)
+                            self.cachedWsdls[(wsdlFileName, address)] = etree.tostring(wsdlRoot, xml_declaration=True, encoding="utf-8")
+                        return self.cachedWsdls[(wsdlFileName, address)]
+
+        methods = SESSION_OPERATIONS + [method.strip() for method in methodList.split(",") if method.strip()]
+        if not methodList.strip():
+            methods = list(self.operations)
+        operations = { method: self.operations[method] for method in methods if method in self.operations }
+        return BuildStandInWsdl(address, operations, service.upper()).encode("utf-8")
+
+    def nextKeyNumber(self):
+        with self.lock:
+            return next(self.keyNumbers)
+
+    def buildRow(self, operationName, index, overrides):
+        # Return the row as (field name, text) pairs in the order of the operation's DataRow
+        sampleRows = self.sampleRows.get(operationName)
+        sampleRow = sampleRows[index % len(sampleRows)] if sampleRows else {}
+        row = []
+        for fieldName, fieldType in self.operations[operationName]["DataRow"]:
+            if fieldName in overrides:
+                value = overrides[fieldName]
+            elif fieldName in sampleRow:
+                value = sampleRow[fieldName]
+                if IsKeyField(fieldName) and INTEGER_PATTERN.match(value):
+                    value = str(int(value) + index)
+            elif fieldName in FIELD_VALUES:
+                value = FIELD_VALUES[fieldName](index, self.random)
+            else:
+                value = self.generateValue(fieldName, fieldType, index)
+            if value is not None:
+                row.append((fieldName, value))
+        return row
+
+    def generateValue(self, fieldName, fieldType, index):
+        if fieldType in ("xsd:long", "xsd:int"):
+            return str(KEY_BASE + index) if IsKeyField(fieldName) else str(self.random.randint(0, 1000))
+        if fieldType in ("xsd:double", "xsd:decimal"):
+            value = round(self.random.uniform(1, 10000), 2)
+            return str(-value if "Volume" in fieldName and index % 2 else value)
+        if fieldType == "xsd:boolean":
+            return "false"
+        if fieldType == "xsd:dateTime":
+            return datetime.now().replace(microsecond=0).isoformat()
+        if fieldType == "xsd:string":
+            return "{}{}".format(fieldName, index)
+        return None
+
+    def buildResultSet(self, operationName, parameters):
+        # A result set of rowCount rows, or rowsPerItem rows for each item of the request arrays whose items are also
+        # DataRow fields, such as PortfolioCodeArray for PortfolioPositionDetailGet.
+        dataRowFields = set(fieldName for fieldName, fieldType in self.operations[operationName]["DataRow"])
+        itemArrays = { itemName: parameters.get(parameterName) or [] for parameterName, parameterType, itemName in self.operations[operationName]["Parameters"] if itemName in dataRowFields and isinstance(parameters.get(parameterName), list) }
+        if not itemArrays or not any(itemArrays.values()):
+            return [self.buildRow(operationName, index, {}) for index in range(self.rowCount)]
+
+        rowsPerItem = ROWS_PER_ITEM.get(operationName, self.rowsPerItem)
+        rows = []
+        for itemIndex in range(max(len(items) for items in itemArrays.values())):
+            overrides = { itemName: items[itemIndex] for itemName, items in itemArrays.items() if itemIndex < len(items) }
+            for _ in range(rowsPerItem):
+                rows.append(self.buildRow(operationName, len(rows), overrides))
+        return rows
+
+    def buildWriteRows(self, operationName, parameters):
+        # One row per item of the request arrays, echoing the items whose names are DataRow fields and giving every
+        # other key field, such as OrderNumber or AlertID, a new number.
+        dataRowFields = self.operations[operationName]["DataRow"]
+        arrays = { itemName: parameters.get(parameterName) or [] for parameterName, parameterType, itemName in self.operations[operationName]["Parameters"] if itemName and isinstance(parameters.get(parameterName), list) }
+        rows = []
+        for itemIndex in range(max([len(items) for items in arrays.values()] + [1])):
+            overrides = { itemName: items[itemIndex] for itemName, items in arrays.items() if itemIndex < len(items) }
+            for fieldName, fieldType in dataRowFields:
+                if IsKeyField(fieldName) and fieldName not in overrides and fieldType in ("xsd:long", "xsd:int"):
+                    overrides[fieldName] = str(self.nextKeyNumber())
+            rows.append(self.buildRow(operationName, itemIndex, overrides))
+        return rows
+
+    def answerSessionStart(self, operationName, header, parameters):
+        sessionKey = "{}@MOCK".format(uuid.uuid4()).upper()
+        row = self.buildRow(operationName, 0, { "IRESSSessionKey": sessionKey, "ServiceSessionKey": sessionKey })
+        with self.lock:
+            if operationName == "IRESSSessionStart":
+                userName = "{}@{}".format(parameters.get("UserName"), parameters.get("CompanyName")).upper()
+                if parameters.get("KickLikeSessions") == "true":
+                    self.sessions = { key: session for key, session in self.sessions.items() if session[1] != userName }
+            else:
+                userName = self.sessions.get(parameters.get("IRESSSessionKey"), (None, None))[1]
+            self.sessions[sessionKey] = (time.time(), userName)
+        return [row]
+
+    def expireSessions(self):
+        # End every session, as a server restart would
+        with self.lock:
+            self.sessions.clear()
+
+    def checkSessionKey(self, operationName, header):
+        sessionKeyField = self.operations.get(operationName, {}).get("SessionKeyField")
+        sessionKey = header.get(sessionKeyField) if sessionKeyField else None
+        if not sessionKey:
+            return
+        with self.lock:
+            session = self.sessions.get(sessionKey)
+        if session is None or time.time() - session[0] > self.sessionLifetime:
+            raise Exception("Session key {} is invalid or has expired".format(sessionKey))
+
+    def answerUploadCreate(self, operationName, header, parameters):
+        uploadId = self.nextKeyNumber()
+        with self.lock:
+            self.uploads[str(uploadId)] = { "TotalRows": 0, "RunStartTime": None, "UploadRunID": None, "Parameters": parameters }
+        return [[("UploadID", str(uploadId))]]
+
+    def answerUploadDataSet(self, operationName, header, parameters):
+        with self.lock:
+            upload = self.uploads[parameters.get("UploadID")]
+            upload["TotalRows"] = upload["TotalRows"] + len(parameters.get("UploadTextArray") or [])
+            return [[("TotalRows", str(upload["TotalRows"]))]]
+
+    def answerUploadRun(self, operationName, header, parameters):
+        uploadRunId = self.nextKeyNumber()
+        with self.lock:
+            upload = self.uploads[parameters.get("UploadID")]
+            upload["RunStartTime"] = time.time()
+            upload["UploadRunID"] = str(uploadRunId)
+        return []
+
+    def uploadErrorCount(self, upload):
+        return upload["TotalRows"] // self.ipsErrorEvery if self.ipsErrorEvery else 0
+
+    def answerUploadSummaryGet(self, operationName, header, parameters):
+        with self.lock:
+            upload = self.uploads.get(parameters.get("UploadID"))
+            if upload is None:
+                return []
+            running = upload["RunStartTime"] is not None and time.time() - upload["RunStartTime"] < self.ipsRunTime
+            uploadStatus = "Running" if running else ("Complete" if upload["RunStartTime"] is not None else "Uploaded")
+            overrides = { "UploadID": parameters.get("UploadID"), "UploadName": upload["Parameters"].get("UploadName") or "", "FileType": upload["Parameters"].get("FileType") or "", "FileLineCount": str(upload["TotalRows"]), "UploadStatus": uploadStatus, "RunCount": "1" if upload["RunStartTime"] is not None else "0", "LastRunErrorCount": str(self.uploadErrorCount(upload)), "LastRunLineCount": str(upload["TotalRows"]), "LastRunUploadRunID": upload["UploadRunID"] or "0" }
+        return [self.buildRow(operationName, 0, overrides)]
+
+    def answerUploadErrorGet(self, operationName, header, parameters):
+        with self.lock:
+            upload = next((upload for upload in self.uploads.values() if upload["UploadRunID"] == parameters.get("UploadRunID")), None)
+            if upload is None or not self.ipsErrorEvery:
+                return []
+            errorLineNumbers = range(self.ipsErrorEvery, upload["TotalRows"] + 1, self.ipsErrorEvery)
+        return [[("LineNumber", str(lineNumber)), ("ErrorMessage", "Mock error for line {}".format(lineNumber))] for lineNumber in errorLineNumbers]
+
+    def answerTimeSeriesGet(self, operationName, header, parameters):
+        # One row per weekday of the requested range. Each day's values are seeded by the security and date, so the
+        # same day has the same values however the range is requested.
+        securityCode = parameters.get("SecurityCode") or ""
+        exchange = parameters.get("Exchange") or ""
+        timeSeriesDate = date.fromisoformat((parameters.get("TimeSeriesFromDate") or date.today().isoformat())[:10])
+        toDate = date.fromisoformat((parameters.get("TimeSeriesToDate") or date.today().isoformat())[:10])
+        rows = []
+        while timeSeriesDate <= toDate:
+            if timeSeriesDate.weekday() < 5:
+                generator = random.Random("{}.{}.{}".format(securityCode, exchange, timeSeriesDate.isoformat()))
+                openPrice = round(generator.uniform(1, 100), 2)
+                closePrice = round(openPrice * generator.uniform(0.95, 1.05), 2)
+                totalVolume = generator.randint(1000, 10000000)
+                overrides = { "TimeSeriesDate": timeSeriesDate.isoformat(), "OpenPrice": str(openPrice), "HighPrice": str(round(max(openPrice, closePrice) * generator.uniform(1, 1.02), 2)), "LowPrice": str(round(min(openPrice, closePrice) * generator.uniform(0.98, 1), 2)), "ClosePrice": str(closePrice), "TotalVolume": str(totalVolume), "TotalValue": str(round(totalVolume * (openPrice + closePrice) / 2, 2)), "TradeCount": str(totalVolume // 200), "MarketVWAP": str(round((openPrice + closePrice) / 2, 4)) }
+                rows.append(self.buildRow(operationName, len(rows), overrides))
+            timeSeriesDate = timeSeriesDate + timedelta(days=1)
+        return rows
+
+    def answerSecurityInformationGet(self, operationName, header, parameters):
+        # One row per requested security, from SecurityCodeArray and ExchangeArray or "SecurityCode.Exchange" items of
+        # SecurityTextArray. The ISIN and SEDOL are derived from the code and exchange, so they are the same on every
+        # call. Codes starting with "UNKNOWN" get an ErrorNumber, like codes the server does not know.
+        securities = list(zip(parameters.get("SecurityCodeArray") or [], parameters.get("ExchangeArray") or []))
+        securities.extend(securityText.rpartition(".")[::2] for securityText in parameters.get("SecurityTextArray") or [])
+        rows = []
+        for securityCode, exchange in securities:
+            if securityCode.upper().startswith("UNKNOWN"):
+                rows.append([("ErrorNumber", "1"), ("ErrorDescription", "Security {}.{} not found".format(securityCode, exchange)), ("SecurityCode", securityCode), ("Exchange", exchange)])
+                continue
+            checksum = zlib.crc32("{}.{}".format(securityCode, exchange).upper().encode())
+            overrides = { "SecurityCode": securityCode, "Exchange": exchange, "ISIN": "AU{:09d}0".format(checksum % 1000000000), "SEDOL": "{:07d}".format(checksum % 10000000), "SecurityDescription": "{} Mock Security".format(securityCode) }
+            rows.append(self.buildRow(operationName, len(rows), overrides))
+        return rows
+
+    def answerUpdates(self, operationName, header, requestId):
+        # Long-poll a RequestID that is watching for updates, returning changed rows from its result set
+        with self.lock:
+            resultSet = self.resultSets.get(requestId)
+        if resultSet is None or not resultSet["Watching"]:
+            raise Exception("RequestID {} is not watching for updates".format(requestId))
+
+        time.sleep(min(int(header.get("Timeout") or 25), self.updateInterval))
+        baseOperationName = resultSet["Operation"]
+        changeableFields = [(fieldName, fieldType) for fieldName, fieldType in self.operations[baseOperationName]["DataRow"] if fieldType in ("xsd:double", "xsd:long", "xsd:int") and not IsKeyField(fieldName)]
+        with self.lock:
+            rows = resultSet["Rows"]
+            changedRows = []
+            for _ in range(min(self.updateRows, len(rows))):
+                rowIndex = self.random.randrange(len(rows))
+                if changeableFields:
+                    changedField, changedType = changeableFields[self.random.randrange(len(changeableFields))]
+                    changedValue = str(round(self.random.uniform(1, 10000), 2)) if changedType == "xsd:double" else str(self.random.randint(1, 10000))
+                    rows[rowIndex] = [(fieldName, changedValue if fieldName == changedField else value) for fieldName, value in rows[rowIndex]]
+                changedRows.append(rows[rowIndex])
+        return BuildResponse(operationName, requestId, STATUS_WATCHING_FOR_UPDATES, changedRows)
+
+    def answerOperation(self, operationName, operationElement):
+        # Return the HTTP status and body for a call
+        if operationName not in SESSION_OPERATIONS:
+            if self.throttleBucket is not None and not self.throttleBucket.tryAcquire():
+                return 503, b"Server busy, too many requests"
+            if self.busyRate > 0 and self.random.random() < self.busyRate:
+                return 503, b"Server busy"
+
+        if self.latency > 0 or self.jitter > 0:
+            time.sleep(self.latency + self.random.uniform(0, self.jitter))
+
+        headerElement = operationElement.find("{0}Input/{0}Header".format("{%s}" % IRESS_NAMESPACE))
+        parametersElement = operationElement.find("{0}Input/{0}Parameters".format("{%s}" % IRESS_NAMESPACE))
+        header = { LocalName(element): element.text for element in (headerElement if headerElement is not None else []) if isinstance(element.tag, str) }
+        parameters = {}
+        for element in (parametersElement if parametersElement is not None else []):
+            if isinstance(element.tag, str):
+                parameters[LocalName(element)] = [itemElement.text or "" for itemElement in element if isinstance(itemElement.tag, str)] if len(element) or LocalName(element).endswith("Array") else element.text
+        requestId = header.get("RequestID") or str(uuid.uuid4())
+
+        try:
+            if operationName not in SESSION_OPERATIONS and self.sessionLifetime > 0:
+                self.checkSessionKey(operationName, header)
+            if operationName not in SESSION_OPERATIONS and self.errorRate > 0 and (self.errorOperations is None or operationName in self.errorOperations) and self.random.random() < self.errorRate:
+                raise Exception("Mock error injected for {}".format(operationName))
+            if operationName.endswith("Updates") and operationName not in self.handlers:
+                return 200, self.answerUpdates(operationName, header, requestId)
+            if operationName not in self.operations:
+                raise Exception("Operation {} is not supported by the mock server".format(operationName))
+            return 200, self.answerPage(operationName, header, parameters, requestId)
+        except Exception as ex:
+            return 500, BuildFault(str(ex))
+
+    def answerPage(self, operationName, header, parameters, requestId):
+        # Answer the next page of the RequestID's result set, building the result set on its first page
+        isWrite = any(word in operationName for word in WRITE_OPERATION_WORDS)
+        with self.lock:
+            if isWrite and (requestId, operationName) in self.writeResponses:
+                return self.writeResponses[(requestId, operationName)]
+            resultSet = self.resultSets.get(requestId)
+        if resultSet is None or resultSet["Operation"] != operationName or resultSet["Watching"]:
+            if operationName in self.handlers:
+                rows = self.handlers[operationName](operationName, header, parameters)
+            elif isWrite:
+                rows = self.buildWriteRows(operationName, parameters)
+            else:
+                rows = self.buildResultSet(operationName, parameters)
+            resultSet = { "Operation": operationName, "Rows": rows, "Position": 0, "Updates": header.get("Updates") == "true", "Watching": False }
+
+        pageSize = int(header.get("PageSize") or 0) or DEFAULT_PAGE_SIZE
+        with self.lock:
+            page = resultSet["Rows"][resultSet["Position"]:resultSet["Position"] + pageSize]
+            resultSet["Position"] = resultSet["Position"] + len(page)
+            if resultSet["Position"] < len(resultSet["Rows"]):
+                statusCode = STATUS_MORE_DATA_AVAILABLE
+                self.resultSets[requestId] = resultSet
+            elif resultSet["Updates"]:
+                statusCode = STATUS_WATCHING_FOR_UPDATES
+                resultSet["Watching"] = True
+                self.resultSets[requestId] = resultSet
+            else:
+                statusCode = STATUS_COMPLETE
+                self.resultSets.pop(requestId, None)
+        response = BuildResponse(operationName, requestId, statusCode, page)
+        if isWrite and statusCode == STATUS_COMPLETE:
+            with self.lock:
+                self.writeResponses[(requestId, operationName)] = response
+        return response
+
+def StartMockServer(port=0, **settings):
+    # Start the mock server on a background thread and return it along with its WSDL endpoint. settings are passed to
+    # MockServer.
+    server = MockServer(("127.0.0.1", port), **settings)
+    serverThread = threading.Thread(target=server.serve_forever, daemon=True)
+    serverThread.start()
+    endpoint = "http://{}:{}/v4/wsdl.aspx".format(*server.server_address[:2])
+    return server, endpoint
+
+@click.command()
+@click.option('--port', '-p', help='The local port to listen on.', default=8080)
+@click.option('--latency', '-l', help='Artificial server latency to add to each response, in milliseconds.', default=0.0)
+@click.option('--jitter', '-j', help='Random extra latency of up to this many milliseconds to add to each response.', default=0.0)
+@click.option('--errorrate', help='The share of calls, from 0 to 1, to answer with a SOAP fault.', default=0.0)
+@click.option('--erroroperations', help='Comma separated operations to inject errors into. Defaults to all but the session starts.', default=None)
+@click.option('--busyrate', help='The share of calls, from 0 to 1, to answer with HTTP 503 as a busy server would.', default=0.0)
+@click.option('--throttlerate', help='The number of calls per second to allow before answering with HTTP 503, or 0 for no limit.', default=0.0)
+@click.option('--sessionlifetime', help='The number of seconds a session key stays valid, or 0 to accept any session key. Unknown, expired and kicked session keys are answered with a SOAP fault.', default=0.0)
+@click.option('--rows', '-r', help='The number of DataRows in each result set.', default=100)
+@click.option('--rowsperitem', help='The number of DataRows for each item of a request array, such as each portfolio code.', default=5)
+@click.option('--updateinterval', help='The number of seconds an ...Updates long-poll waits before returning changed rows.', default=1.0)
+@click.option('--updaterows', help='The number of changed rows each ...Updates long-poll returns.', default=1)
+@click.option('--ipsruntime', help='The number of seconds an IPS upload run takes.', default=1.0)
+@click.option('--ipserrorevery', help='Report an IPS upload error for every this many lines, or 0 for none.', default=0)
+@click.option('--seed', help='The seed for the generated values and injected errors.', default=1)
+@click.option('--wsdldirectory', '-w', multiple=True, help='A directory of cached WSDLs to serve. Defaults to the C# sample WSDLs.')
+def main(port, latency, jitter, errorrate, erroroperations, busyrate, throttlerate, sessionlifetime, rows, rowsperitem, updateinterval, updaterows, ipsruntime, ipserrorevery, seed, wsdldirectory):
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s.%(msecs)03d %(message)s', datefmt='%Y-%m-%d %H:%M:%S')
+    errorOperations = set(operation.strip() for operation in erroroperations.split(",")) if erroroperations else None
+    server, endpoint = StartMockServer(port, latency=latency / 1000, jitter=jitter / 1000, errorRate=errorrate, errorOperations=errorOperations, busyRate=busyrate, throttleRate=throttlerate, sessionLifetime=sessionlifetime, rowCount=rows, rowsPerItem=rowsperitem, updateInterval=updateinterval, updateRows=updaterows, ipsRunTime=ipsruntime, ipsErrorEvery=ipserrorevery, seed=seed, wsdlDirectories=list(wsdldirectory) or DEFAULT_WSDL_DIRECTORIES)
+    logging.info("Mock Web Services endpoint listening with {} operations. WSDL endpoint: {}".format(len(server.operations), endpoint))
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+def runMain():
+    main()
+
+if __name__ == "__main__":
+    runMain()
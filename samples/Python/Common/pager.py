@@ -0,0 +1,117 @@
+import queue
+import threading
+import uuid
+
+# Pages through Web Services methods that return their results over several responses. The request is repeated with
+# the same RequestID, and the PagingBookmark of the previous response, for as long as the result header's StatusCode
+# says more data is available. The pages are yielded lazily, so a large result never has to be held in memory at once.
+# With prefetch on, the next page is requested on a background thread while the caller processes the current one.
+#
+# requestPage is called with the paging fields for the request header (RequestID, PageSize and PagingBookmark) and
+# makes the call, for example:
+#
+#   for dataRow in pager.GetDataRows(lambda pagingHeader: client.service.AlertGet(factory.AlertGetInput(
+#           Header=factory.AlertGetInputHeader(SessionKey=sessionKey, **pagingHeader), Parameters=...))):
+#
+# The GetRaw... variants page through calls made with raw_response, such as through rawResponse.CallRaw. requestPage
+# returns the response content, and decodePage is called with the content and a dict to fill with the result header,
+# as the rawResponse decoders are. decodePage must decode the whole page before returning, for example into a list,
+# as the StatusCode and PagingBookmark are only in the dict once the content has been read past the header.
+
+DEFAULT_PAGE_SIZE = 1000
+
+# StatusCode in the result header while there are more pages to request
+STATUS_MORE_DATA_AVAILABLE = 1
+
+# Marks the end of the results handed over by the prefetch thread
+END_OF_RESULTS = object()
+
+def RequestResults(requestPage, pageSize):
+    pagingHeader = { "RequestID": str(uuid.uuid4()), "PageSize": pageSize, "PagingBookmark": None }
+    while True:
+        result = requestPage(dict(pagingHeader)).Result
+        yield result
+        if result.Header.StatusCode != STATUS_MORE_DATA_AVAILABLE:
+            return
+        pagingHeader["PagingBookmark"] = getattr(result.Header, "PagingBookmark", None)
+
+def RequestRawResults(requestPage, decodePage, pageSize, requestId=None):
+    pagingHeader = { "RequestID": requestId or str(uuid.uuid4()), "PageSize": pageSize, "PagingBookmark": None }
+    while True:
+        resultHeader = {}
+        page = decodePage(requestPage(dict(pagingHeader)), resultHeader)
+        yield resultHeader, page
+        if resultHeader.get("StatusCode") != STATUS_MORE_DATA_AVAILABLE:
+            return
+        # An empty bookmark is left out rather than sent as an empty element
+        pagingHeader["PagingBookmark"] = resultHeader.get("PagingBookmark") or None
+
+def PrefetchResults(results):
+    # Run the results generator on a background thread, requesting at most one page ahead of the caller. Errors raised
+    # while requesting a page are raised to the caller when it reaches that page.
+    resultQueue = queue.Queue()
+    resultTaken = threading.Semaphore(0)
+    stopped = threading.Event()
+
+    def WaitUntilTaken():
+        while not stopped.is_set():
+            if resultTaken.acquire(timeout=0.1):
+                return True
+        return False
+
+    def FetchResults():
+        try:
+            for result in results:
+                resultQueue.put((result, None))
+                if not WaitUntilTaken():
+                    return
+        except Exception as ex:
+            resultQueue.put((None, ex))
+            return
+        resultQueue.put((END_OF_RESULTS, None))
+
+    fetchThread = threading.Thread(target=FetchResults, daemon=True)
+    fetchThread.start()
+    try:
+        while True:
+            result, error = resultQueue.get()
+            if error is not None:
+                raise error
+            if result is END_OF_RESULTS:
+                return
+            resultTaken.release()
+            yield result
+    finally:
+        # Also stops the prefetch thread when the caller abandons the results part way through
+        stopped.set()
+
+def GetResults(requestPage, pageSize=DEFAULT_PAGE_SIZE, prefetch=True):
+    # Yield the Result of each response, including its header
+    results = RequestResults(requestPage, pageSize)
+    if prefetch:
+        return PrefetchResults(results)
+    return results
+
+def GetPages(requestPage, pageSize=DEFAULT_PAGE_SIZE, prefetch=True):
+    # Yield the DataRows of each response that has any, as a list
+    for result in GetResults(requestPage, pageSize, prefetch):
+        if result.DataRows:
+            yield result.DataRows.DataRow
+
+def GetDataRows(requestPage, pageSize=DEFAULT_PAGE_SIZE, prefetch=True):
+    # Yield the DataRows of every response one at a time
+    for dataRows in GetPages(requestPage, pageSize, prefetch):
+        yield from dataRows
+
+def GetRawResults(requestPage, decodePage, pageSize=DEFAULT_PAGE_SIZE, prefetch=True, requestId=None):
+    # Yield the result header and decoded page of each raw response, as (resultHeader, page). The request uses
+    # requestId when it is given, for requests whose RequestID is used again after paging, such as for updates.
+    results = RequestRawResults(requestPage, decodePage, pageSize, requestId)
+    if prefetch:
+        return PrefetchResults(results)
+    return results
+
+def GetRawPages(requestPage, decodePage, pageSize=DEFAULT_PAGE_SIZE, prefetch=True, requestId=None):
+    # Yield the decoded page of each raw response
+    for resultHeader, page in GetRawResults(requestPage, decodePage, pageSize, prefetch, requestId):
+        yield page
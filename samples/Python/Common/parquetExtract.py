@@ -0,0 +1,171 @@
+from datetime import date, datetime
+import json
+import os
+import threading
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+import pager
+import rawResponse
+
+# Extracts of paged result sets to Parquet files, for backfills too large to hold in memory. The Arrow schema of an
+# operation is built from its DataRow type in the WSDL, so every file for an operation has the same columns whichever
+# fields a page happens to contain. Pages are decoded by the raw response decoder, rowBatchSize rows at a time, and
+# written as row groups of up to rowGroupSize rows, so the memory an extract takes is bounded by those and not by the
+# size of the result set.
+#
+# A file is written under a temporary name and only given its final name once the whole result set is in it. An
+# ExtractCheckpoint records the files that are complete, so that a rerun skips them. A result set cannot be resumed
+# part way through, as its RequestID does not outlive the run, so an interrupted file is extracted again from the
+# start.
+
+DEFAULT_ROW_BATCH_SIZE = 10000
+DEFAULT_ROW_GROUP_SIZE = 100000
+
+XSD_NAMESPACE = "http://www.w3.org/2001/XMLSchema"
+IRESS_NAMESPACE = "http://webservices.iress.com.au/v4/"
+
+def ParseWallClockDateTime(text):
+    # Date times are kept as the wall clock time the server sent, as Parquet columns cannot mix times with and without
+    # a UTC offset
+    return datetime.fromisoformat(text).replace(tzinfo=None)
+
+def ParseDate(text):
+    return date.fromisoformat(text[:10])
+
+# The Arrow type and conversion from text of each xsd type. Fields of other types, such as the ...Dictionary fields,
+# are not extracted.
+XSD_ARROW_TYPES = {
+    "string": (pa.string(), None),
+    "long": (pa.int64(), int),
+    "int": (pa.int32(), int),
+    "short": (pa.int16(), int),
+    "double": (pa.float64(), float),
+    "decimal": (pa.float64(), float),
+    "boolean": (pa.bool_(), rawResponse.ParseBoolean),
+    "dateTime": (pa.timestamp("us"), ParseWallClockDateTime),
+    "date": (pa.date32(), ParseDate),
+}
+
+class DataRowSchema:
+    # The fields of an operation's DataRow that can be extracted, with their conversions and Arrow schema
+    def __init__(self, client, operationName):
+        dataRowType = client.get_type("{%s}%sDataRow" % (IRESS_NAMESPACE, operationName))
+        self.operationName = operationName
+        self.fields = []
+        self.coercions = {}
+        arrowFields = []
+        for fieldName, element in dataRowType.elements:
+            qname = getattr(element.type, "qname", None)
+            if qname is None or qname.namespace != XSD_NAMESPACE or qname.localname not in XSD_ARROW_TYPES:
+                continue
+            arrowType, coercion = XSD_ARROW_TYPES[qname.localname]
+            self.fields.append(fieldName)
+            if coercion is not None:
+                self.coercions[fieldName] = coercion
+            arrowFields.append(pa.field(fieldName, arrowType))
+        self.arrowSchema = pa.schema(arrowFields)
+
+    def decodeBatches(self, source, rowBatchSize=DEFAULT_ROW_BATCH_SIZE, resultHeader=None):
+        # Yield the DataRows of a response as Arrow RecordBatches of up to rowBatchSize rows
+        columns = [[] for field in self.fields]
+        appends = [column.append for column in columns]
+        rowCount = 0
+        for values in rawResponse.DecodeDataRowValues(source, self.fields, self.coercions, resultHeader):
+            for append, value in zip(appends, values):
+                append(value)
+            rowCount = rowCount + 1
+            if rowCount == rowBatchSize:
+                yield self.buildBatch(columns)
+                columns = [[] for field in self.fields]
+                appends = [column.append for column in columns]
+                rowCount = 0
+        if rowCount:
+            yield self.buildBatch(columns)
+
+    def buildBatch(self, columns):
+        return pa.RecordBatch.from_arrays([pa.array(column, type=arrowField.type) for column, arrowField in zip(columns, self.arrowSchema)], schema=self.arrowSchema)
+
+class ParquetExtractWriter:
+    # Writes RecordBatches to a Parquet file through a temporary file, buffering them into row groups of up to
+    # rowGroupSize rows. The file only appears under its own name once commit is called.
+    def __init__(self, fileName, arrowSchema, rowGroupSize=DEFAULT_ROW_GROUP_SIZE, compression="zstd"):
+        self.fileName = fileName
+        self.temporaryFileName = "{}.{}.{}.tmp".format(fileName, os.getpid(), threading.get_ident())
+        self.arrowSchema = arrowSchema
+        self.rowGroupSize = rowGroupSize
+        self.pendingBatches = []
+        self.pendingRowCount = 0
+        self.rowCount = 0
+        fileDirectory = os.path.dirname(fileName)
+        if fileDirectory:
+            os.makedirs(fileDirectory, exist_ok=True)
+        self.writer = pq.ParquetWriter(self.temporaryFileName, arrowSchema, compression=compression)
+
+    def flush(self):
+        if self.pendingBatches:
+            self.writer.write_table(pa.Table.from_batches(self.pendingBatches, schema=self.arrowSchema), row_group_size=self.rowGroupSize)
+            self.pendingBatches = []
+            self.pendingRowCount = 0
+
+    def write(self, recordBatch):
+        self.pendingBatches.append(recordBatch)
+        self.pendingRowCount = self.pendingRowCount + recordBatch.num_rows
+        self.rowCount = self.rowCount + recordBatch.num_rows
+        if self.pendingRowCount >= self.rowGroupSize:
+            self.flush()
+
+    def commit(self):
+        self.flush()
+        self.writer.close()
+        os.replace(self.temporaryFileName, self.fileName)
+        return self.rowCount
+
+    def abort(self):
+        try:
+            self.writer.close()
+        finally:
+            if os.path.exists(self.temporaryFileName):
+                os.remove(self.temporaryFileName)
+
+def ExtractPages(requestPage, dataRowSchema, fileName, rowBatchSize=DEFAULT_ROW_BATCH_SIZE, rowGroupSize=DEFAULT_ROW_GROUP_SIZE, pageSize=pager.DEFAULT_PAGE_SIZE, requestId=None):
+    # Write every page of a result set to fileName and return the number of rows written. The pages are requested
+    # through pager.GetRawPages, so requestPage is called with the paging fields for the request header and returns
+    # the raw response content. The next page is requested while the current one is written. The result set is
+    # requested under requestId, or a new RequestID when it is None. Nothing is left at fileName if a page fails.
+    writer = ParquetExtractWriter(fileName, dataRowSchema.arrowSchema, rowGroupSize)
+    try:
+        for recordBatches in pager.GetRawPages(requestPage, lambda content, resultHeader: list(dataRowSchema.decodeBatches(content, rowBatchSize, resultHeader)), pageSize, requestId=requestId):
+            for recordBatch in recordBatches:
+                writer.write(recordBatch)
+        return writer.commit()
+    except:
+        writer.abort()
+        raise
+
+class ExtractCheckpoint:
+    # Records the extract files that are complete, with their row counts, in a JSON file that is replaced as a whole
+    # each time a file completes
+    def __init__(self, fileName):
+        self.fileName = fileName
+        self.lock = threading.Lock()
+        self.completed = {}
+        if os.path.exists(fileName):
+            with open(fileName) as checkpointFile:
+                self.completed = json.load(checkpointFile)["Completed"]
+
+    def isComplete(self, key, extractFileName):
+        # A file deleted since it completed is extracted again
+        with self.lock:
+            return key in self.completed and os.path.exists(extractFileName)
+
+    def markComplete(self, key, rowCount):
+        with self.lock:
+            self.completed[key] = { "Rows": rowCount, "CompletedTime": datetime.now().isoformat() }
+            checkpointDirectory = os.path.dirname(self.fileName)
+            if checkpointDirectory:
+                os.makedirs(checkpointDirectory, exist_ok=True)
+            temporaryFileName = "{}.{}.tmp".format(self.fileName, os.getpid())
+            with open(temporaryFileName, "w") as checkpointFile:
+                json.dump({ "Completed": self.completed }, checkpointFile, indent=1, sort_keys=True)
+            os.replace(temporaryFileName, self.fileName)
@@ -0,0 +1,170 @@
+from requests import Session
+from zeep.transports import Transport
+from zeep import Client
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+import threading
+import time
+
+import pager
+import rawResponse
+from requestScheduler import RequestScheduler, InstallTransientStatusHook
+from soapMetrics import MeteredClient
+from securityKey import SecurityKey, ParseSecurityKey
+
+# Quote snapshots through PricingQuoteGet, for jobs that need the current price of many securities. Requested
+# "SecurityCode.Exchange" keys are deduplicated and sent up to batchSize at a time in multi-security PricingQuoteGet
+# calls, through its parallel SecurityCodeArray and ExchangeArray. Quotes are kept in a QuoteCache for ttl seconds,
+# which several QuoteServices can share. A key that is already being requested, by this caller or a concurrent one, is
+# not requested again, the caller waits for the call in flight instead. A burst of lookups for the same securities
+# from many threads therefore costs one call per batch of distinct securities.
+#
+# The calls go through a RequestScheduler under schedulerKey, so that they share the rate and concurrency limits of the
+# caller's other IRESS calls and are retried when they fail transiently. Without one, the service uses a scheduler of
+# its own. Given a SoapMetrics, the calls are recorded in it.
+#
+# Securities that the server cannot quote, with a non-zero ErrorNumber or no row at all, are returned as None. These
+# are cached like quotes, so unknown codes are not requested over and over.
+
+DEFAULT_BATCH_SIZE = 100
+DEFAULT_TTL = 5.0
+DEFAULT_MAX_SIZE = 10000
+DEFAULT_PARALLELISM = 4
+
+# The DataRow fields of PricingQuoteGet that are decoded, and their conversions from text
+QUOTE_FIELDS = ["SecurityCode", "Exchange", "DataSource", "ErrorNumber", "AskCount", "AskPrice", "AskVolume", "BidCount", "BidPrice", "BidVolume", "TotalVolume", "TotalValue", "HighPrice", "LastPrice", "LowPrice", "MatchPrice", "MatchVolume", "MarketValue", "MarketVolume", "Movement", "OpenPrice", "QuotationBasisCode", "CompanyReportCode", "TradingStatus", "TradeCount", "TradeDateTime", "UpdateDateTime", "PreviousClosePrice", "Board"]
+QUOTE_COERCIONS = { "ErrorNumber": int, "AskCount": int, "AskPrice": float, "AskVolume": float, "BidCount": int, "BidPrice": float, "BidVolume": float, "TotalVolume": float, "TotalValue": float, "HighPrice": float, "LastPrice": float, "LowPrice": float, "MatchPrice": float, "MatchVolume": float, "MarketValue": float, "MarketVolume": float, "Movement": float, "OpenPrice": float, "TradeCount": int, "TradeDateTime": rawResponse.ParseDateTime, "UpdateDateTime": rawResponse.ParseDateTime, "PreviousClosePrice": float }
+Quote = rawResponse.RowSchema("Quote", QUOTE_FIELDS)
+
+class QuoteCache:
+    # A thread safe cache of up to maxSize quotes, each kept for ttl seconds. When full, the least recently used quote
+    # is dropped.
+    def __init__(self, maxSize=DEFAULT_MAX_SIZE, ttl=DEFAULT_TTL):
+        self.maxSize = maxSize
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        # Return (True, quote) for a cached quote, which may be None, or (False, None) when there is none
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return False, None
+            expiryTime, quote = entry
+            if expiryTime <= time.monotonic():
+                del self.entries[key]
+                return False, None
+            self.entries.move_to_end(key)
+            return True, quote
+
+    def put(self, key, quote):
+        with self.lock:
+            self.entries[key] = (time.monotonic() + self.ttl, quote)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxSize:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+class QuoteService:
+    def __init__(self, client, clientFactory, sessionManager, cache=None, batchSize=DEFAULT_BATCH_SIZE, parallelism=DEFAULT_PARALLELISM, scheduler=None, schedulerKey=("IRESS", ""), metrics=None):
+        self.client = client
+        self.clientFactory = clientFactory
+        self.sessionManager = sessionManager
+        self.cache = cache if cache is not None else QuoteCache()
+        self.scheduler = scheduler if scheduler is not None else RequestScheduler(maxConcurrency=parallelism)
+        self.schedulerKey = schedulerKey
+        self.metrics = metrics
+        self.batchSize = batchSize
+        self.inFlight = {}
+        self.lock = threading.Lock()
+        self.statistics = { "Requested": 0, "CacheHits": 0, "Coalesced": 0, "Fetched": 0, "Calls": 0 }
+        self.workerState = threading.local()
+        self.executor = ThreadPoolExecutor(max_workers=parallelism, initializer=self.initialiseWorker)
+
+    def initialiseWorker(self):
+        # Each worker gets its own HTTP session, sharing the parsed WSDL and credentials of the main client
+        workerSession = Session()
+        workerSession.auth = self.client.transport.session.auth
+        InstallTransientStatusHook(workerSession)
+        self.sessionManager.installRestartHook(workerSession)
+        if self.metrics is not None:
+            self.workerState.client = MeteredClient(self.client.wsdl, self.metrics, settings=self.client.settings, session=workerSession)
+        else:
+            self.workerState.client = Client(self.client.wsdl, settings=self.client.settings, transport=Transport(session=workerSession))
+        self.workerState.client.set_ns_prefix("ns0", "http://webservices.iress.com.au/v4/")
+
+    def requestQuotes(self, keys):
+        # Return a dict of key to quote for one PricingQuoteGet call, paging through the rows with the same RequestID
+        securities = [ParseSecurityKey(key) for key in keys]
+        sessionKey = self.sessionManager.getIressSessionKey()
+        parameters = self.clientFactory.PricingQuoteGetInputParameters(SecurityCodeArray={ "SecurityCode": [securityCode for securityCode, exchange in securities] }, ExchangeArray={ "Exchange": [exchange for securityCode, exchange in securities] })
+
+        def RequestPage(pagingHeader):
+            content = self.scheduler.call(self.schedulerKey, "PricingQuoteGet", rawResponse.CallRaw, self.workerState.client, "PricingQuoteGet", self.clientFactory.PricingQuoteGetInput(Header=self.clientFactory.PricingQuoteGetInputHeader(SessionKey=sessionKey, **pagingHeader), Parameters=parameters))
+            with self.lock:
+                self.statistics["Calls"] = self.statistics["Calls"] + 1
+            return content
+
+        quotes = {}
+        for quotesPage in pager.GetRawPages(RequestPage, lambda content, resultHeader: list(rawResponse.DecodeRows(content, Quote, QUOTE_COERCIONS, resultHeader)), len(keys), prefetch=False):
+            for quote in quotesPage:
+                if quote.SecurityCode and quote.Exchange and not quote.ErrorNumber:
+                    quotes.setdefault(SecurityKey(quote.SecurityCode, quote.Exchange), quote)
+        return quotes
+
+    def fetchBatch(self, keys):
+        # Request a batch of keys and hand the quotes to everyone waiting on them. A key is cached before it is
+        # removed from the keys in flight, so a concurrent caller always finds it in one or the other.
+        try:
+            quotes = self.requestQuotes(keys)
+        except BaseException as ex:
+            with self.lock:
+                for key in keys:
+                    self.inFlight.pop(key).set_exception(ex)
+            return
+
+        with self.lock:
+            self.statistics["Fetched"] = self.statistics["Fetched"] + len(keys)
+            for key in keys:
+                self.cache.put(key, quotes.get(key))
+                self.inFlight.pop(key).set_result(quotes.get(key))
+
+    def getQuotes(self, keys):
+        # Return a dict of each of the "SecurityCode.Exchange" keys to its Quote, or None when it cannot be quoted.
+        # Raises the error of a failed PricingQuoteGet call for any of the keys it covered.
+        uniqueKeys = OrderedDict((key, SecurityKey(*ParseSecurityKey(key))) for key in keys)
+        quotes = {}
+        pendingQuotes = {}
+        keysToFetch = []
+        with self.lock:
+            self.statistics["Requested"] = self.statistics["Requested"] + len(uniqueKeys)
+            for quoteKey in dict.fromkeys(uniqueKeys.values()):
+                found, quote = self.cache.get(quoteKey)
+                if found:
+                    self.statistics["CacheHits"] = self.statistics["CacheHits"] + 1
+                    quotes[quoteKey] = quote
+                    continue
+                future = self.inFlight.get(quoteKey)
+                if future is None:
+                    future = Future()
+                    self.inFlight[quoteKey] = future
+                    keysToFetch.append(quoteKey)
+                else:
+                    self.statistics["Coalesced"] = self.statistics["Coalesced"] + 1
+                pendingQuotes[quoteKey] = future
+
+        for index in range(0, len(keysToFetch), self.batchSize):
+            self.executor.submit(self.fetchBatch, keysToFetch[index:index + self.batchSize])
+        for quoteKey, future in pendingQuotes.items():
+            quotes[quoteKey] = future.result()
+        return { key: quotes[quoteKey] for key, quoteKey in uniqueKeys.items() }
+
+    def getQuote(self, key):
+        return self.getQuotes([key])[key]
+
+    def close(self):
+        self.executor.shutdown(wait=True)
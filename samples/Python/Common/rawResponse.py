@@ -0,0 +1,129 @@
+from collections import namedtuple
+from datetime import datetime
+from decimal import Decimal
+from lxml import etree
+import io
+
+# Raw response path for wide result sets. zeep builds a full object graph for every DataRow of a response, and for
+# methods such as OrderPadGetByAccount, IPSTransactionGetByAccount5 and BookingGetByOrganization2 that costs more CPU
+# time than the call itself. Here the response XML is streamed through iterparse instead, and only the requested
+# fields of each Result/DataRows/DataRow are kept, either as compact namedtuple rows or as columns. Only fields given
+# a coercion are converted from text, the rest stay as strings. Fields that are missing or nil are None.
+#
+# Fields with nested content, such as the ...Dictionary fields, are not decoded.
+
+IRESS_NAMESPACE = "http://webservices.iress.com.au/v4/"
+SOAP_ENVELOPE_NAMESPACE = "http://schemas.xmlsoap.org/soap/envelope/"
+XSI_NIL = "{http://www.w3.org/2001/XMLSchema-instance}nil"
+
+DATA_ROW_TAG = "{%s}DataRow" % IRESS_NAMESPACE
+RESULT_HEADER_TAG = "{%s}Header" % IRESS_NAMESPACE
+RESULT_TAG = "{%s}Result" % IRESS_NAMESPACE
+FAULT_TAG = "{%s}Fault" % SOAP_ENVELOPE_NAMESPACE
+
+class RawResponseError(Exception):
+    def __init__(self, message, statusCode=None):
+        super().__init__(message)
+        self.statusCode = statusCode
+
+def ParseBoolean(text):
+    return text == "true" or text == "1"
+
+def ParseDateTime(text):
+    return datetime.fromisoformat(text)
+
+# Coercions for the xsd types used in the Web Services V4 WSDLs
+XSD_COERCIONS = {
+    "xsd:int": int,
+    "xsd:long": int,
+    "xsd:double": float,
+    "xsd:decimal": Decimal,
+    "xsd:boolean": ParseBoolean,
+    "xsd:dateTime": ParseDateTime,
+}
+
+def RowSchema(name, fields):
+    # A namedtuple type for decoded rows, so each row costs a single tuple
+    return namedtuple(name, fields)
+
+def OpenSource(source):
+    # iterparse takes a file name or a file-like object. Response content is wrapped so it can be passed directly.
+    if isinstance(source, (bytes, bytearray)):
+        return io.BytesIO(source)
+    return source
+
+def CopyPagingBookmark(element):
+    # The PagingBookmark as a dict of its field names to their text, which can be passed back in the next request's
+    # header. The element itself cannot be kept, as iterparse clears the tree it belongs to as the response is read.
+    if element is None or element.get(XSI_NIL) == "true":
+        return None
+    return { etree.QName(fieldElement).localname: (None if fieldElement.get(XSI_NIL) == "true" else fieldElement.text) for fieldElement in element if isinstance(fieldElement.tag, str) }
+
+def DecodeDataRowValues(source, fields, coercions=None, resultHeader=None):
+    # Yield a list of the field values of each DataRow, in the order of fields. When a resultHeader dict is given, it
+    # is filled with the RequestID, StatusCode and PagingBookmark of the result header before the first row is yielded.
+    fieldIndexes = { "{%s}%s" % (IRESS_NAMESPACE, field): index for index, field in enumerate(fields) }
+    fieldCoercions = [None] * len(fields)
+    for field, coercion in (coercions or {}).items():
+        fieldCoercions[fields.index(field)] = coercion
+
+    # A response that is not well formed, such as one cut short, raises rather than yielding the rows before the damage
+    try:
+        for event, element in etree.iterparse(OpenSource(source), events=("end",), tag=(DATA_ROW_TAG, RESULT_HEADER_TAG, FAULT_TAG), huge_tree=True):
+            if element.tag == DATA_ROW_TAG:
+                values = [None] * len(fields)
+                for fieldElement in element:
+                    index = fieldIndexes.get(fieldElement.tag)
+                    if index is None or fieldElement.get(XSI_NIL) == "true":
+                        continue
+                    text = fieldElement.text or ""
+                    coercion = fieldCoercions[index]
+                    if coercion is None:
+                        values[index] = text
+                    elif text:
+                        values[index] = coercion(text)
+                yield values
+
+                # Drop the row, and the ones before it, so memory stays bounded however many rows the response has
+                element.clear()
+                parent = element.getparent()
+                while element.getprevious() is not None:
+                    del parent[0]
+            elif element.tag == RESULT_HEADER_TAG:
+                if resultHeader is not None and element.getparent().tag == RESULT_TAG:
+                    statusCode = element.findtext("{%s}StatusCode" % IRESS_NAMESPACE)
+                    pagingBookmark = element.find("{%s}PagingBookmark" % IRESS_NAMESPACE)
+                    resultHeader["RequestID"] = element.findtext("{%s}RequestID" % IRESS_NAMESPACE)
+                    resultHeader["StatusCode"] = int(statusCode) if statusCode else None
+                    resultHeader["PagingBookmark"] = CopyPagingBookmark(pagingBookmark)
+            else:
+                raise RawResponseError(element.findtext("faultstring") or "SOAP fault returned")
+    except etree.XMLSyntaxError as ex:
+        raise RawResponseError("The response could not be parsed. Error: {}".format(str(ex)))
+
+def DecodeRows(source, rowSchema, coercions=None, resultHeader=None):
+    # Yield each DataRow as a rowSchema tuple holding only the schema's fields
+    for values in DecodeDataRowValues(source, rowSchema._fields, coercions, resultHeader):
+        yield rowSchema._make(values)
+
+def DecodeColumns(source, fields, coercions=None, resultHeader=None):
+    # Return a dict of field name to a list of that field's values, one per DataRow
+    columns = [[] for field in fields]
+    appends = [column.append for column in columns]
+    for values in DecodeDataRowValues(source, fields, coercions, resultHeader):
+        for append, value in zip(appends, values):
+            append(value)
+    return dict(zip(fields, columns))
+
+def CallRaw(client, operationName, *args, **kwargs):
+    # Call an operation through zeep, but return the response content without deserialising it
+    with client.settings(raw_response=True):
+        response = getattr(client.service, operationName)(*args, **kwargs)
+    if response.status_code != 200:
+        faultString = None
+        try:
+            faultString = etree.fromstring(response.content).findtext(".//faultstring")
+        except etree.XMLSyntaxError:
+            pass
+        raise RawResponseError(faultString or "{} failed with HTTP status {}".format(operationName, response.status_code), response.status_code)
+    return response.content
@@ -0,0 +1,189 @@
+from requests import Session
+from zeep.transports import Transport
+from zeep import Client
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+import pager
+import rawResponse
+from requestScheduler import RequestScheduler, InstallTransientStatusHook
+from securityKey import SecurityKey, ParseSecurityKey
+
+# Security reference data, such as the ISIN and SEDOL of a SecurityCode.Exchange, for enriching trades and positions.
+# The C# iosplus-download sample keeps this in a dictionary that is rebuilt on every run. Here it is kept in a local
+# SQLite store, indexed by ISIN and SEDOL as well as by security, so it is built up across runs. populate requests
+# SecurityInformationGet only for the securities that are not in the store, or whose data is older than maxAge, in
+# batches of batchSize through its parallel SecurityCodeArray and ExchangeArray. The calls go through a RequestScheduler
+# under schedulerKey, as the quote service's do, so that they share the caller's rate and concurrency limits and are
+# retried when they fail transiently. Without one, the cache uses a scheduler of its own.
+#
+# Securities the server does not know are stored too, so they are not requested again until they are older than
+# maxAge. Lookups never call the server, and return None for them. Pass storePath=None to keep the store in memory
+# for this process only.
+
+DEFAULT_STORE_PATH = os.path.join(os.path.expanduser("~"), ".iress", "referencedata.db")
+DEFAULT_BATCH_SIZE = 100 # As in the C# sample, SecurityInformationGet allows 1000 but smaller batches are less likely to time out
+DEFAULT_MAX_AGE = 7 * 24 * 60 * 60
+DEFAULT_PARALLELISM = 4
+
+# The SecurityInformationGet DataRow fields that are stored, and their conversions from text
+REFERENCE_DATA_FIELDS = ["SecurityCode", "Exchange", "ISIN", "SEDOL", "SecurityDescription", "SecurityShortDescription", "SecurityType", "CurrencyCode", "IssuerCode", "GICSCode", "LotSize", "HomeExchange"]
+REFERENCE_DATA_COERCIONS = { "ErrorNumber": int, "SecurityType": int, "GICSCode": int, "LotSize": int }
+ReferenceData = rawResponse.RowSchema("ReferenceData", REFERENCE_DATA_FIELDS)
+SecurityInformationRow = rawResponse.RowSchema("SecurityInformationRow", ["ErrorNumber"] + REFERENCE_DATA_FIELDS)
+
+# SQLite limits the number of parameters in a statement, so keys are looked up this many at a time
+LOOKUP_CHUNK_SIZE = 500
+
+def logInfo(message):
+    logger = logging.getLogger(__name__)
+    logger.info(message)
+
+def OpenReferenceDataStore(storePath):
+    if storePath is None:
+        storePath = ":memory:"
+    else:
+        storeDirectory = os.path.dirname(storePath)
+        if storeDirectory:
+            os.makedirs(storeDirectory, exist_ok=True)
+
+    # Write ahead logging lets other processes read the store while this one is writing to it
+    store = sqlite3.connect(storePath, timeout=60, isolation_level=None, check_same_thread=False)
+    store.execute("PRAGMA journal_mode=WAL")
+    store.execute("CREATE TABLE IF NOT EXISTS SecurityInformation (SecurityKey TEXT PRIMARY KEY, {}, Known INTEGER NOT NULL, UpdatedTime REAL NOT NULL)".format(", ".join(REFERENCE_DATA_FIELDS)))
+    store.execute("CREATE INDEX IF NOT EXISTS SecurityInformationISIN ON SecurityInformation (ISIN)")
+    store.execute("CREATE INDEX IF NOT EXISTS SecurityInformationSEDOL ON SecurityInformation (SEDOL)")
+    return store
+
+class ReferenceDataCache:
+    def __init__(self, client, clientFactory, sessionManager, storePath=DEFAULT_STORE_PATH, batchSize=DEFAULT_BATCH_SIZE, maxAge=DEFAULT_MAX_AGE, parallelism=DEFAULT_PARALLELISM, scheduler=None, schedulerKey=("IRESS", "")):
+        # client must support SecurityInformationGet, which is in the IRESS WSDL
+        self.client = client
+        self.clientFactory = clientFactory
+        self.sessionManager = sessionManager
+        self.scheduler = scheduler if scheduler is not None else RequestScheduler(maxConcurrency=parallelism)
+        self.schedulerKey = schedulerKey
+        self.batchSize = batchSize
+        self.maxAge = maxAge
+        self.parallelism = parallelism
+        self.store = OpenReferenceDataStore(storePath)
+        self.lock = threading.Lock()
+        self.workerState = threading.local()
+
+        # Lookups already answered from the store in this process, so enriching many rows of the same security costs
+        # one query
+        self.entries = {}
+
+    def initialiseWorker(self):
+        # Each worker gets its own HTTP session, sharing the parsed WSDL and credentials of the main client
+        workerSession = Session()
+        workerSession.auth = self.client.transport.session.auth
+        InstallTransientStatusHook(workerSession)
+        self.sessionManager.installRestartHook(workerSession)
+        self.workerState.client = Client(self.client.wsdl, settings=self.client.settings, transport=Transport(session=workerSession))
+        self.workerState.client.set_ns_prefix("ns0", "http://webservices.iress.com.au/v4/")
+
+    def requestSecurityInformation(self, keys):
+        # Return a dict of key to ReferenceData for one batch of keys, paging through the rows with the same RequestID.
+        # Securities the server does not know are left out.
+        securities = [ParseSecurityKey(key) for key in keys]
+        sessionKey = self.sessionManager.getIressSessionKey()
+        parameters = self.clientFactory.SecurityInformationGetInputParameters(SecurityCodeArray={ "SecurityCode": [securityCode for securityCode, exchange in securities] }, ExchangeArray={ "Exchange": [exchange for securityCode, exchange in securities] })
+
+        def RequestPage(pagingHeader):
+            return self.scheduler.call(self.schedulerKey, "SecurityInformationGet", rawResponse.CallRaw, self.workerState.client, "SecurityInformationGet", self.clientFactory.SecurityInformationGetInput(Header=self.clientFactory.SecurityInformationGetInputHeader(SessionKey=sessionKey, **pagingHeader), Parameters=parameters))
+
+        referenceData = {}
+        for rows in pager.GetRawPages(RequestPage, lambda content, resultHeader: list(rawResponse.DecodeRows(content, SecurityInformationRow, REFERENCE_DATA_COERCIONS, resultHeader)), len(keys), prefetch=False):
+            for row in rows:
+                if row.SecurityCode and row.Exchange and not row.ErrorNumber:
+                    referenceData.setdefault(SecurityKey(row.SecurityCode, row.Exchange), ReferenceData._make(row[1:]))
+        return referenceData
+
+    def storeBatch(self, keys, referenceData):
+        updatedTime = time.time()
+        rows = []
+        for key in keys:
+            data = referenceData.get(key)
+            if data is None:
+                securityCode, exchange = ParseSecurityKey(key)
+                rows.append((key, securityCode, exchange) + (None,) * (len(REFERENCE_DATA_FIELDS) - 2) + (0, updatedTime))
+            else:
+                rows.append((key,) + tuple(data) + (1, updatedTime))
+        with self.lock:
+            self.store.execute("BEGIN IMMEDIATE")
+            try:
+                self.store.executemany("INSERT OR REPLACE INTO SecurityInformation (SecurityKey, {}, Known, UpdatedTime) VALUES ({})".format(", ".join(REFERENCE_DATA_FIELDS), ", ".join(["?"] * (len(REFERENCE_DATA_FIELDS) + 3))), rows)
+                self.store.execute("COMMIT")
+            except:
+                self.store.execute("ROLLBACK")
+                raise
+            for key in keys:
+                self.entries[key] = referenceData.get(key)
+
+    def getStoredKeys(self, keys, updatedAfter):
+        # Return the keys that are in the store with data newer than updatedAfter
+        storedKeys = set()
+        with self.lock:
+            for index in range(0, len(keys), LOOKUP_CHUNK_SIZE):
+                chunk = keys[index:index + LOOKUP_CHUNK_SIZE]
+                storedKeys.update(row[0] for row in self.store.execute("SELECT SecurityKey FROM SecurityInformation WHERE UpdatedTime > ? AND SecurityKey IN ({})".format(", ".join(["?"] * len(chunk))), [updatedAfter] + chunk))
+        return storedKeys
+
+    def populate(self, keys):
+        # Request SecurityInformationGet for the "SecurityCode.Exchange" keys that are missing from the store or older
+        # than maxAge. Each batch is stored as it arrives. Returns the number of keys requested, and raises the error
+        # of the first batch that failed once the others have finished.
+        uniqueKeys = list(dict.fromkeys(SecurityKey(*ParseSecurityKey(key)) for key in keys))
+        storedKeys = self.getStoredKeys(uniqueKeys, time.time() - self.maxAge)
+        keysToFetch = [key for key in uniqueKeys if key not in storedKeys]
+        if not keysToFetch:
+            return 0
+
+        batches = [keysToFetch[index:index + self.batchSize] for index in range(0, len(keysToFetch), self.batchSize)]
+        logInfo("Requesting security information for {} of {} securities in {} batches".format(len(keysToFetch), len(uniqueKeys), len(batches)))
+        firstError = None
+        with ThreadPoolExecutor(max_workers=min(self.parallelism, len(batches)), initializer=self.initialiseWorker) as executor:
+            futures = { executor.submit(self.requestSecurityInformation, batch): batch for batch in batches }
+            for future in as_completed(futures):
+                try:
+                    self.storeBatch(futures[future], future.result())
+                except Exception as ex:
+                    firstError = firstError or ex
+        if firstError is not None:
+            raise firstError
+        return len(keysToFetch)
+
+    def get(self, key):
+        # Return the ReferenceData of a "SecurityCode.Exchange" key from the store, or None when it is not known. Never
+        # calls the server, call populate first.
+        securityKey = SecurityKey(*ParseSecurityKey(key))
+        with self.lock:
+            if securityKey not in self.entries:
+                row = self.store.execute("SELECT {} FROM SecurityInformation WHERE SecurityKey = ? AND Known = 1".format(", ".join(REFERENCE_DATA_FIELDS)), (securityKey,)).fetchone()
+                self.entries[securityKey] = ReferenceData._make(row) if row else None
+            return self.entries[securityKey]
+
+    def getMany(self, keys):
+        # Populate any of the keys that are unknown, then return a dict of each key to its ReferenceData or None
+        self.populate(keys)
+        return { key: self.get(key) for key in keys }
+
+    def findByField(self, fieldName, value):
+        with self.lock:
+            rows = self.store.execute("SELECT {} FROM SecurityInformation WHERE {} = ? AND Known = 1 ORDER BY SecurityKey".format(", ".join(REFERENCE_DATA_FIELDS), fieldName), (value,)).fetchall()
+        return [ReferenceData._make(row) for row in rows]
+
+    def findByIsin(self, isin):
+        # Return the ReferenceData of every stored listing with the ISIN, as a security can trade on several exchanges
+        return self.findByField("ISIN", isin)
+
+    def findBySedol(self, sedol):
+        return self.findByField("SEDOL", sedol)
+
+    def close(self):
+        self.store.close()
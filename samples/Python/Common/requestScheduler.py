@@ -0,0 +1,272 @@
+from concurrent.futures import Future
+import logging
+import random
+import re
+import threading
+import time
+import requests
+import urllib3.exceptions
+import zeep.exceptions
+
+import rawResponse
+
+# Central scheduling of Web Services calls, so that scripts running many calls concurrently neither give up on the
+# first transient fault nor push a server past what it tolerates. Calls are scheduled against a key, normally the
+# (service, server) pair such as ("IOSPLUS", "IOSPLUSAPIRETAIL3") or ("IRESS", ""), and each key has:
+#   * an optional token bucket, limiting its calls to a rate per second with bursts of up to burst calls
+#   * an adaptive concurrency limit. It grows by one call per limit's worth of calls that complete in time, and shrinks
+#     by a tenth when a call fails transiently or recent calls take more than latencyTolerance times as long as the
+#     fastest ones, so the calls in flight settle at the most the server keeps up with.
+# A call that fails with a transient fault is retried up to maxAttempts times in all, after a jittered exponential
+# backoff. Retries repeat the call exactly. Calls given a requestId are also coalesced: a call made while another with
+# the same RequestID is in flight waits for and gets that call's result. Results are not kept once a call completes,
+# as holding every response of a long run would grow without bound.
+#
+# A call that is not idempotent, such as OrderCreate3 or AlertCreate, is only retried when it certainly never reached
+# the server: it could not connect, or the server turned it away with HTTP 429 or 503. A timeout, a dropped connection
+# or a gateway error can happen after the server has acted on the request, and nothing guarantees that the server
+# recognises a repeated RequestID, so retrying those could create the same orders or alerts twice. Such failures are
+# raised to the caller to reconcile.
+#
+# zeep parses error responses leniently with strict=False, so a busy server's plain text or HTML page does not reach
+# the caller as a usable error. InstallTransientStatusHook makes a requests Session raise an HTTPError for those
+# responses instead, which IsTransient recognises.
+
+DEFAULT_MAX_ATTEMPTS = 4
+DEFAULT_BASE_DELAY = 0.5
+DEFAULT_MAX_DELAY = 30.0
+DEFAULT_MAX_CONCURRENCY = 8
+DEFAULT_LATENCY_TOLERANCE = 2.0
+
+# Throttling, gateway and timeout responses, as opposed to faults in the request itself
+TRANSIENT_HTTP_STATUS_CODES = (408, 429, 502, 503, 504)
+# Statuses the server answers with instead of acting on a request
+REJECTED_HTTP_STATUS_CODES = (429, 503)
+TRANSIENT_FAULT_PATTERN = re.compile(r"time[d ]*out|busy|throttl|too many|unavailable|try again", re.IGNORECASE)
+
+def logWarning(message):
+    logger = logging.getLogger(__name__)
+    logger.warning(message)
+
+def RaiseTransientStatus(response, *args, **kwargs):
+    if response.status_code in TRANSIENT_HTTP_STATUS_CODES:
+        response.content # Read the body so the connection goes back to the pool
+        response.raise_for_status()
+
+def InstallTransientStatusHook(session):
+    session.hooks["response"].append(RaiseTransientStatus)
+    return session
+
+def IsTransient(ex):
+    # Whether a failed call is worth retrying: it could not connect or timed out, the server was throttling or
+    # unavailable, or the SOAP fault says so
+    if isinstance(ex, requests.exceptions.HTTPError):
+        return ex.response is not None and ex.response.status_code in TRANSIENT_HTTP_STATUS_CODES
+    if isinstance(ex, (requests.exceptions.ConnectionError, requests.exceptions.Timeout)):
+        return True
+    if isinstance(ex, zeep.exceptions.TransportError):
+        return ex.status_code in TRANSIENT_HTTP_STATUS_CODES
+    if isinstance(ex, rawResponse.RawResponseError):
+        return ex.statusCode in TRANSIENT_HTTP_STATUS_CODES or bool(TRANSIENT_FAULT_PATTERN.search(str(ex)))
+    if isinstance(ex, zeep.exceptions.Fault):
+        return bool(TRANSIENT_FAULT_PATTERN.search(ex.message or ""))
+    return False
+
+def IsNotDelivered(ex):
+    # Whether a failed call certainly did not reach the server, or was turned away by it, so that it can be retried
+    # even when the server would act on it twice
+    if isinstance(ex, requests.exceptions.ConnectTimeout):
+        return True
+    if isinstance(ex, requests.exceptions.ConnectionError):
+        reason = getattr(ex.args[0], "reason", None) if ex.args else None
+        return isinstance(reason, (urllib3.exceptions.NewConnectionError, urllib3.exceptions.ConnectTimeoutError))
+    if isinstance(ex, requests.exceptions.HTTPError):
+        return ex.response is not None and ex.response.status_code in REJECTED_HTTP_STATUS_CODES
+    if isinstance(ex, zeep.exceptions.TransportError):
+        return ex.status_code in REJECTED_HTTP_STATUS_CODES
+    if isinstance(ex, rawResponse.RawResponseError):
+        return ex.statusCode in REJECTED_HTTP_STATUS_CODES
+    return False
+
+def BackoffDelay(attempt, baseDelay=DEFAULT_BASE_DELAY, maxDelay=DEFAULT_MAX_DELAY):
+    # Full jitter: a random delay of up to the exponential backoff for the attempt that failed, so that the workers
+    # that failed together do not all retry together
+    return random.uniform(0, min(maxDelay, baseDelay * 2 ** (attempt - 1)))
+
+class TokenBucket:
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.burst = burst if burst is not None else max(1.0, rate)
+        self.tokens = self.burst
+        self.lastTime = time.monotonic()
+        self.lock = threading.Lock()
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.lastTime) * self.rate)
+        self.lastTime = now
+
+    def tryAcquire(self):
+        # Take a token if one is available, without waiting
+        with self.lock:
+            self.refill()
+            if self.tokens >= 1:
+                self.tokens = self.tokens - 1
+                return True
+            return False
+
+    def acquire(self):
+        # Wait until a token is available and take it
+        while True:
+            with self.lock:
+                self.refill()
+                if self.tokens >= 1:
+                    self.tokens = self.tokens - 1
+                    return
+                waitTime = (1 - self.tokens) / self.rate
+            time.sleep(waitTime)
+
+class AdaptiveConcurrencyLimit:
+    # An additive increase, multiplicative decrease limit on the calls in flight, between minConcurrency and
+    # maxConcurrency. The server is overloaded when the average latency of recent calls is more than latencyTolerance
+    # times the baseline, which follows the fastest calls and drifts up slowly so a server that has become slower
+    # overall is not treated as overloaded for good. The limit is cut at most once per recent call latency, so the calls
+    # already in flight when it was cut do not cut it again.
+    def __init__(self, maxConcurrency=DEFAULT_MAX_CONCURRENCY, minConcurrency=1, latencyTolerance=DEFAULT_LATENCY_TOLERANCE):
+        self.maxConcurrency = maxConcurrency
+        self.minConcurrency = minConcurrency
+        self.latencyTolerance = latencyTolerance
+        self.limit = float(maxConcurrency)
+        self.inFlight = 0
+        self.baselineLatency = None
+        self.recentLatency = None
+        self.lastDecreaseTime = 0.0
+        self.condition = threading.Condition()
+
+    def acquire(self):
+        with self.condition:
+            while self.inFlight >= int(self.limit):
+                self.condition.wait()
+            self.inFlight = self.inFlight + 1
+
+    def release(self, latency=None, overloaded=False):
+        # Return a call's slot, adjusting the limit by its latency, or by overloaded when it failed
+        with self.condition:
+            self.inFlight = self.inFlight - 1
+            if latency is not None:
+                if self.baselineLatency is None or latency < self.baselineLatency:
+                    self.baselineLatency = latency
+                else:
+                    self.baselineLatency = self.baselineLatency + (latency - self.baselineLatency) * 0.01
+                self.recentLatency = latency if self.recentLatency is None else self.recentLatency + (latency - self.recentLatency) * 0.1
+                overloaded = overloaded or self.recentLatency > self.baselineLatency * self.latencyTolerance
+            if overloaded:
+                now = time.monotonic()
+                if now - self.lastDecreaseTime >= (self.recentLatency or 0.0):
+                    self.limit = max(float(self.minConcurrency), self.limit * 0.9)
+                    self.lastDecreaseTime = now
+            elif latency is not None:
+                self.limit = min(float(self.maxConcurrency), self.limit + 1 / self.limit)
+            self.condition.notify_all()
+
+class RequestScheduler:
+    def __init__(self, rate=None, burst=None, maxConcurrency=DEFAULT_MAX_CONCURRENCY, minConcurrency=1, latencyTolerance=DEFAULT_LATENCY_TOLERANCE, maxAttempts=DEFAULT_MAX_ATTEMPTS, baseDelay=DEFAULT_BASE_DELAY, maxDelay=DEFAULT_MAX_DELAY, rates=None, isTransient=IsTransient, isNotDelivered=IsNotDelivered):
+        # rate, burst and maxConcurrency apply to every key, except that rates can give a key a rate of its own. A
+        # rate of None does not limit the rate.
+        self.rate = rate
+        self.burst = burst
+        self.maxConcurrency = maxConcurrency
+        self.minConcurrency = minConcurrency
+        self.latencyTolerance = latencyTolerance
+        self.maxAttempts = maxAttempts
+        self.baseDelay = baseDelay
+        self.maxDelay = maxDelay
+        self.rates = rates or {}
+        self.isTransient = isTransient
+        self.isNotDelivered = isNotDelivered
+        self.lock = threading.Lock()
+        self.buckets = {}
+        self.concurrencyLimits = {}
+        self.inFlightRequests = {}
+        self.statistics = { "Calls": 0, "Retries": 0, "Failures": 0, "Repeats": 0 }
+
+    def getLimits(self, key):
+        with self.lock:
+            if key not in self.concurrencyLimits:
+                rate = self.rates.get(key, self.rate)
+                self.buckets[key] = TokenBucket(rate, self.burst) if rate else None
+                self.concurrencyLimits[key] = AdaptiveConcurrencyLimit(self.maxConcurrency, self.minConcurrency, self.latencyTolerance)
+            return self.buckets[key], self.concurrencyLimits[key]
+
+    def getConcurrencyLimit(self, key):
+        return self.getLimits(key)[1].limit
+
+    def callWithRetries(self, key, operationName, function, args, kwargs, idempotent=True):
+        bucket, concurrencyLimit = self.getLimits(key)
+        attempt = 1
+        while True:
+            if bucket is not None:
+                bucket.acquire()
+            concurrencyLimit.acquire()
+            startTime = time.perf_counter()
+            try:
+                result = function(*args, **kwargs)
+            except Exception as ex:
+                transient = self.isTransient(ex)
+                concurrencyLimit.release(overloaded=transient)
+                retryable = transient if idempotent else self.isNotDelivered(ex)
+                if not retryable or attempt >= self.maxAttempts:
+                    with self.lock:
+                        self.statistics["Failures"] = self.statistics["Failures"] + 1
+                    raise
+                delay = BackoffDelay(attempt, self.baseDelay, self.maxDelay)
+                logWarning("{} failed on attempt {} of {}, retrying in {:.2f}s. Error: {}".format(operationName, attempt, self.maxAttempts, delay, str(ex)))
+                with self.lock:
+                    self.statistics["Retries"] = self.statistics["Retries"] + 1
+                time.sleep(delay)
+                attempt = attempt + 1
+                continue
+            except:
+                concurrencyLimit.release()
+                raise
+
+            concurrencyLimit.release(time.perf_counter() - startTime)
+            with self.lock:
+                self.statistics["Calls"] = self.statistics["Calls"] + 1
+            return result
+
+    def call(self, key, operationName, function, *args, requestId=None, idempotent=True, **kwargs):
+        # Call function(*args, **kwargs) under key's limits, retrying transient faults, and return its result. With a
+        # requestId, the result of a concurrent call with that RequestID is returned instead of calling again. A call
+        # that is not idempotent is only retried when it was not delivered.
+        if requestId is None:
+            return self.callWithRetries(key, operationName, function, args, kwargs, idempotent)
+
+        with self.lock:
+            future = self.inFlightRequests.get(requestId)
+            repeat = future is not None
+            if repeat:
+                self.statistics["Repeats"] = self.statistics["Repeats"] + 1
+            else:
+                future = Future()
+                self.inFlightRequests[requestId] = future
+        if repeat:
+            return future.result()
+
+        try:
+            result = self.callWithRetries(key, operationName, function, args, kwargs, idempotent)
+        except BaseException as ex:
+            with self.lock:
+                self.inFlightRequests.pop(requestId)
+            future.set_exception(ex)
+            raise
+
+        with self.lock:
+            self.inFlightRequests.pop(requestId)
+        future.set_result(result)
+        return result
+
+    def formatSummary(self):
+        with self.lock:
+            limits = ", ".join("{}: {:.1f}".format("/".join(str(part) for part in key if part) if isinstance(key, tuple) else key, concurrencyLimit.limit) for key, concurrencyLimit in self.concurrencyLimits.items())
+            return "Scheduled calls: {Calls} Retries: {Retries} Failures: {Failures} Repeated RequestIDs: {Repeats}".format(**self.statistics) + (" Concurrency limits: " + limits if limits else "")
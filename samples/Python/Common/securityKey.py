@@ -0,0 +1,12 @@
+# "SecurityCode.Exchange" keys, such as "BHP.ASX", which the quote service and the reference data cache are looked up
+# by. Keys are upper case, so the same security requested in different cases is one key.
+
+def SecurityKey(securityCode, exchange):
+    return "{}.{}".format(securityCode, exchange).upper()
+
+def ParseSecurityKey(key):
+    # Split a "SecurityCode.Exchange" key. The exchange follows the last ".", as security codes may contain one.
+    securityCode, separator, exchange = key.rpartition(".")
+    if not separator or not securityCode or not exchange:
+        raise ValueError("Security key {} is not of the form SecurityCode.Exchange".format(key))
+    return securityCode, exchange
@@ -0,0 +1,226 @@
+from xml.sax.saxutils import escape
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+import uuid
+
+# Shares IRESS and service sessions between jobs and worker threads. Every run of a script would otherwise perform an
+# IRESSSessionStart and ServiceSessionStart before doing any work. The session keys are kept in a local SQLite store,
+# so later processes reuse them. Within a process the keys are handed out to any number of worker threads, and are
+# renewed shortly before they expire.
+#
+# The server can reject a session before it was due to expire, for example when it was ended or kicked by another
+# login. A session manager restarts the sessions when a call through a session it has hooked is rejected for its
+# session key, and resends the call once with the new key.
+#
+# The store holds live session keys, so it is created readable by the current user only. Pass storePath=None to keep
+# the sessions in memory for this process only.
+
+DEFAULT_STORE_PATH = os.path.join(os.path.expanduser("~"), ".iress", "sessions.db")
+DEFAULT_SESSION_LIFETIME = 60 * 60
+DEFAULT_RENEW_BEFORE = 5 * 60
+
+# Faults the server answers with when a call's session key has expired, been ended or been kicked
+INVALID_SESSION_PATTERN = re.compile(r"\bsession\b[^.]*?\b(invalid|not valid|expired|not found|ended|kicked|timed out)\b|\b(invalid|expired|unknown)\W+(\w+\W+)?session\b", re.IGNORECASE)
+SESSION_START_OPERATIONS = ["IRESSSessionStart", "ServiceSessionStart"]
+
+def logInfo(message):
+    logger = logging.getLogger(__name__)
+    logger.info(message)
+
+def logWarning(message):
+    logger = logging.getLogger(__name__)
+    logger.warning(message)
+
+def logError(message):
+    logger = logging.getLogger(__name__)
+    logger.error(message)
+
+def OpenSessionStore(storePath):
+    storeDirectory = os.path.dirname(storePath)
+    if storeDirectory:
+        os.makedirs(storeDirectory, exist_ok=True)
+    if not os.path.exists(storePath):
+        os.close(os.open(storePath, os.O_CREAT | os.O_WRONLY, 0o600))
+
+    # Autocommit mode, so the transactions below are controlled explicitly with BEGIN IMMEDIATE
+    store = sqlite3.connect(storePath, timeout=60, isolation_level=None)
+    store.execute("CREATE TABLE IF NOT EXISTS Sessions (StoreKey TEXT PRIMARY KEY, IressSessionKey TEXT NOT NULL, ServiceSessionKey TEXT, ExpiryTime REAL NOT NULL)")
+    return store
+
+class SessionManager:
+    def __init__(self, client, clientFactory, endpoint, username, companyname, password, service=None, server=None, storePath=DEFAULT_STORE_PATH, sessionLifetime=DEFAULT_SESSION_LIFETIME, renewBefore=DEFAULT_RENEW_BEFORE, kickLikeSessions=False):
+        # client must support IRESSSessionStart, and ServiceSessionStart when a service is given. Both the IRESS and
+        # IOS+ WSDLs include them.
+        self.client = client
+        self.clientFactory = clientFactory
+        self.username = username
+        self.companyname = companyname
+        self.password = password
+        self.service = service
+        self.server = server
+        self.storePath = storePath
+        self.sessionLifetime = sessionLifetime
+        self.renewBefore = min(renewBefore, sessionLifetime / 2)
+        # Kicking like sessions would end the ones that other processes are sharing through the store, so only
+        # sessions kept for this process alone kick
+        self.kickLikeSessions = kickLikeSessions and storePath is None
+        self.storeKey = "{}|{}@{}|{}|{}".format(endpoint, username, companyname, service or "", server or "")
+        self.lock = threading.Lock()
+        self.iressSessionKey = None
+        self.serviceSessionKey = None
+        self.expiryTime = 0
+        self.renewalThread = None
+        self.stopRenewal = threading.Event()
+        self.rejectedKeys = (None, None)
+        self.resendState = threading.local()
+        self.installRestartHook(client.transport.session)
+
+    def startSessions(self):
+        # Only kick like sessions on the first start. Kicking on a renewal would end the sessions this process's
+        # workers are still using.
+        appId = str(uuid.uuid4()) # Generate a application ID that is unique.
+        if self.kickLikeSessions and self.iressSessionKey is None:
+            iressSessionStartInputParameters = self.clientFactory.IRESSSessionStartInputParameters(UserName=self.username, CompanyName=self.companyname, ApplicationID=appId, Password=self.password, SessionNumberToKick=-2, KickLikeSessions=True)
+        else:
+            iressSessionStartInputParameters = self.clientFactory.IRESSSessionStartInputParameters(UserName=self.username, CompanyName=self.companyname, ApplicationID=appId, Password=self.password)
+
+        # A restart can happen inside a call made with raw_response on the same client and thread, so the responses
+        # are always deserialised here
+        with self.client.settings(raw_response=False):
+            iressSessionStartResponse = self.client.service.IRESSSessionStart(self.clientFactory.IRESSSessionStartInput(Header=self.clientFactory.IRESSSessionStartInputHeader(Updates=False), Parameters=iressSessionStartInputParameters))
+            iressSessionKey = iressSessionStartResponse.Result.DataRows.DataRow[0].IRESSSessionKey
+
+            serviceSessionKey = None
+            if self.service:
+                serviceSessionStartResponse = self.client.service.ServiceSessionStart(self.clientFactory.ServiceSessionStartInput(Parameters=self.clientFactory.ServiceSessionStartInputParameters(IRESSSessionKey=iressSessionKey, Service=self.service, Server=self.server)))
+                serviceSessionKey = serviceSessionStartResponse.Result.DataRows.DataRow[0].ServiceSessionKey
+
+        logInfo("Sessions started for user {}@{}, IRESS session key: {} Service Session Key: {}".format(self.username, self.companyname, iressSessionKey, serviceSessionKey))
+        return iressSessionKey, serviceSessionKey, time.time() + self.sessionLifetime
+
+    def loadOrStartSessions(self):
+        # Take the write lock on the store before checking it, so concurrent processes that all find the sessions
+        # missing or expiring start only one new set between them.
+        if self.storePath is None:
+            return self.startSessions()
+
+        store = OpenSessionStore(self.storePath)
+        try:
+            store.execute("BEGIN IMMEDIATE")
+            storedSession = store.execute("SELECT IressSessionKey, ServiceSessionKey, ExpiryTime FROM Sessions WHERE StoreKey = ?", (self.storeKey,)).fetchone()
+            if storedSession and storedSession[2] - time.time() > self.renewBefore:
+                store.execute("COMMIT")
+                logInfo("Reusing sessions for user {}@{}, IRESS session key: {} Service Session Key: {}".format(self.username, self.companyname, storedSession[0], storedSession[1]))
+                return storedSession
+
+            try:
+                iressSessionKey, serviceSessionKey, expiryTime = self.startSessions()
+            except:
+                store.execute("ROLLBACK")
+                raise
+            store.execute("INSERT OR REPLACE INTO Sessions (StoreKey, IressSessionKey, ServiceSessionKey, ExpiryTime) VALUES (?, ?, ?, ?)", (self.storeKey, iressSessionKey, serviceSessionKey, expiryTime))
+            store.execute("COMMIT")
+            return iressSessionKey, serviceSessionKey, expiryTime
+        finally:
+            store.close()
+
+    def getSessionKeys(self):
+        # Return the current (IRESSSessionKey, ServiceSessionKey), renewing them first when they are close to expiry.
+        # Safe to call from any number of worker threads.
+        with self.lock:
+            if self.expiryTime - time.time() <= self.renewBefore:
+                self.iressSessionKey, self.serviceSessionKey, self.expiryTime = self.loadOrStartSessions()
+            return self.iressSessionKey, self.serviceSessionKey
+
+    def getIressSessionKey(self):
+        return self.getSessionKeys()[0]
+
+    def getServiceSessionKey(self):
+        return self.getSessionKeys()[1]
+
+    def forgetStoredSessions(self):
+        # Remove the sessions from the store, unless another process has already replaced them. Called with the lock
+        # held.
+        if self.storePath is not None:
+            store = OpenSessionStore(self.storePath)
+            try:
+                if self.iressSessionKey is None:
+                    store.execute("DELETE FROM Sessions WHERE StoreKey = ?", (self.storeKey,))
+                else:
+                    store.execute("DELETE FROM Sessions WHERE StoreKey = ? AND IressSessionKey = ?", (self.storeKey, self.iressSessionKey))
+            finally:
+                store.close()
+
+    def invalidate(self):
+        # Forget the sessions so that new ones are started on the next request
+        with self.lock:
+            self.forgetStoredSessions()
+            self.expiryTime = 0
+
+    def restartRejectedSessions(self, requestBody):
+        # Start new sessions for a request the server rejected for its session key, unless another thread already has,
+        # and return the request body with the rejected keys replaced by the new ones. Returns None when the body holds
+        # none of the keys this manager handed out.
+        if isinstance(requestBody, str):
+            requestBody = requestBody.encode("utf-8")
+        with self.lock:
+            if any(key and escape(key).encode("utf-8") in requestBody for key in (self.iressSessionKey, self.serviceSessionKey)):
+                logWarning("The server rejected the sessions for user {}@{}, IRESS session key: {} Service Session Key: {}. Starting new sessions.".format(self.username, self.companyname, self.iressSessionKey, self.serviceSessionKey))
+                self.rejectedKeys = (self.iressSessionKey, self.serviceSessionKey)
+                self.forgetStoredSessions()
+                self.iressSessionKey, self.serviceSessionKey, self.expiryTime = self.loadOrStartSessions()
+            replacements = [(rejectedKey, currentKey) for rejectedKey, currentKey in zip(self.rejectedKeys, (self.iressSessionKey, self.serviceSessionKey)) if rejectedKey and currentKey and rejectedKey != currentKey]
+
+        newRequestBody = requestBody
+        for rejectedKey, currentKey in replacements:
+            newRequestBody = newRequestBody.replace(escape(rejectedKey).encode("utf-8"), escape(currentKey).encode("utf-8"))
+        return newRequestBody if newRequestBody != requestBody else None
+
+    def installRestartHook(self, session):
+        # Make a requests Session restart the sessions and resend a call once when the server rejects the call's session
+        # key. The resent call's response takes the place of the rejected one.
+        def RestartRejectedSessions(response, *args, **kwargs):
+            if response.status_code != 500 or getattr(self.resendState, "active", False):
+                return None
+            operationName = response.request.headers.get("SOAPAction", "").strip('"').rsplit("/", 1)[-1]
+            if operationName in SESSION_START_OPERATIONS or not INVALID_SESSION_PATTERN.search(response.text):
+                return None
+            try:
+                requestBody = self.restartRejectedSessions(response.request.body)
+            except Exception as ex:
+                logError("Session restart failed. Error: {}".format(str(ex)))
+                return None
+            if requestBody is None:
+                return None
+
+            request = response.request.copy()
+            request.prepare_body(requestBody, None)
+            self.resendState.active = True
+            try:
+                return session.send(request, **kwargs)
+            finally:
+                self.resendState.active = False
+
+        session.hooks["response"].append(RestartRejectedSessions)
+        return session
+
+    def startRenewal(self):
+        # Renew the sessions in the background, so that a long running job never waits on a session start.
+        def RenewSessions():
+            while not self.stopRenewal.wait(min(60, max(1, self.renewBefore / 2))):
+                try:
+                    self.getSessionKeys()
+                except Exception as ex:
+                    logError("Session renewal failed. Error: {}".format(str(ex)))
+
+        self.renewalThread = threading.Thread(target=RenewSessions, daemon=True)
+        self.renewalThread.start()
+
+    def close(self):
+        self.stopRenewal.set()
+        if self.renewalThread:
+            self.renewalThread.join()
@@ -0,0 +1,288 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from zeep.transports import Transport
+from zeep.wsdl.utils import etree_to_string
+from zeep import Client
+from datetime import datetime
+import bisect
+import json
+import os
+import re
+import threading
+import time
+
+# Per-operation instrumentation of Web Services calls made through zeep. A MeteredClient times every operation call it
+# makes, and its MeteredTransport splits that time into:
+#   serialize - building the request envelope from the zeep objects and encoding it
+#   wire      - sending the request and waiting for the whole response, which includes the server's processing
+#   parse     - parsing the response and building the zeep result objects. With raw_response this is close to 0, and
+#               decoding the content is left to the caller.
+# Each call is recorded in a SoapMetrics with its operation, request and response bytes, StatusCode and the page of
+# its RequestID it was. The metrics are kept as Prometheus-style counters and histograms by operation, which can be
+# written in the Prometheus text format or served for scraping, and each call can also be written to a JSON lines trace.
+#
+# Calls made through a MeteredTransport by a plain zeep Client are recorded too, but without the serialize time of
+# building the envelope or any parse time.
+
+# Histogram buckets for the call durations in seconds, and for the number of pages of a request
+DURATION_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+PAGE_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 1000)
+
+STATUS_MORE_DATA_AVAILABLE = 1
+
+# The Result header fields are found with a regular expression rather than by parsing the response a second time. The
+# Input echoed back ahead of the Result has a RequestID but no StatusCode or WebServiceTimeStamp.
+STATUS_CODE_PATTERN = re.compile(rb"<(?:\w+:)?StatusCode>(\d+)</")
+REQUEST_ID_PATTERN = re.compile(rb"<(?:\w+:)?RequestID>([^<]*)</")
+WEB_SERVICE_TIME_STAMP_PATTERN = re.compile(rb"<(?:\w+:)?WebServiceTimeStamp>([^<]*)</")
+
+HISTOGRAMS = [
+    ("webservices_call_duration_seconds", "CallSeconds", "Time taken by each Web Services operation call.", DURATION_BUCKETS),
+    ("webservices_serialize_duration_seconds", "SerializeSeconds", "Time taken to build and encode each request.", DURATION_BUCKETS),
+    ("webservices_wire_duration_seconds", "WireSeconds", "Time from sending each request to receiving its whole response.", DURATION_BUCKETS),
+    ("webservices_parse_duration_seconds", "ParseSeconds", "Time taken to parse each response into zeep objects.", DURATION_BUCKETS),
+]
+COUNTERS = [
+    ("webservices_calls_total", "Web Services operation calls by StatusCode, or error when the call failed."),
+    ("webservices_request_bytes_total", "Bytes sent in Web Services requests."),
+    ("webservices_response_bytes_total", "Bytes received in Web Services responses."),
+]
+PAGES_HISTOGRAM = ("webservices_request_pages", "Pages returned for each Web Services RequestID.")
+
+# The call being made by each thread, which the transport adds its measurements to
+callState = threading.local()
+
+def FormatLabels(labels):
+    return "{" + ",".join('{}="{}"'.format(name, str(value).replace("\\", "\\\\").replace('"', '\\"')) for name, value in labels) + "}"
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.bucketCounts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.bucketCounts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum = self.sum + value
+        self.count = self.count + 1
+
+    def formatLines(self, name, labels):
+        lines = []
+        cumulativeCount = 0
+        for bound, bucketCount in zip([str(bucket) for bucket in self.buckets] + ["+Inf"], self.bucketCounts):
+            cumulativeCount = cumulativeCount + bucketCount
+            lines.append("{}_bucket{} {}".format(name, FormatLabels(labels + [("le", bound)]), cumulativeCount))
+        lines.append("{}_sum{} {}".format(name, FormatLabels(labels), self.sum))
+        lines.append("{}_count{} {}".format(name, FormatLabels(labels), self.count))
+        return lines
+
+class SoapMetrics:
+    def __init__(self, traceFileName=None):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+        self.requestPages = {}
+        self.traceFile = open(traceFileName, "a") if traceFileName else None
+
+        # Called with each call's record after it is counted, for example to report percentiles as a run progresses
+        self.observers = []
+
+    def addCounter(self, name, labels, value):
+        key = (name, tuple(labels))
+        self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, labels, buckets, value):
+        key = (name, tuple(labels))
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = self.histograms[key] = Histogram(buckets)
+        histogram.observe(value)
+
+    def record(self, call):
+        # Count a finished call. call is a dict with the Operation and any of RequestID, StatusCode, Error,
+        # RequestBytes, ResponseBytes and the ...Seconds durations. Its Page is added here.
+        operationLabels = [("operation", call["Operation"])]
+        with self.lock:
+            statusCode = "error" if call.get("Error") else str(call["StatusCode"]) if call.get("StatusCode") is not None else ""
+            self.addCounter("webservices_calls_total", operationLabels + [("status_code", statusCode)], 1)
+            self.addCounter("webservices_request_bytes_total", operationLabels, call.get("RequestBytes", 0))
+            self.addCounter("webservices_response_bytes_total", operationLabels, call.get("ResponseBytes", 0))
+            for name, field, description, buckets in HISTOGRAMS:
+                if call.get(field) is not None:
+                    self.observe(name, operationLabels, buckets, call[field])
+
+            # Pages are counted by RequestID until a response says no more data is available
+            requestId = call.get("RequestID")
+            if requestId:
+                call["Page"] = self.requestPages.get(requestId, 0) + 1
+                if call.get("StatusCode") == STATUS_MORE_DATA_AVAILABLE and not call.get("Error"):
+                    self.requestPages[requestId] = call["Page"]
+                else:
+                    self.requestPages.pop(requestId, None)
+                    self.observe(PAGES_HISTOGRAM[0], operationLabels, PAGE_BUCKETS, call["Page"])
+
+            if self.traceFile:
+                self.traceFile.write(json.dumps(call) + "\n")
+            observers = list(self.observers)
+
+        for observer in observers:
+            observer(call)
+
+    def formatExposition(self):
+        # Return the metrics in the Prometheus text exposition format
+        with self.lock:
+            lines = []
+            for name, description in COUNTERS:
+                lines.extend(["# HELP {} {}".format(name, description), "# TYPE {} counter".format(name)])
+                lines.extend("{}{} {}".format(name, FormatLabels(list(labels)), value) for (counterName, labels), value in sorted(self.counters.items()) if counterName == name)
+            for name, field, description, buckets in HISTOGRAMS + [(PAGES_HISTOGRAM[0], None, PAGES_HISTOGRAM[1], PAGE_BUCKETS)]:
+                lines.extend(["# HELP {} {}".format(name, description), "# TYPE {} histogram".format(name)])
+                for (histogramName, labels), histogram in sorted(self.histograms.items(), key=lambda item: item[0]):
+                    if histogramName == name:
+                        lines.extend(histogram.formatLines(name, list(labels)))
+            return "\n".join(lines) + "\n"
+
+    def writeExposition(self, fileName):
+        # Replace the file as a whole, so a collector reading it, such as the node_exporter textfile collector, never
+        # sees it half written
+        temporaryFileName = "{}.{}.tmp".format(fileName, os.getpid())
+        with open(temporaryFileName, "w") as expositionFile:
+            expositionFile.write(self.formatExposition())
+        os.replace(temporaryFileName, fileName)
+
+    def formatSummary(self):
+        # Return a line per operation with its call count and mean durations and sizes
+        with self.lock:
+            operations = sorted(set(dict(labels)["operation"] for name, labels in self.histograms if name == "webservices_call_duration_seconds"))
+            lines = []
+            for operation in operations:
+                labels = (("operation", operation),)
+                callHistogram = self.histograms[("webservices_call_duration_seconds", labels)]
+                means = []
+                for name, field, description, buckets in HISTOGRAMS:
+                    histogram = self.histograms.get((name, labels))
+                    means.append(1000.0 * histogram.sum / histogram.count if histogram and histogram.count else 0.0)
+                errorCount = self.counters.get(("webservices_calls_total", labels + (("status_code", "error"),)), 0)
+                requestBytes = self.counters.get(("webservices_request_bytes_total", labels), 0)
+                responseBytes = self.counters.get(("webservices_response_bytes_total", labels), 0)
+                lines.append("{}: Calls: {} Errors: {} Mean call: {:.2f}ms serialize: {:.2f}ms wire: {:.2f}ms parse: {:.2f}ms Mean request: {:.0f} bytes response: {:.0f} bytes".format(operation, callHistogram.count, errorCount, means[0], means[1], means[2], means[3], requestBytes / callHistogram.count, responseBytes / callHistogram.count))
+            return lines
+
+    def close(self):
+        with self.lock:
+            if self.traceFile:
+                self.traceFile.close()
+                self.traceFile = None
+
+class MeteredTransport(Transport):
+    def __init__(self, metrics, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.metrics = metrics
+
+    def post_xml(self, address, envelope, headers):
+        # zeep's extension point for sending an envelope. The call being made by this thread, if any, gets the sizes,
+        # timings and Result header of the exchange, otherwise it is recorded as a call of its own.
+        call = getattr(callState, "call", None)
+        standalone = call is None
+        if standalone:
+            call = { "Operation": (headers.get("SOAPAction") or "").strip('"').rpartition("/")[2] or "Unknown", "StartTime": datetime.now().isoformat() }
+
+        serializeStartTime = time.perf_counter()
+        message = etree_to_string(envelope)
+        wireStartTime = time.perf_counter()
+        try:
+            response = self.post(address, message, headers)
+        except Exception as ex:
+            call["Error"] = str(ex) or type(ex).__name__
+            raise
+        finally:
+            wireEndTime = time.perf_counter()
+            call["RequestBytes"] = len(message)
+            call["WireStart"] = wireStartTime
+            call["WireEnd"] = wireEndTime
+            call["WireSeconds"] = wireEndTime - wireStartTime
+            if standalone:
+                call["SerializeSeconds"] = wireStartTime - serializeStartTime
+                if "Error" in call:
+                    self.metrics.record(call)
+
+        content = response.content
+        call["ResponseBytes"] = len(content)
+        statusCode = STATUS_CODE_PATTERN.search(content)
+        requestId = REQUEST_ID_PATTERN.search(content)
+        webServiceTimeStamp = WEB_SERVICE_TIME_STAMP_PATTERN.search(content)
+        call["StatusCode"] = int(statusCode.group(1)) if statusCode else None
+        call["RequestID"] = requestId.group(1).decode() if requestId else None
+        call["WebServiceTimeStamp"] = webServiceTimeStamp.group(1).decode() if webServiceTimeStamp else None
+        if response.status_code != 200:
+            call["Error"] = "HTTP status {}".format(response.status_code)
+        if standalone:
+            del call["WireStart"], call["WireEnd"]
+            self.metrics.record(call)
+        return response
+
+class MeteredOperation:
+    def __init__(self, operation, operationName, metrics):
+        self.operation = operation
+        self.operationName = operationName
+        self.metrics = metrics
+
+    def __call__(self, *args, **kwargs):
+        call = { "Operation": self.operationName, "StartTime": datetime.now().isoformat() }
+        callState.call = call
+        startTime = time.perf_counter()
+        try:
+            return self.operation(*args, **kwargs)
+        except Exception as ex:
+            call.setdefault("Error", str(ex) or type(ex).__name__)
+            raise
+        finally:
+            endTime = time.perf_counter()
+            callState.call = None
+            call["CallSeconds"] = endTime - startTime
+            if "WireStart" in call:
+                call["SerializeSeconds"] = call.pop("WireStart") - startTime
+                call["ParseSeconds"] = endTime - call.pop("WireEnd")
+            self.metrics.record(call)
+
+class MeteredServiceProxy:
+    # Stands in for a zeep ServiceProxy, timing each operation called through it
+    def __init__(self, serviceProxy, metrics):
+        self.serviceProxy = serviceProxy
+        self.metrics = metrics
+
+    def __getattr__(self, operationName):
+        return MeteredOperation(getattr(self.serviceProxy, operationName), operationName, self.metrics)
+
+    def __getitem__(self, operationName):
+        return MeteredOperation(self.serviceProxy[operationName], operationName, self.metrics)
+
+class MeteredClient(Client):
+    # A zeep Client that records every operation call in metrics. Takes the requests Session to send through rather
+    # than a transport.
+    def __init__(self, wsdl, metrics, settings=None, session=None, **kwargs):
+        super().__init__(wsdl, settings=settings, transport=MeteredTransport(metrics, session=session), **kwargs)
+        self.metrics = metrics
+
+    def bind(self, service_name=None, port_name=None):
+        serviceProxy = super().bind(service_name, port_name)
+        return MeteredServiceProxy(serviceProxy, self.metrics) if serviceProxy else serviceProxy
+
+def ServeMetrics(metrics, port, address=""):
+    # Serve the metrics for Prometheus to scrape at http://<address>:<port>/metrics on a background thread. Returns
+    # the server, call shutdown() on it to stop.
+    class MetricsRequestHandler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def do_GET(self):
+            body = metrics.formatExposition().encode()
+            self.send_response(200 if self.path.split("?")[0] in ("/", "/metrics") else 404)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    server = ThreadingHTTPServer((address, port), MetricsRequestHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
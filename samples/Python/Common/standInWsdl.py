@@ -0,0 +1,99 @@
+# Builds reduced Web Services V4 WSDLs for local stand-in servers and benchmarks. The WSDLs follow the layout of the
+# ones generated by the wsdl.aspx endpoint (Input/Header/Parameters, Output/Input/Result/Header/DataRows), but only
+# describe the operations and fields they are given.
+
+from datetime import datetime
+import re
+
+IRESS_NAMESPACE = "http://webservices.iress.com.au/v4/"
+
+INTEGER_PATTERN = re.compile(r"^-?\d+$")
+
+STANDARD_HEADER_FIELDS = [("RequestID", "xsd:string"), ("Updates", "xsd:boolean"), ("Timeout", "xsd:int"), ("PageSize", "xsd:int"), ("WaitForResponse", "xsd:boolean"), ("PagingBookmark", None), ("PagingDirection", "xsd:int"), ("InputLocalizationType", "xsd:int"), ("OutputLocalizationType", "xsd:int")]
+
+def InferXsdType(text):
+    # Guess the xsd type of a field from a sample value, for building WSDLs from the sample request and response XML
+    if not text:
+        return "xsd:string"
+    if text in ("true", "false"):
+        return "xsd:boolean"
+    if INTEGER_PATTERN.match(text):
+        return "xsd:long"
+    try:
+        float(text)
+        return "xsd:double"
+    except ValueError:
+        pass
+    if "T" in text:
+        try:
+            datetime.fromisoformat(text)
+            return "xsd:dateTime"
+        except ValueError:
+            pass
+    return "xsd:string"
+
+# Operations are given as a dict of operation name to a dict with the "SessionKeyField" of the input header, the
+# "Parameters" as (name, xsd type, array item name) where the item name is only set for the parallel "...Array"
+# parameters, and the "DataRow" fields as (name, xsd type).
+
+def BuildOperationSchema(operationName, operation):
+    schema = []
+    schema.append('<xsd:element name="{0}"><xsd:complexType><xsd:sequence><xsd:element name="Input" type="tns:{0}Input" /></xsd:sequence></xsd:complexType></xsd:element>'.format(operationName))
+    schema.append('<xsd:element name="{0}Response"><xsd:complexType><xsd:sequence><xsd:element minOccurs="0" maxOccurs="1" name="Output" type="tns:{0}Output" /></xsd:sequence></xsd:complexType></xsd:element>'.format(operationName))
+    schema.append('<xsd:complexType name="{0}Input"><xsd:sequence><xsd:element minOccurs="1" maxOccurs="1" name="Header" type="tns:{0}InputHeader" nillable="true" /><xsd:element minOccurs="1" maxOccurs="1" name="Parameters" type="tns:{0}InputParameters" nillable="true" /><xsd:any processContents="lax" minOccurs="0" maxOccurs="unbounded" /></xsd:sequence></xsd:complexType>'.format(operationName))
+
+    headerFields = [(operation["SessionKeyField"], "xsd:string")] + STANDARD_HEADER_FIELDS
+    schema.append('<xsd:complexType name="{}InputHeader"><xsd:sequence>'.format(operationName))
+    for fieldName, fieldType in headerFields:
+        schema.append('<xsd:element minOccurs="0" maxOccurs="1" name="{}" type="{}" nillable="true" />'.format(fieldName, fieldType or "tns:{}PagingBookmark".format(operationName)))
+    schema.append('<xsd:any processContents="lax" minOccurs="0" maxOccurs="unbounded" /></xsd:sequence></xsd:complexType>')
+    schema.append('<xsd:complexType name="{}PagingBookmark"><xsd:sequence><xsd:any processContents="lax" minOccurs="0" maxOccurs="unbounded" /></xsd:sequence></xsd:complexType>'.format(operationName))
+
+    schema.append('<xsd:complexType name="{}InputParameters"><xsd:sequence>'.format(operationName))
+    for parameterName, parameterType, arrayItemName in operation["Parameters"]:
+        if arrayItemName:
+            schema.append('<xsd:element name="{}" nillable="true" minOccurs="0" maxOccurs="1"><xsd:complexType><xsd:sequence><xsd:element name="{}" type="{}" nillable="true" minOccurs="0" maxOccurs="unbounded" /></xsd:sequence></xsd:complexType></xsd:element>'.format(parameterName, arrayItemName, parameterType))
+        else:
+            schema.append('<xsd:element name="{}" minOccurs="0" maxOccurs="1" type="{}" nillable="true" />'.format(parameterName, parameterType))
+    schema.append('<xsd:any processContents="lax" minOccurs="0" maxOccurs="unbounded" /></xsd:sequence></xsd:complexType>')
+
+    schema.append('<xsd:complexType name="{0}Output"><xsd:sequence><xsd:element minOccurs="0" maxOccurs="1" name="Input" type="tns:{0}Input" /><xsd:element minOccurs="0" maxOccurs="1" name="Result" type="tns:{0}Result" /></xsd:sequence></xsd:complexType>'.format(operationName))
+    schema.append('<xsd:complexType name="{0}Result"><xsd:sequence><xsd:element minOccurs="1" maxOccurs="1" name="Header" type="tns:{0}OutputHeader" /><xsd:element minOccurs="1" maxOccurs="1" name="HeaderRow" type="tns:{0}HeaderRow" /><xsd:element minOccurs="1" maxOccurs="1" name="DataRows" type="tns:ArrayOf{0}DataRow" /><xsd:element minOccurs="1" maxOccurs="1" name="ErrorRows" type="tns:ArrayOf{0}ErrorRow" /><xsd:any processContents="lax" minOccurs="0" maxOccurs="unbounded" /></xsd:sequence></xsd:complexType>'.format(operationName))
+    schema.append('<xsd:complexType name="{0}OutputHeader"><xsd:sequence><xsd:element minOccurs="1" maxOccurs="1" name="RequestID" type="xsd:string" /><xsd:element minOccurs="1" maxOccurs="1" name="StatusCode" type="xsd:int" /><xsd:element minOccurs="1" maxOccurs="1" name="WebServiceTimeStamp" type="xsd:dateTime" /><xsd:element minOccurs="1" maxOccurs="1" name="PagingBookmark" type="tns:{0}PagingBookmark" /><xsd:any processContents="lax" minOccurs="0" maxOccurs="unbounded" /></xsd:sequence></xsd:complexType>'.format(operationName))
+    schema.append('<xsd:complexType name="{}HeaderRow"><xsd:sequence><xsd:any processContents="lax" minOccurs="0" maxOccurs="unbounded" /></xsd:sequence></xsd:complexType>'.format(operationName))
+
+    schema.append('<xsd:complexType name="{}DataRow"><xsd:sequence>'.format(operationName))
+    for fieldName, fieldType in operation["DataRow"]:
+        schema.append('<xsd:element minOccurs="0" maxOccurs="1" name="{}" type="{}" nillable="true" />'.format(fieldName, fieldType))
+    schema.append('<xsd:any processContents="lax" minOccurs="0" maxOccurs="unbounded" /></xsd:sequence></xsd:complexType>')
+    schema.append('<xsd:complexType name="ArrayOf{0}DataRow"><xsd:sequence><xsd:element minOccurs="0" maxOccurs="unbounded" name="DataRow" nillable="true" type="tns:{0}DataRow" /></xsd:sequence></xsd:complexType>'.format(operationName))
+    schema.append('<xsd:complexType name="{}ErrorRow"><xsd:sequence><xsd:any processContents="lax" minOccurs="0" maxOccurs="unbounded" /></xsd:sequence></xsd:complexType>'.format(operationName))
+    schema.append('<xsd:complexType name="ArrayOf{0}ErrorRow"><xsd:sequence><xsd:element minOccurs="0" maxOccurs="unbounded" name="ErrorRow" nillable="true" type="tns:{0}ErrorRow" /></xsd:sequence></xsd:complexType>'.format(operationName))
+    return "".join(schema)
+
+def BuildStandInWsdl(address, operations, serviceName="IOSPLUS"):
+    wsdl = []
+    wsdl.append('<wsdl:definitions xmlns:soap="http://schemas.xmlsoap.org/wsdl/soap/" xmlns:xsd="http://www.w3.org/2001/XMLSchema" xmlns:tns="{0}" targetNamespace="{0}" xmlns:wsdl="http://schemas.xmlsoap.org/wsdl/">'.format(IRESS_NAMESPACE))
+    wsdl.append('<wsdl:types><xsd:schema xmlns:tns="{0}" targetNamespace="{0}" elementFormDefault="qualified">'.format(IRESS_NAMESPACE))
+    wsdl.append('<xsd:complexType name="IRESSDictionary"><xsd:sequence><xsd:element minOccurs="0" maxOccurs="unbounded" name="Elements"><xsd:complexType><xsd:sequence><xsd:element name="Key" nillable="true" type="xsd:string" /><xsd:element name="Value" nillable="true" type="xsd:string" /></xsd:sequence></xsd:complexType></xsd:element></xsd:sequence></xsd:complexType>')
+    for operationName, operation in operations.items():
+        wsdl.append(BuildOperationSchema(operationName, operation))
+    wsdl.append('</xsd:schema></wsdl:types>')
+
+    for operationName in operations:
+        wsdl.append('<wsdl:message name="{0}InputMessage"><wsdl:part name="parameters" element="tns:{0}" /></wsdl:message>'.format(operationName))
+        wsdl.append('<wsdl:message name="{0}OutputMessage"><wsdl:part name="parameters" element="tns:{0}Response" /></wsdl:message>'.format(operationName))
+
+    wsdl.append('<wsdl:portType name="I{}Soap">'.format(serviceName))
+    for operationName in operations:
+        wsdl.append('<wsdl:operation name="{0}"><wsdl:input message="tns:{0}InputMessage" /><wsdl:output message="tns:{0}OutputMessage" /></wsdl:operation>'.format(operationName))
+    wsdl.append('</wsdl:portType>')
+
+    wsdl.append('<wsdl:binding name="{0}Soap" type="tns:I{0}Soap"><soap:binding transport="http://schemas.xmlsoap.org/soap/http" />'.format(serviceName))
+    for operationName in operations:
+        wsdl.append('<wsdl:operation name="{0}"><soap:operation soapAction="{1}{2}/{0}" /><wsdl:input><soap:body use="literal" /></wsdl:input><wsdl:output><soap:body use="literal" /></wsdl:output></wsdl:operation>'.format(operationName, IRESS_NAMESPACE, serviceName))
+    wsdl.append('</wsdl:binding>')
+
+    wsdl.append('<wsdl:service name="{0}Service"><wsdl:port name="{0}Soap" binding="tns:{0}Soap"><soap:address location="{1}" /></wsdl:port></wsdl:service>'.format(serviceName, address))
+    wsdl.append('</wsdl:definitions>')
+    return "".join(wsdl)
@@ -0,0 +1,177 @@
+from datetime import date, timedelta
+import json
+import os
+import re
+import threading
+import numpy as np
+
+import rawResponse
+
+# Local history store for TimeSeriesGet2 results. Each series, a security, exchange and frequency, is kept as a
+# NumPy structured array in a .npy file, sorted by TimeSeriesDate, which is opened memory-mapped so a long history is
+# paged in only as it is read. Next to it a .json file records the date ranges that have been fetched, including ones
+# that returned no rows such as weekends and holidays, so that later runs request only the dates that are missing.
+#
+# Rows are added by writing them to a chunk file of their own, <series>.chunks/<n>.npy, and listing it in the .json file, so
+# adding a chunk costs the size of the chunk rather than of the whole series. read merges the chunks into the series,
+# with the rows added last winning for a TimeSeriesDate that is stored more than once. compact folds the chunks into
+# the series file, through a temporary file, and is also done once a series has maxChunks chunks. Concurrent readers
+# keep the version they opened.
+
+DEFAULT_STORE_DIRECTORY = os.path.join(os.path.expanduser("~"), ".iress", "timeseries")
+DEFAULT_MAX_CHUNKS = 100
+
+# The DataRow fields of TimeSeriesGet2 that are stored. Missing and nil values are NaN, or NaT for the date.
+TIME_SERIES_FIELDS = [("TimeSeriesDate", "datetime64[s]"), ("OpenPrice", "f8"), ("HighPrice", "f8"), ("LowPrice", "f8"), ("ClosePrice", "f8"), ("TotalVolume", "f8"), ("TotalValue", "f8"), ("TradeCount", "f8"), ("AdjustmentFactor", "f8"), ("MarketVWAP", "f8"), ("ShortSold", "f8"), ("ShortSoldPercent", "f8"), ("ShortSellPosition", "f8"), ("ShortSellPositionPercent", "f8")]
+TIME_SERIES_DTYPE = np.dtype(TIME_SERIES_FIELDS)
+TIME_SERIES_FIELD_NAMES = [fieldName for fieldName, fieldType in TIME_SERIES_FIELDS]
+
+def DecodeTimeSeries(source, resultHeader=None):
+    # Decode the DataRows of a TimeSeriesGet2 response into a TIME_SERIES_DTYPE array. The text of each column is
+    # converted by NumPy in one pass rather than value by value.
+    columns = rawResponse.DecodeColumns(source, TIME_SERIES_FIELD_NAMES, resultHeader=resultHeader)
+    rows = np.empty(len(columns["TimeSeriesDate"]), dtype=TIME_SERIES_DTYPE)
+    for fieldName, fieldType in TIME_SERIES_FIELDS:
+        missingValue = "NaT" if fieldType.startswith("datetime64") else "NaN"
+        rows[fieldName] = np.array([value or missingValue for value in columns[fieldName]], dtype=fieldType)
+    return rows
+
+def MergeRanges(ranges):
+    # Merge inclusive (from date, to date) ranges that overlap or are next to each other
+    mergedRanges = []
+    for fromDate, toDate in sorted(ranges):
+        if mergedRanges and fromDate <= mergedRanges[-1][1] + timedelta(days=1):
+            mergedRanges[-1] = (mergedRanges[-1][0], max(mergedRanges[-1][1], toDate))
+        else:
+            mergedRanges.append((fromDate, toDate))
+    return mergedRanges
+
+def GetMissingRanges(coveredRanges, fromDate, toDate):
+    # Return the inclusive ranges between fromDate and toDate that are not covered
+    missingRanges = []
+    nextDate = fromDate
+    for coveredFromDate, coveredToDate in MergeRanges(coveredRanges):
+        if coveredToDate < nextDate:
+            continue
+        if coveredFromDate > toDate:
+            break
+        if coveredFromDate > nextDate:
+            missingRanges.append((nextDate, coveredFromDate - timedelta(days=1)))
+        nextDate = coveredToDate + timedelta(days=1)
+    if nextDate <= toDate:
+        missingRanges.append((nextDate, toDate))
+    return missingRanges
+
+def SplitRange(fromDate, toDate, days):
+    # Split an inclusive range into consecutive ranges of at most days days
+    while fromDate <= toDate:
+        chunkToDate = min(fromDate + timedelta(days=days - 1), toDate)
+        yield fromDate, chunkToDate
+        fromDate = chunkToDate + timedelta(days=1)
+
+def SafeFileName(name):
+    return re.sub(r"[^A-Za-z0-9._-]", "_", name)
+
+def MergeRows(rowArrays):
+    # Merge arrays of rows into one sorted by TimeSeriesDate. A stable sort keeps the rows of each date in the order
+    # of the arrays, so keeping the last row of each date keeps the one from the latest array.
+    allRows = np.concatenate(rowArrays) if rowArrays else np.empty(0, dtype=TIME_SERIES_DTYPE)
+    allRows = allRows[np.argsort(allRows["TimeSeriesDate"], kind="stable")]
+    timeSeriesDates = allRows["TimeSeriesDate"]
+    return allRows[np.append(timeSeriesDates[1:] != timeSeriesDates[:-1], True)] if len(allRows) else allRows
+
+class TimeSeriesStore:
+    def __init__(self, directory=DEFAULT_STORE_DIRECTORY, maxChunks=DEFAULT_MAX_CHUNKS):
+        self.directory = directory
+        self.maxChunks = maxChunks
+        self.lock = threading.Lock()
+
+    def getSeriesPath(self, securityCode, exchange, frequency):
+        # The path of the series without its extension
+        return os.path.join(self.directory, SafeFileName(frequency), SafeFileName(exchange), SafeFileName(securityCode))
+
+    def readIndex(self, seriesPath):
+        # The covered ranges and chunk files of a series, as written by writeIndex
+        if not os.path.isfile(seriesPath + ".json"):
+            return { "CoveredRanges": [], "Chunks": [], "NextChunk": 1 }
+        with open(seriesPath + ".json") as indexFile:
+            index = json.load(indexFile)
+        index.setdefault("Chunks", [])
+        index.setdefault("NextChunk", 1)
+        return index
+
+    def writeIndex(self, seriesPath, index):
+        temporaryFileName = "{}.{}.tmp.json".format(seriesPath, os.getpid())
+        with open(temporaryFileName, "w") as indexFile:
+            json.dump(index, indexFile)
+        os.replace(temporaryFileName, seriesPath + ".json")
+
+    def getCoveredRanges(self, securityCode, exchange, frequency):
+        index = self.readIndex(self.getSeriesPath(securityCode, exchange, frequency))
+        return [(date.fromisoformat(fromDate), date.fromisoformat(toDate)) for fromDate, toDate in index["CoveredRanges"]]
+
+    def getMissingRanges(self, securityCode, exchange, frequency, fromDate, toDate):
+        return GetMissingRanges(self.getCoveredRanges(securityCode, exchange, frequency), fromDate, toDate)
+
+    def readRows(self, seriesPath, chunkFileNames):
+        seriesFileName = seriesPath + ".npy"
+        rows = np.load(seriesFileName, mmap_mode="r") if os.path.isfile(seriesFileName) else np.empty(0, dtype=TIME_SERIES_DTYPE)
+        if not chunkFileNames:
+            return rows
+        return MergeRows([rows] + [np.load(os.path.join(seriesPath + ".chunks", chunkFileName)) for chunkFileName in chunkFileNames])
+
+    def read(self, securityCode, exchange, frequency):
+        # Return the stored rows, or an empty array when nothing is stored. Each field, such as rows["ClosePrice"], is a
+        # column view. A compacted series is memory-mapped read only, otherwise its chunks are merged into memory.
+        seriesPath = self.getSeriesPath(securityCode, exchange, frequency)
+        try:
+            return self.readRows(seriesPath, self.readIndex(seriesPath)["Chunks"])
+        except FileNotFoundError:
+            # A compaction removed the chunks after the index was read. It writes the series file and index first, so
+            # reading the index again finds the compacted rows.
+            return self.readRows(seriesPath, self.readIndex(seriesPath)["Chunks"])
+
+    def add(self, securityCode, exchange, frequency, rows, fromDate, toDate):
+        # Add rows fetched for the inclusive range fromDate to toDate to the series as a new chunk, and record the range
+        # as covered unless toDate is before fromDate. Rows for a TimeSeriesDate that is already stored replace the
+        # stored ones when the series is read.
+        seriesPath = self.getSeriesPath(securityCode, exchange, frequency)
+        rows = rows[~np.isnat(rows["TimeSeriesDate"])]
+        with self.lock:
+            os.makedirs(seriesPath + ".chunks", exist_ok=True)
+            index = self.readIndex(seriesPath)
+            if len(rows):
+                chunkFileName = "{}.npy".format(index["NextChunk"])
+                np.save(os.path.join(seriesPath + ".chunks", chunkFileName), rows)
+                index["Chunks"].append(chunkFileName)
+                index["NextChunk"] = index["NextChunk"] + 1
+
+            # The chunk is written before the index lists it, so a failure in between only means the range is fetched
+            # again
+            coveredRanges = MergeRanges([(date.fromisoformat(coveredFromDate), date.fromisoformat(coveredToDate)) for coveredFromDate, coveredToDate in index["CoveredRanges"]] + ([(fromDate, toDate)] if fromDate <= toDate else []))
+            index["CoveredRanges"] = [(coveredFromDate.isoformat(), coveredToDate.isoformat()) for coveredFromDate, coveredToDate in coveredRanges]
+            self.writeIndex(seriesPath, index)
+            if len(index["Chunks"]) >= self.maxChunks:
+                self.compactSeries(seriesPath, index)
+
+    def compactSeries(self, seriesPath, index):
+        # Fold the chunks into the series file. The index stops listing the chunks only once the series file holds
+        # their rows, and they are deleted after that, so a failure at any point leaves the same rows readable.
+        if not index["Chunks"]:
+            return
+        temporaryFileName = "{}.{}.tmp.npy".format(seriesPath, os.getpid())
+        np.save(temporaryFileName, self.readRows(seriesPath, index["Chunks"]))
+        os.replace(temporaryFileName, seriesPath + ".npy")
+        chunkFileNames = index["Chunks"]
+        index["Chunks"] = []
+        self.writeIndex(seriesPath, index)
+        for chunkFileName in chunkFileNames:
+            os.remove(os.path.join(seriesPath + ".chunks", chunkFileName))
+
+    def compact(self, securityCode, exchange, frequency):
+        # Fold the chunks added to the series into its series file, so that it is read memory-mapped again. Returns the
+        # number of rows in the series.
+        seriesPath = self.getSeriesPath(securityCode, exchange, frequency)
+        with self.lock:
+            self.compactSeries(seriesPath, self.readIndex(seriesPath))
+        return len(self.read(securityCode, exchange, frequency))
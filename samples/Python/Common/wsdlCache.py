@@ -0,0 +1,102 @@
+from lxml import etree
+import glob
+import hashlib
+import logging
+import os
+import time
+
+# On-disk cache of the WSDLs generated by the Web Services wsdl.aspx endpoint. Generating and downloading the WSDL for a
+# service dominates the start up time of short running jobs, so it is fetched once, validated, and reused from disk
+# until it is older than the TTL. In offline mode nothing is fetched, and any WSDL already on disk that supports the
+# requested methods is used, such as the ones checked in under samples/C#/iosplus-download/WebServices.
+
+DEFAULT_CACHE_DIRECTORY = os.path.join(os.path.expanduser("~"), ".iress", "wsdlcache")
+DEFAULT_TTL = 24 * 60 * 60
+
+WSDL_NAMESPACE = "http://schemas.xmlsoap.org/wsdl/"
+
+class WsdlCacheError(Exception):
+    pass
+
+def BuildWsdlUrl(endpoint, service, server, methodList):
+    return "{}?svc={}&svr={}&mf={}".format(endpoint, service, server, methodList)
+
+def GetCacheFileName(endpoint, service, server, methodList):
+    # Key the cache on the service, server and method list. The endpoint is part of the key too, so that WSDLs for
+    # different environments do not overwrite each other.
+    methods = ",".join(sorted(method.strip() for method in methodList.split(",") if method.strip()))
+    keyHash = hashlib.sha1("{}|{}|{}|{}".format(endpoint, service, server, methods).encode("utf-8")).hexdigest()[:12]
+    return "{}_{}_{}.wsdl".format(service, server or "default", keyHash)
+
+def GetWsdlOperations(wsdlContent):
+    # Return the operation names declared by the WSDL, or None if the content is not a WSDL document.
+    try:
+        wsdlRoot = etree.fromstring(wsdlContent, etree.XMLParser(huge_tree=True, resolve_entities=False))
+    except etree.XMLSyntaxError:
+        return None
+    if wsdlRoot.tag != "{%s}definitions" % WSDL_NAMESPACE:
+        return None
+    return set(operation.get("name") for operation in wsdlRoot.iterfind("{0}portType/{0}operation".format("{%s}" % WSDL_NAMESPACE)))
+
+def IsValidWsdl(wsdlContent, methodList):
+    operations = GetWsdlOperations(wsdlContent)
+    if not operations:
+        return False
+    return all(method.strip() in operations for method in methodList.split(",") if method.strip())
+
+def ReadFile(fileName):
+    with open(fileName, "rb") as wsdlFile:
+        return wsdlFile.read()
+
+def WriteFileAtomically(fileName, content):
+    # Write to a temporary file first so concurrent jobs never see a partially written WSDL.
+    temporaryFileName = "{}.{}.tmp".format(fileName, os.getpid())
+    with open(temporaryFileName, "wb") as wsdlFile:
+        wsdlFile.write(content)
+    os.replace(temporaryFileName, fileName)
+
+def FindOfflineWsdl(cacheDirectory, methodList):
+    # Look through every WSDL in the cache directory for one that supports all of the requested methods.
+    for fileName in sorted(glob.glob(os.path.join(cacheDirectory, "*.wsdl"))):
+        if IsValidWsdl(ReadFile(fileName), methodList):
+            return fileName
+    return None
+
+def GetWsdl(session, endpoint, service, server, methodList, cacheDirectory=DEFAULT_CACHE_DIRECTORY, ttl=DEFAULT_TTL, offline=False):
+    # Return a local path to a WSDL for the service that supports the methods in methodList, fetching it through the
+    # requests session only when there is no valid cached copy younger than ttl seconds. Pass cacheDirectory=None to
+    # bypass the cache and use the WSDL URL directly.
+    wsdlUrl = BuildWsdlUrl(endpoint, service, server, methodList)
+    if cacheDirectory is None:
+        return wsdlUrl
+
+    cacheFileName = os.path.join(cacheDirectory, GetCacheFileName(endpoint, service, server, methodList))
+    cachedWsdlIsValid = os.path.isfile(cacheFileName) and IsValidWsdl(ReadFile(cacheFileName), methodList)
+
+    if offline:
+        if cachedWsdlIsValid:
+            return cacheFileName
+        offlineFileName = FindOfflineWsdl(cacheDirectory, methodList)
+        if offlineFileName is None:
+            raise WsdlCacheError("No cached WSDL in {} supports the methods {}".format(cacheDirectory, methodList))
+        return offlineFileName
+
+    if cachedWsdlIsValid and time.time() - os.path.getmtime(cacheFileName) < ttl:
+        return cacheFileName
+
+    try:
+        wsdlResponse = session.get(wsdlUrl, timeout=60)
+        wsdlResponse.raise_for_status()
+        wsdlContent = wsdlResponse.content
+        if not IsValidWsdl(wsdlContent, methodList):
+            raise WsdlCacheError("WSDL returned from {} does not support the methods {}".format(wsdlUrl, methodList))
+    except Exception as ex:
+        # Keep running from an expired copy rather than failing outright when the endpoint is unavailable.
+        if cachedWsdlIsValid:
+            logging.getLogger(__name__).warning("Refreshing cached WSDL failed, using expired copy {}. Error: {}".format(cacheFileName, str(ex)))
+            return cacheFileName
+        raise
+
+    os.makedirs(cacheDirectory, exist_ok=True)
+    WriteFileAtomically(cacheFileName, wsdlContent)
+    return cacheFileName
@@ -10,7 +10,30 @@ import time
 import sys
 import click
 import distutils.util
+import queue
+import threading
 import uuid
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), "..", "Common"))
+import wsdlCache
+import pager
+from sessionManager import SessionManager, DEFAULT_STORE_PATH, DEFAULT_SESSION_LIFETIME
+from quoteService import QuoteService
+from securityKey import SecurityKey
+from requestScheduler import RequestScheduler, InstallTransientStatusHook, DEFAULT_MAX_ATTEMPTS
+from soapMetrics import SoapMetrics, MeteredClient, ServeMetrics
+
+# A quote alert waiting to be created for a portfolio position, and an existing alert waiting to be deleted
+PendingAlert = namedtuple("PendingAlert", ["AlertOperator", "SecurityCode", "Exchange", "AlertPrice", "PortfolioCode", "Memo"])
+ExistingAlert = namedtuple("ExistingAlert", ["AlertID", "SecurityCode", "SecurityOperator", "LastPrice", "LastPriceOperator", "AlertMemo"])
+
+# The key IRESS calls are scheduled under, IOS+ calls are scheduled under their server name
+IRESS_SCHEDULER_KEY = ("IRESS", "")
+
+# Marks the end of the positions placed on the position queue by RetrievePortfolioPositions
+END_OF_POSITIONS = object()
 
 def logInfo(message):
     logger = logging.getLogger(__name__)
@@ -20,45 +43,115 @@ def logError(message):
     logger = logging.getLogger(__name__)
     logger.error(message)    
 
-def DeleteAlert(iressClient, iressClientFactory, iressSessionKey, alertId, securityCode, securityOperator, lastPrice, lastPriceOperator, alertMemo):
-    #logInfo("Deleting alert with AlertID {} for {} at price {:.3f} [{}]".format(alertId, securityCode, lastPrice, alertMemo))
-     
-    # Delete alert with the specified alert ID
-    alertDeleteInputParameters = iressClientFactory.AlertDeleteInputParameters(AlertIDArray=[alertId])
+def DeleteAlerts(iressClient, iressClientFactory, scheduler, iressSessionKey, existingAlerts):
+    # Delete all of the alerts with a single AlertDelete call. Each DataRow carries the AlertID it relates to, which is
+    # used to report the result against the alert that was requested.
+    alertsById = { existingAlert.AlertID: existingAlert for existingAlert in existingAlerts }
+    alertDeleteInputParameters = iressClientFactory.AlertDeleteInputParameters(AlertIDArray={"AlertID": [existingAlert.AlertID for existingAlert in existingAlerts]})
     try:
-        alertDeleteResponse = iressClient.service.AlertDelete(iressClientFactory.AlertDeleteInput(Header=iressClientFactory.AlertDeleteInputHeader(SessionKey=iressSessionKey),Parameters=alertDeleteInputParameters))
+        alertDeleteRequestID = str(uuid.uuid4()) # Sent again with any retry, so the server can tell it is a repeat
+        alertDeleteInput = iressClientFactory.AlertDeleteInput(Header=iressClientFactory.AlertDeleteInputHeader(SessionKey=iressSessionKey, RequestID=alertDeleteRequestID),Parameters=alertDeleteInputParameters)
+        alertDeleteResponse = scheduler.call(IRESS_SCHEDULER_KEY, "AlertDelete", iressClient.service.AlertDelete, alertDeleteInput, requestId=alertDeleteRequestID)
     except Exception as ex:
-        logError("Alert deletion failed for AlertID {} for {} at price {:.3f} [{}]. Error: {}".format(alertId, securityCode, lastPrice, alertMemo, str(ex)))
-        return
+        for existingAlert in existingAlerts:
+            logError("Alert deletion failed for AlertID {} for {} at price {:.3f} [{}]. Error: {}".format(existingAlert.AlertID, existingAlert.SecurityCode, existingAlert.LastPrice, existingAlert.AlertMemo, str(ex)))
+        return 0
     except:
-        logError("Alert deletion failed for AlertID {} for {} at price {:.3f} [{}]. Error: Unspecified".format(alertId, securityCode, lastPrice, alertMemo))
-        return
+        for existingAlert in existingAlerts:
+            logError("Alert deletion failed for AlertID {} for {} at price {:.3f} [{}]. Error: Unspecified".format(existingAlert.AlertID, existingAlert.SecurityCode, existingAlert.LastPrice, existingAlert.AlertMemo))
+        return 0
 
+    alertsDeletedCount = 0
     if alertDeleteResponse.Result.DataRows:
         alertDeleteDataRows = alertDeleteResponse.Result.DataRows
-        
+
         for alertDeleteResponseDataRow in alertDeleteDataRows.DataRow:
             errorNumber = alertDeleteResponseDataRow.ErrorNumber
             errorDescription = alertDeleteResponseDataRow.ErrorDescription
             alertId = alertDeleteResponseDataRow.AlertID
-            
+            existingAlert = alertsById.get(alertId, ExistingAlert(alertId, "", "", "", "", ""))
+
             if errorNumber == 0:
-                logInfo("Alert deletion succeeded for AlertID {} for {} at price {} [{}]".format(alertId, securityCode, lastPrice, alertMemo))
+                logInfo("Alert deletion succeeded for AlertID {} for {} at price {} [{}]".format(alertId, existingAlert.SecurityCode, existingAlert.LastPrice, existingAlert.AlertMemo))
+                alertsDeletedCount = alertsDeletedCount + 1
             else:
-                logError("Alert deletion failed for AlertID {} for {} at price {} [{}] - ErrorNumber {} ErrorDescription: {}".format(alertId, securityCode, lastPrice, alertMemo, errorNumber, errorDescription))
-
-def WipeExistingAlerts(iressClient, iressClientFactory, iressSessionKey):
+                logError("Alert deletion failed for AlertID {} for {} at price {} [{}] - ErrorNumber {} ErrorDescription: {}".format(alertId, existingAlert.SecurityCode, existingAlert.LastPrice, existingAlert.AlertMemo, errorNumber, errorDescription))
+
+    return alertsDeletedCount
+
+def ParseToolAlert(alertGetResponseDataRow):
+    # Return an alert from AlertGet as an ExistingAlert if it was created by this tool, otherwise None. If the alert
+    # memo contains the text "PortfolioCode -" we know it was generated previously with this tool.
+    alertMemo = alertGetResponseDataRow.AlertMemo
+    if not alertMemo or alertMemo.find("PortfolioCode -") == -1:
+        return None
+
+    # Find the index of the Security
+    alertFieldNamesArray = alertGetResponseDataRow.AlertFieldNames.split(";")
+    if ('Security' not in alertFieldNamesArray) or ('Last' not in alertFieldNamesArray):
+        return None
+    securityIndex = alertFieldNamesArray.index("Security")
+    lastIndex = alertFieldNamesArray.index("Last")
+    alertFieldValues = alertGetResponseDataRow.AlertFieldValues.split(";")
+    securityCode = alertFieldValues[securityIndex]
+    lastPrice = Decimal(alertFieldValues[lastIndex])
+    alertFieldOperatorArray = alertGetResponseDataRow.AlertFieldOperators.split(";")
+    securityOperator = alertFieldOperatorArray[securityIndex]
+    lastPriceOperator = alertFieldOperatorArray[lastIndex]
+    return ExistingAlert(alertGetResponseDataRow.AlertID, securityCode, securityOperator, lastPrice, lastPriceOperator, alertMemo)
+
+def AlertKey(security, alertOperator, alertPrice, memo):
+    # Identifies an alert by what it watches rather than by AlertID. The price is compared as it is sent in AlertCreate,
+    # to three decimal places.
+    return (security.upper(), alertOperator, "{:.3f}".format(alertPrice), memo)
+
+def GetExistingAlerts(iressClient, iressClientFactory, scheduler, iressSessionKey, pageSize=pager.DEFAULT_PAGE_SIZE):
+    # Index the tool's existing alerts by AlertKey. Each key holds a list, as the same alert may have been created more
+    # than once. Returns None if the alerts could not be retrieved.
+    logInfo("Retrieving existing alerts")
+    existingAlerts = {}
+    alertGetInputParameters = iressClientFactory.AlertGetInputParameters()
+    try:
+        for alertGetResponseDataRow in pager.GetDataRows(lambda pagingHeader: scheduler.call(IRESS_SCHEDULER_KEY, "AlertGet", iressClient.service.AlertGet, iressClientFactory.AlertGetInput(Header=iressClientFactory.AlertGetInputHeader(SessionKey=iressSessionKey, **pagingHeader),Parameters=alertGetInputParameters)), pageSize):
+            existingAlert = ParseToolAlert(alertGetResponseDataRow)
+            if existingAlert is not None:
+                existingAlerts.setdefault(AlertKey(existingAlert.SecurityCode, existingAlert.LastPriceOperator, existingAlert.LastPrice, existingAlert.AlertMemo), []).append(existingAlert)
+    except Exception as ex:
+        logError("Unable to reconcile existing alerts. Alert retrieval failed. Error: {}".format(str(ex)))
+        return None
+    except:
+        logError("Unable to reconcile existing alerts. Alert retrieval failed. Error: Unspecified")
+        return None
+
+    logInfo("Found {} existing alerts created by the Portfolio Alerter tool".format(sum(len(alerts) for alerts in existingAlerts.values())))
+    return existingAlerts
+
+def DeleteStaleAlerts(iressClient, iressClientFactory, scheduler, iressSessionKey, existingAlerts, retrievalSummary, dryrun, batchSize):
+    # The existing alerts no positions matched are stale. They are only deleted once every portfolio's positions were
+    # retrieved, as otherwise the alerts of the portfolios that failed would look stale too. Returns the stale alerts
+    # and the number deleted.
+    staleAlerts = [existingAlert for matchingAlerts in existingAlerts.values() for existingAlert in matchingAlerts]
+    alertsDeletedCount = 0
+    if retrievalSummary["Failed"] or retrievalSummary["GroupFailed"]:
+        logError("Not deleting {} stale alerts, as the positions of some portfolios could not be retrieved.".format(len(staleAlerts)))
+    elif dryrun:
+        for existingAlert in staleAlerts:
+            logInfo("Dry run: would delete AlertID {} for {} at price {} [{}]".format(existingAlert.AlertID, existingAlert.SecurityCode, existingAlert.LastPrice, existingAlert.AlertMemo))
+    else:
+        for index in range(0, len(staleAlerts), batchSize):
+            alertsDeletedCount = alertsDeletedCount + DeleteAlerts(iressClient, iressClientFactory, scheduler, iressSessionKey, staleAlerts[index:index + batchSize])
+    return staleAlerts, alertsDeletedCount
+
+def WipeExistingAlerts(iressClient, iressClientFactory, scheduler, iressSessionKey, pageSize=pager.DEFAULT_PAGE_SIZE):
     logInfo("Wiping existing alerts")
 
-    alertGetMoreDataAvailable = True
-    alertGetRequestID = str(uuid.uuid4()) # Generate a request ID to support paging through the AlertGet method
+    # Get existing alerts, one page at a time. The pager requests the next page while this one is being deleted.
+    alertGetInputParameters = iressClientFactory.AlertGetInputParameters()
+    alertGetPages = pager.GetPages(lambda pagingHeader: scheduler.call(IRESS_SCHEDULER_KEY, "AlertGet", iressClient.service.AlertGet, iressClientFactory.AlertGetInput(Header=iressClientFactory.AlertGetInputHeader(SessionKey=iressSessionKey, **pagingHeader),Parameters=alertGetInputParameters)), pageSize)
 
-    # Get existing alerts
-    while alertGetMoreDataAvailable:
+    while True:
         try: 
-            alertGetInputParameters = iressClientFactory.AlertGetInputParameters()
-            alertGetInput = iressClientFactory.AlertGetInput(Header=iressClientFactory.AlertGetInputHeader(SessionKey=iressSessionKey, RequestID=alertGetRequestID),Parameters=alertGetInputParameters)
-            alertGetResponse = iressClient.service.AlertGet(alertGetInput)
+            alertGetDataRows = next(alertGetPages, None)
         except Exception as ex:
             logError("Unable to wipe existing alerts. Alert retrieval failed. Error: {}".format(str(ex)))
             return
@@ -66,60 +159,167 @@ def WipeExistingAlerts(iressClient, iressClientFactory, iressSessionKey):
             logError("Unable to wipe existing alerts. Alert retrieval failed. Error: Unspecified")    
             return
 
-        # Check requet status to determine if there is any more data available after this response
-        alertGetRequestStatus = alertGetResponse.Result.Header.StatusCode
-        if alertGetRequestStatus != 1:
-            alertGetMoreDataAvailable = False
-
-        if alertGetResponse.Result.DataRows:
-            alertGetDataRows = alertGetResponse.Result.DataRows
-            
-            for alertGetResponseDataRow in alertGetDataRows.DataRow:
-                alertMemo = alertGetResponseDataRow.AlertMemo
-                
-                # If the alert memo contains the text "PortfolioCode -" we know it was generated previously with this tool. Delete the alert.
-                if alertMemo:
-                    if alertMemo.find("PortfolioCode -") > -1:
-                        alertId = alertGetResponseDataRow.AlertID
-
-                        # Find the index of the Security
-                        alertFieldNamesArray = alertGetResponseDataRow.AlertFieldNames.split(";")
-                        if ('Security' in alertFieldNamesArray) and ('Last' in alertFieldNamesArray):
-                            securityIndex = alertFieldNamesArray.index("Security")
-                            lastIndex = alertFieldNamesArray.index("Last")
-                            alertFieldValues = alertGetResponseDataRow.AlertFieldValues.split(";")
-                            securityCode = alertFieldValues[securityIndex]
-                            lastPrice = Decimal(alertFieldValues[lastIndex])
-                            alertFieldOperatorArray = alertGetResponseDataRow.AlertFieldOperators.split(";")
-                            securityOperator = alertFieldOperatorArray[securityIndex]
-                            lastPriceOperator = alertFieldOperatorArray[lastIndex]
-
-                            DeleteAlert(iressClient, iressClientFactory, iressSessionKey, alertId, securityCode, securityOperator, lastPrice, lastPriceOperator, alertMemo)
-
-def CreateQuoteAlert(iressClient, iressClientFactory, iressSessionKey, alertOperator, securityCode, exchange, alertPrice, portfolioCode, memo):
+        if alertGetDataRows is None:
+            return
+
+        # Delete every alert on this page that was generated previously with this tool
+        alertsToDelete = [existingAlert for existingAlert in map(ParseToolAlert, alertGetDataRows) if existingAlert is not None]
+
+        # Delete the tool's alerts from this page with a single AlertDelete call
+        if alertsToDelete:
+            DeleteAlerts(iressClient, iressClientFactory, scheduler, iressSessionKey, alertsToDelete)
+
+def CreateQuoteAlerts(iressClient, iressClientFactory, scheduler, iressSessionKey, pendingAlerts):
+    # Create all of the alerts with a single AlertCreate call. The response has one DataRow per alert, in the same order
+    # as the request arrays, which is used to map each ErrorNumber back to the position the alert was created for.
+    # A call that fails transiently is retried with the same RequestID, so the alerts are not created twice.
+    # Returns the number of alerts created successfully.
     try:
-        alertCreateInputParameters = iressClientFactory.AlertCreateInputParameters(AlertTypeArray=["Quote"], AlertFieldNamesArray=["Security;Last"],AlertFieldOperatorsArray=["==;{}".format(alertOperator)],AlertFieldValuesArray=["{}.{};{:.3f}".format(securityCode, exchange, alertPrice)],ReactivateTimeArray=[0],AlertMemoArray=[memo],UseMessageManagerNotificationsArray=[True])
-        alertCreateResponse = iressClient.service.AlertCreate(iressClientFactory.AlertCreateInput(Header=iressClientFactory.AlertCreateInputHeader(SessionKey=iressSessionKey),Parameters=alertCreateInputParameters))
-        if alertCreateResponse.Result.DataRows:
-            alertCreateDataRows = alertCreateResponse.Result.DataRows
-            
-            for alertCreateResponseDataRow in alertCreateDataRows.DataRow:
-                errorNumber = alertCreateResponseDataRow.ErrorNumber
-                errorDescription = alertCreateResponseDataRow.ErrorDescription
-                alertId = alertCreateResponseDataRow.AlertID
-
-                if errorNumber == 0:
-                    logInfo("Alert created successfully for {}.{} in portfolio {} at price {:.3f} - AlertID: {}".format(securityCode, exchange, portfolioCode, alertPrice, alertId))
-                    return True
-                else:
-                    logError("Alert create failed for {}.{} in portfolio {} at price {:.3f} - ErrorNumber {} ErrorDescription: {}".format(securityCode, exchange, portfolioCode, alertPrice, errorNumber, errorDescription))
-                    return False
+        alertCreateInputParameters = iressClientFactory.AlertCreateInputParameters(AlertTypeArray={"AlertType": ["Quote"] * len(pendingAlerts)}, AlertFieldNamesArray={"AlertFieldNames": ["Security;Last"] * len(pendingAlerts)},AlertFieldOperatorsArray={"AlertFieldOperators": ["==;{}".format(pendingAlert.AlertOperator) for pendingAlert in pendingAlerts]},AlertFieldValuesArray={"AlertFieldValues": ["{}.{};{:.3f}".format(pendingAlert.SecurityCode, pendingAlert.Exchange, pendingAlert.AlertPrice) for pendingAlert in pendingAlerts]},ReactivateTimeArray={"ReactivateTime": [0] * len(pendingAlerts)},AlertMemoArray={"AlertMemo": [pendingAlert.Memo for pendingAlert in pendingAlerts]},UseMessageManagerNotificationsArray={"UseMessageManagerNotifications": [True] * len(pendingAlerts)})
+        alertCreateRequestID = str(uuid.uuid4())
+        alertCreateInput = iressClientFactory.AlertCreateInput(Header=iressClientFactory.AlertCreateInputHeader(SessionKey=iressSessionKey, RequestID=alertCreateRequestID),Parameters=alertCreateInputParameters)
+        alertCreateResponse = scheduler.call(IRESS_SCHEDULER_KEY, "AlertCreate", iressClient.service.AlertCreate, alertCreateInput, requestId=alertCreateRequestID, idempotent=False)
     except Exception as ex:
-        logError("Alert creation failed for {}.{} in portfolio {} at price {:.3f}. Error: {}".format(securityCode, exchange, portfolioCode, alertPrice, str(ex)))
-        return False
+        for pendingAlert in pendingAlerts:
+            logError("Alert creation failed for {}.{} in portfolio {} at price {:.3f}. Error: {}".format(pendingAlert.SecurityCode, pendingAlert.Exchange, pendingAlert.PortfolioCode, pendingAlert.AlertPrice, str(ex)))
+        return 0
     except:
-        logError("Alert creation failed for {}.{} in portfolio {} at price {:.3f}. Error: Unspecified".format(securityCode, exchange, portfolioCode, alertPrice))        
-        return False
+        for pendingAlert in pendingAlerts:
+            logError("Alert creation failed for {}.{} in portfolio {} at price {:.3f}. Error: Unspecified".format(pendingAlert.SecurityCode, pendingAlert.Exchange, pendingAlert.PortfolioCode, pendingAlert.AlertPrice))
+        return 0
+
+    alertCreateDataRows = []
+    if alertCreateResponse.Result.DataRows:
+        alertCreateDataRows = alertCreateResponse.Result.DataRows.DataRow
+
+    alertsCreatedCount = 0
+    for pendingAlert, alertCreateResponseDataRow in zip(pendingAlerts, alertCreateDataRows):
+        errorNumber = alertCreateResponseDataRow.ErrorNumber
+        errorDescription = alertCreateResponseDataRow.ErrorDescription
+        alertId = alertCreateResponseDataRow.AlertID
+
+        if errorNumber == 0:
+            logInfo("Alert created successfully for {}.{} in portfolio {} at price {:.3f} - AlertID: {}".format(pendingAlert.SecurityCode, pendingAlert.Exchange, pendingAlert.PortfolioCode, pendingAlert.AlertPrice, alertId))
+            alertsCreatedCount = alertsCreatedCount + 1
+        else:
+            logError("Alert create failed for {}.{} in portfolio {} at price {:.3f} - ErrorNumber {} ErrorDescription: {}".format(pendingAlert.SecurityCode, pendingAlert.Exchange, pendingAlert.PortfolioCode, pendingAlert.AlertPrice, errorNumber, errorDescription))
+
+    # Any alert without a matching DataRow has no result to report, so treat it as failed
+    for pendingAlert in pendingAlerts[len(alertCreateDataRows):]:
+        logError("Alert create failed for {}.{} in portfolio {} at price {:.3f} - No result returned for alert".format(pendingAlert.SecurityCode, pendingAlert.Exchange, pendingAlert.PortfolioCode, pendingAlert.AlertPrice))
+
+    return alertsCreatedCount
+
+def GetPortfolioGroupPositions(iosPlusClient, iosPlusClientFactory, scheduler, schedulerKey, serviceSessionKey, portfolioCodes, positionQueue, pageSize=pager.DEFAULT_PAGE_SIZE):
+    # Request the positions for a group of portfolios with one multi-code PortfolioCodeArray, handing each page of
+    # positions to the alert creation as soon as it arrives. Returns False if the positions could not all be retrieved.
+    portfolioPositionDetailGetInputParameters = iosPlusClientFactory.PortfolioPositionDetailGetInputParameters(AccessMode=0, PortfolioCodeArray={"PortfolioCode": portfolioCodes}, IncludePositionsFromPortfoliosWithSameCashAccountArray={"IncludePositionsFromPortfoliosWithSameCashAccount": [False] * len(portfolioCodes)})
+    pagesQueuedCount = 0
+    try:
+        for portfolioPositionDetailGetDataRows in pager.GetPages(lambda pagingHeader: scheduler.call(schedulerKey, "PortfolioPositionDetailGet", iosPlusClient.service.PortfolioPositionDetailGet, iosPlusClientFactory.PortfolioPositionDetailGetInput(Header=iosPlusClientFactory.PortfolioPositionDetailGetInputHeader(ServiceSessionKey=serviceSessionKey, **pagingHeader), Parameters=portfolioPositionDetailGetInputParameters)), pageSize):
+            positionQueue.put(portfolioPositionDetailGetDataRows)
+            pagesQueuedCount = pagesQueuedCount + 1
+        return True
+    except Exception as ex:
+        logError("Portfolio position retrieval failed for PortfolioCodes {}. Error: {}".format(", ".join(portfolioCodes), str(ex)))
+    except:
+        logError("Portfolio position retrieval failed for PortfolioCodes {}. Error: Unspecified".format(", ".join(portfolioCodes)))
+
+    # One portfolio the server cannot return fails the whole group. If none of the group's positions were handed on
+    # yet, request each portfolio on its own so that only the ones that fail again are missed.
+    if pagesQueuedCount == 0 and len(portfolioCodes) > 1:
+        logInfo("Retrying PortfolioCodes {} one portfolio at a time".format(", ".join(portfolioCodes)))
+        return all([GetPortfolioGroupPositions(iosPlusClient, iosPlusClientFactory, scheduler, schedulerKey, serviceSessionKey, [portfolioCode], positionQueue, pageSize) for portfolioCode in portfolioCodes])
+    return False
+
+def RetrievePortfolioPositions(iosPlusClient, iosPlusClientFactory, scheduler, schedulerKey, sessionManager, portfolioGroupSize, parallelism, positionQueue, retrievalSummary, pageSize=pager.DEFAULT_PAGE_SIZE, metrics=None):
+    # Page through PortfolioGet and fan the portfolio codes out, in groups of portfolioGroupSize, to at most parallelism
+    # concurrent PortfolioPositionDetailGet requests. Every page of positions is placed on positionQueue, followed by
+    # END_OF_POSITIONS once all of the groups have finished. Given metrics, the workers' calls are recorded in them.
+    workerState = threading.local()
+    groupSlots = threading.BoundedSemaphore(parallelism * 2) # Stop paging through PortfolioGet when the workers fall behind
+
+    def InitialiseWorker():
+        # Each worker gets its own HTTP session, sharing the parsed WSDL and credentials of the main client
+        workerSession = Session()
+        workerSession.auth = iosPlusClient.transport.session.auth
+        InstallTransientStatusHook(workerSession)
+        sessionManager.installRestartHook(workerSession)
+        if metrics is not None:
+            workerState.client = MeteredClient(iosPlusClient.wsdl, metrics, settings=iosPlusClient.settings, session=workerSession)
+        else:
+            workerState.client = Client(iosPlusClient.wsdl, settings=iosPlusClient.settings, transport=Transport(session=workerSession))
+        workerState.client.set_ns_prefix("ns0", "http://webservices.iress.com.au/v4/")
+
+    def GetGroupPositions(portfolioCodes):
+        # Runs on the executor, which would keep any error in a future that nothing reads, so every failure is logged
+        # and marks the group as failed here
+        try:
+            if not GetPortfolioGroupPositions(workerState.client, iosPlusClientFactory, scheduler, schedulerKey, sessionManager.getServiceSessionKey(), portfolioCodes, positionQueue, pageSize):
+                retrievalSummary["GroupFailed"] = True
+        except Exception as ex:
+            logError("Portfolio position retrieval failed for PortfolioCodes {}. Error: {}".format(", ".join(portfolioCodes), str(ex)))
+            retrievalSummary["GroupFailed"] = True
+        except:
+            logError("Portfolio position retrieval failed for PortfolioCodes {}. Error: Unspecified".format(", ".join(portfolioCodes)))
+            retrievalSummary["GroupFailed"] = True
+        finally:
+            groupSlots.release()
+
+    def SubmitGroup(executor, portfolioCodes):
+        groupSlots.acquire()
+        executor.submit(GetGroupPositions, portfolioCodes)
+
+    # END_OF_POSITIONS goes on the queue however this fails, as the alert creation waits for it
+    try:
+        portfolioGetInputParameters = iosPlusClientFactory.PortfolioGetInputParameters(AccessMode=0, FilterBy=0, FilterMode=0, FilterText="", IncludeInactive=True)
+        portfolioGetDataRows = pager.GetDataRows(lambda pagingHeader: scheduler.call(schedulerKey, "PortfolioGet", iosPlusClient.service.PortfolioGet, iosPlusClientFactory.PortfolioGetInput(Header=iosPlusClientFactory.PortfolioGetInputHeader(ServiceSessionKey=sessionManager.getServiceSessionKey(), **pagingHeader),Parameters=portfolioGetInputParameters)), pageSize)
+
+        with ThreadPoolExecutor(max_workers=parallelism, initializer=InitialiseWorker) as executor:
+            portfolioCodes = []
+
+            try:
+                for portfolioGetDataRow in portfolioGetDataRows:
+                    portfolioCodes.append(portfolioGetDataRow.PortfolioCode)
+                    retrievalSummary["PortfolioCount"] = retrievalSummary["PortfolioCount"] + 1
+
+                    if len(portfolioCodes) == portfolioGroupSize:
+                        SubmitGroup(executor, portfolioCodes)
+                        portfolioCodes = []
+            except Exception as ex:
+                logError("Portfolio retrieval failed. Error: {}".format(str(ex)))
+                retrievalSummary["Failed"] = True
+                return
+            except:
+                logError("Portfolio retrieval failed. Error: Unspecified")
+                retrievalSummary["Failed"] = True
+                return
+
+            if retrievalSummary["PortfolioCount"] == 0:
+                logInfo("No portfolios associated with the requesting user.")
+                retrievalSummary["Failed"] = True
+                return
+
+            if portfolioCodes:
+                SubmitGroup(executor, portfolioCodes)
+    except Exception as ex:
+        logError("Portfolio position retrieval failed. Error: {}".format(str(ex)))
+        retrievalSummary["Failed"] = True
+    except:
+        logError("Portfolio position retrieval failed. Error: Unspecified")
+        retrievalSummary["Failed"] = True
+    finally:
+        positionQueue.put(END_OF_POSITIONS)
+
+def ReportMetrics(metrics, metricsServer, metricsFileName):
+    # Log the per-operation summary of the run's calls, write the metrics out if asked to and stop serving them
+    for summaryLine in metrics.formatSummary():
+        logInfo(summaryLine)
+    if metricsFileName:
+        metrics.writeExposition(metricsFileName)
+    if metricsServer:
+        metricsServer.shutdown()
+    metrics.close()
 
 def is_number(s):
     try:
@@ -136,9 +336,27 @@ def is_number(s):
 @click.option('--iosname', '-i', prompt="IOS+ server name", help='The IOS+ server name to connect to.')    
 @click.option('--thresholdvalue', '-t', prompt="Position threshold value", help='The threshold value in absolute terms that a portfolio position must be greater than in order to be considered for the alert creation.')
 @click.option('--percentchange', '-p', prompt="Percentage change", help='The percentage change in the start of day average price to generate an alert for.')
+@click.option('--pricebasis', type=click.Choice(['startofday', 'last']), help='The price the percentage change is applied to, the start of day average price or the last price from PricingQuoteGet.', default='startofday')
 @click.option('--endpoint', '-e', prompt="Web Services WSDL endpoint", help='The Web Services WSDL endpoint to connect to.')
 @click.option('--wipeexistingalerts', '-w', prompt="Wipe existing alerts", help='Indicates whether to wipe existing alerts created by the Portfolio Alerter tool.')
-def main(username, companyname, password, iosname, thresholdvalue, percentchange, endpoint, wipeexistingalerts):
+@click.option('--reconcile', is_flag=True, help='Compare the alerts the positions need with the existing alerts created by the tool, and only create the missing ones and delete the stale ones. Cannot be used with --pricebasis last.')
+@click.option('--dryrun', is_flag=True, help='Log the alerts --reconcile would create and delete without changing any.')
+@click.option('--portfoliogroupsize', '-g', help='The number of portfolio codes to request in each PortfolioPositionDetailGet call.', default=50)
+@click.option('--parallelism', '-n', help='The maximum number of PortfolioPositionDetailGet calls to run concurrently.', default=4)
+@click.option('--alertbatchsize', '-b', help='The number of alerts to create in each AlertCreate call.', default=100)
+@click.option('--ratelimit', help='The most calls per second to make to each of the IRESS and IOS+ servers, or 0 for no limit.', default=0.0)
+@click.option('--maxattempts', help='The number of times to try a call that fails with a transient error, such as the server being busy. AlertCreate is only retried when the server turned it away (HTTP 429 or 503) or it could not connect, as the alerts may otherwise have been created.', default=DEFAULT_MAX_ATTEMPTS)
+@click.option('--pagesize', help='The number of rows to request in each page of AlertGet, PortfolioGet and PortfolioPositionDetailGet results.', default=pager.DEFAULT_PAGE_SIZE)
+@click.option('--wsdlcache', help='The directory to cache WSDLs in between runs.', default=wsdlCache.DEFAULT_CACHE_DIRECTORY)
+@click.option('--wsdlcachettl', help='The number of seconds a cached WSDL is used for before it is fetched again.', default=wsdlCache.DEFAULT_TTL)
+@click.option('--metricsfile', help='A file to write the per-operation metrics to at the end of the run, in the Prometheus text format.', default=None)
+@click.option('--metricsport', help='A port to serve the per-operation metrics on for Prometheus to scrape while the run is in progress.', default=None, type=int)
+@click.option('--tracefile', help='A file to append a JSON line to for every Web Services call.', default=None)
+@click.option('--offline', is_flag=True, help='Only use WSDLs already in the WSDL cache directory, never fetch them from the endpoint.')
+@click.option('--sessionstore', help='The file that IRESS and IOS+ session keys are shared between runs through.', default=DEFAULT_STORE_PATH)
+@click.option('--sessionlifetime', help='The number of seconds the server keeps a session for. Sessions are renewed shortly before then, and sessions the server ends sooner are restarted when it rejects them.', default=DEFAULT_SESSION_LIFETIME)
+@click.option('--newsession', is_flag=True, help='Start new sessions rather than reusing the ones in the session store.')
+def main(username, companyname, password, iosname, thresholdvalue, percentchange, pricebasis, endpoint, wipeexistingalerts, reconcile, dryrun, portfoliogroupsize, parallelism, alertbatchsize, ratelimit, maxattempts, pagesize, wsdlcache, wsdlcachettl, metricsfile, metricsport, tracefile, offline, sessionstore, sessionlifetime, newsession):
     # Setup logger
     logDirectory = os.path.dirname(os.path.realpath(__file__))
     logOutputFileName = 'portfolioAlerter_{}.log'.format(time.strftime("%Y%m%d-%H%M%S"))
@@ -155,8 +373,17 @@ def main(username, companyname, password, iosname, thresholdvalue, percentchange
     logger.addHandler(fileHandler)
     logger.addHandler(consoleHandler)
 
-    # Determine whether we need to wipe existing alerts or not
+    # Determine whether we need to wipe existing alerts or not. A dry run only makes sense as a reconciliation.
     bWipeExistingAlerts = distutils.util.strtobool(wipeexistingalerts)    
+    reconcile = reconcile or dryrun
+    if bWipeExistingAlerts and reconcile:
+        logError("Existing alerts cannot be both wiped and reconciled.")
+        return
+
+    # Alert prices based on the last price move with every quote, so a reconciliation would replace nearly every alert
+    if reconcile and pricebasis == "last":
+        logError("Existing alerts can only be reconciled with a start of day price basis, as alerts based on the last price change with every quote.")
+        return
 
     if is_number(thresholdvalue) == False:
         logError("Threshold value must be a floating point number.")
@@ -174,31 +401,44 @@ def main(username, companyname, password, iosname, thresholdvalue, percentchange
         logError("Percent change must be greater than 0.")
         return
 
+    if portfoliogroupsize < 1 or parallelism < 1 or alertbatchsize < 1 or pagesize < 1:
+        logError("Portfolio group size, parallelism, alert batch size and page size must be greater than 0.")
+        return
+
     longMultiplier = 1 - (percentchange_float / 100)
     shortMultiplier = 1 + (percentchange_float / 100)
 
     # Configure Zeep settings
     settings = Settings(strict = False, xml_huge_tree = True)
 
+    # Every call made through the clients is recorded in the metrics, split into serialize, wire and parse time
+    metrics = SoapMetrics(tracefile)
+    metricsServer = ServeMetrics(metrics, metricsport) if metricsport else None
+
     # Work out IRESS WSDL endpoint details
     iressMethodList = "AlertCreate,AlertGet,AlertDelete"
-    iressWsdl = "{}?svc=IRESS&svr={}&mf={}".format(endpoint, "", iressMethodList)
+    if pricebasis == "last":
+        iressMethodList = iressMethodList + ",PricingQuoteGet"
 
     # Work out IOS+ WSDL endpoint details
     iosPlusMethodList = "PortfolioGet,PortfolioPositionDetailGet"
-    iosPlusWsdl = "{}?svc=IOSPlus&svr={}&mf={}".format(endpoint, iosname, iosPlusMethodList)
 
-    # Create the Web Services client objects, one for the IRESS WSDL and one for the IOS+ WSDL
+    # Create the Web Services client objects, one for the IRESS WSDL and one for the IOS+ WSDL. The WSDLs are taken from
+    # the WSDL cache where possible rather than being generated by the endpoint on every run.
 
     userCompany = username + "@" + companyname
 
     iressSession = Session()
     iressSession.auth = HTTPBasicAuth(userCompany, password)
-    iressClient = Client(iressWsdl, settings=settings, transport=Transport(session=iressSession))
+    InstallTransientStatusHook(iressSession)
+    iressWsdl = wsdlCache.GetWsdl(iressSession, endpoint, "IRESS", "", iressMethodList, cacheDirectory=wsdlcache, ttl=wsdlcachettl, offline=offline)
+    iressClient = MeteredClient(iressWsdl, metrics, settings=settings, session=iressSession)
 
     iosPlusSession = Session()
     iosPlusSession.auth = HTTPBasicAuth(userCompany, password)
-    iosPlusClient = Client(iosPlusWsdl, settings=settings, transport=Transport(session=iosPlusSession))
+    InstallTransientStatusHook(iosPlusSession)
+    iosPlusWsdl = wsdlCache.GetWsdl(iosPlusSession, endpoint, "IOSPlus", iosname, iosPlusMethodList, cacheDirectory=wsdlcache, ttl=wsdlcachettl, offline=offline)
+    iosPlusClient = MeteredClient(iosPlusWsdl, metrics, settings=settings, session=iosPlusSession)
 
     # Obtain the factories for the client objects
     iressClient.set_ns_prefix("ns0", "http://webservices.iress.com.au/v4/")
@@ -207,98 +447,133 @@ def main(username, companyname, password, iosname, thresholdvalue, percentchange
     iosPlusClient.set_ns_prefix("ns0", "http://webservices.iress.com.au/v4/")
     iosPlusClientFactory = iosPlusClient.type_factory('http://webservices.iress.com.au/v4/')
     
-    # Start the IRESS and IOS Service session
-    appId = str(uuid.uuid4()) # Generate a application ID that is unique.
-    iressSessionStartResponse = iosPlusClient.service.IRESSSessionStart(iosPlusClientFactory.IRESSSessionStartInput(Header=iosPlusClientFactory.IRESSSessionStartInputHeader(Updates=False), Parameters=iosPlusClientFactory.IRESSSessionStartInputParameters(UserName=username, CompanyName=companyname, Password=password, ApplicationID=appId)))
-    iressSessionKey = iressSessionStartResponse.Result.DataRows.DataRow[0].IRESSSessionKey
-    serviceSessionStartResponse = iosPlusClient.service.ServiceSessionStart(iosPlusClientFactory.ServiceSessionStartInput(Parameters=iosPlusClientFactory.ServiceSessionStartInputParameters(IRESSSessionKey=iressSessionKey, Service= "IOSPLUS", Server=iosname)))
-    serviceSessionKey = serviceSessionStartResponse.Result.DataRows.DataRow[0].ServiceSessionKey
+    # Start the IRESS and IOS Service session, or reuse the ones a previous run left in the session store
+    sessionManager = SessionManager(iosPlusClient, iosPlusClientFactory, endpoint, username, companyname, password, service="IOSPLUS", server=iosname, storePath=sessionstore, sessionLifetime=sessionlifetime)
+    sessionManager.installRestartHook(iressSession)
+    if newsession:
+        sessionManager.invalidate()
+    iressSessionKey, serviceSessionKey = sessionManager.getSessionKeys()
+    sessionManager.startRenewal()
+
+    # Every call to the IRESS and IOS+ servers goes through the scheduler, which limits their rate and the number in
+    # flight, and retries the ones that fail transiently rather than losing a portfolio or a batch of alerts to them
+    scheduler = RequestScheduler(rate=ratelimit or None, maxConcurrency=parallelism, maxAttempts=maxattempts)
+    iosPlusSchedulerKey = ("IOSPLUS", iosname)
+
+    # Last prices are looked up through a QuoteService, which requests each page's securities in batched
+    # PricingQuoteGet calls and caches them, so a security held in many portfolios is only quoted once
+    quoteService = QuoteService(iressClient, iressClientFactory, sessionManager, batchSize=alertbatchsize, parallelism=parallelism, scheduler=scheduler, schedulerKey=IRESS_SCHEDULER_KEY, metrics=metrics) if pricebasis == "last" else None
 
     # Clear existing alerts for the current user
     if bWipeExistingAlerts:
-        WipeExistingAlerts(iressClient, iressClientFactory, iressSessionKey)
+        WipeExistingAlerts(iressClient, iressClientFactory, scheduler, iressSessionKey, pagesize)
+
+    # When reconciling, index the existing alerts so that the ones the positions still need are kept rather than recreated
+    existingAlerts = None
+    if reconcile:
+        existingAlerts = GetExistingAlerts(iressClient, iressClientFactory, scheduler, iressSessionKey, pagesize)
+        if existingAlerts is None:
+            sessionManager.close()
+            ReportMetrics(metrics, metricsServer, metricsfile)
+            return
 
-    # Get a list of all the portfolio codes for the given user
+    # Get a list of all the portfolio codes for the given user, and retrieve their positions on background threads
     logInfo("Retrieving list of portfolios for user {}@{}".format(username, companyname))
-    portfolioCount = 0
     alertsToCreateCount = 0
     alertsCreatedCount = 0
-    portfolioGetMoreDataAvailable = True
-    portfolioGetRequestID = str(uuid.uuid4()) # Generate a request ID to support paging through the PortfolioGet method
+    alertsUnchangedCount = 0
+    pendingAlerts = []
+    retrievalSummary = { "PortfolioCount": 0, "Failed": False, "GroupFailed": False }
+    positionQueue = queue.Queue(maxsize=parallelism * 4)
+    retrievalThread = threading.Thread(target=RetrievePortfolioPositions, args=(iosPlusClient, iosPlusClientFactory, scheduler, iosPlusSchedulerKey, sessionManager, portfoliogroupsize, parallelism, positionQueue, retrievalSummary, pagesize, metrics), daemon=True)
+    retrievalThread.start()
+
+    # Create the alerts as each page of positions arrives
+    while True:
+        portfolioPositionDetailGetDataRows = positionQueue.get()
+        if portfolioPositionDetailGetDataRows is END_OF_POSITIONS:
+            break
+
+        lastPrices = {}
+        if quoteService is not None:
+            try:
+                quotes = quoteService.getQuotes([SecurityKey(dataRow.SecurityCode, dataRow.Exchange) for dataRow in portfolioPositionDetailGetDataRows if abs(dataRow.ActualValue) > thresholdvalue_float])
+                lastPrices = { key: quote.LastPrice for key, quote in quotes.items() if quote is not None and quote.LastPrice }
+            except Exception as ex:
+                logError("PricingQuoteGet failed, using the start of day average prices for this page. Error: {}".format(str(ex)))
+            except:
+                logError("PricingQuoteGet failed, using the start of day average prices for this page. Error: Unspecified")
+
+        for portfolioPositionDetailGetDataRow in portfolioPositionDetailGetDataRows:
+            # If the position is greater than the threshold value provided on input, grab the details of the position and create an alert for it
+            portfolioCode = portfolioPositionDetailGetDataRow.PortfolioCode
+            securityCode = portfolioPositionDetailGetDataRow.SecurityCode
+            exchange = portfolioPositionDetailGetDataRow.Exchange
+            averagePriceSOD = portfolioPositionDetailGetDataRow.AveragePriceStartOfDay
+            volumeSOD = portfolioPositionDetailGetDataRow.VolumeStartOfDay
+            actualValue = portfolioPositionDetailGetDataRow.ActualValue
+            basePrice = lastPrices.get(SecurityKey(securityCode, exchange), averagePriceSOD)
+
+            absActualValue = abs(actualValue)
+            if absActualValue > thresholdvalue_float:
+                alertsToCreateCount = alertsToCreateCount + 1
+
+                # Create a Quote alert. If position is short, create an alert to notify the user if the position has gone up by more than the specified amount.
+                # For longs, the alert will notify the user if position the has gone down by more than the specified amount.
+                if volumeSOD < 0:
+                    alertOperator = ">="
+                    alertPrice = shortMultiplier * basePrice
+                else:
+                    alertOperator = "<="
+                    alertPrice = longMultiplier * basePrice
+
+                pendingAlert = PendingAlert(alertOperator, securityCode, exchange, alertPrice, portfolioCode, "PortfolioCode - {}".format(portfolioCode))
+
+                # An existing alert for the same security, operator, price and portfolio is kept as it is
+                if existingAlerts is not None:
+                    matchingAlerts = existingAlerts.get(AlertKey("{}.{}".format(securityCode, exchange), alertOperator, alertPrice, pendingAlert.Memo))
+                    if matchingAlerts:
+                        matchingAlerts.pop()
+                        alertsUnchangedCount = alertsUnchangedCount + 1
+                        continue
+
+                if dryrun:
+                    logInfo("Dry run: would create alert for {}.{} in portfolio {} at price {:.3f}".format(securityCode, exchange, portfolioCode, alertPrice))
+                    continue
+
+                # Queue a quote alert for the position that exceeded threshold, creating the alerts once a full batch is ready
+                pendingAlerts.append(pendingAlert)
+                if len(pendingAlerts) == alertbatchsize:
+                    alertsCreatedCount = alertsCreatedCount + CreateQuoteAlerts(iressClient, iressClientFactory, scheduler, sessionManager.getIressSessionKey(), pendingAlerts)
+                    pendingAlerts = []
+
+    if pendingAlerts:
+        alertsCreatedCount = alertsCreatedCount + CreateQuoteAlerts(iressClient, iressClientFactory, scheduler, sessionManager.getIressSessionKey(), pendingAlerts)
+
+    retrievalThread.join()
+    if quoteService is not None:
+        quoteService.close()
+        logInfo("Quotes requested: {Requested} From cache: {CacheHits} Coalesced: {Coalesced} Fetched: {Fetched} in {Calls} PricingQuoteGet calls".format(**quoteService.statistics))
+    logInfo(scheduler.formatSummary())
+    sessionManager.close()
+    if retrievalSummary["Failed"]:
+        ReportMetrics(metrics, metricsServer, metricsfile)
+        return
 
-    while portfolioGetMoreDataAvailable:
-        try:
-            portfolioGetResponse = iosPlusClient.service.PortfolioGet(iosPlusClientFactory.PortfolioGetInput(Header=iosPlusClientFactory.PortfolioGetInputHeader(ServiceSessionKey=serviceSessionKey, RequestID=portfolioGetRequestID),Parameters=iosPlusClientFactory.PortfolioGetInputParameters(AccessMode=0, FilterBy=0, FilterMode=0, FilterText="", IncludeInactive=True)))
-        except Exception as ex:
-            logError("Portfolio retrieval failed. Error: {}".format(str(ex)))
-            return
-        except:
-            logError("Portfolio retrieval failed. Error: Unspecified")
-            return
+    portfolioCount = retrievalSummary["PortfolioCount"]
+    if existingAlerts is None:
+        logInfo("Finished creating alerts. Portfolios scanned: {} Alerts to create: {} Alerts created successfully: {}".format(portfolioCount, alertsToCreateCount, alertsCreatedCount))
+        ReportMetrics(metrics, metricsServer, metricsfile)
+        return
 
-        # Check requet status to determine if there is any more data available after this response
-        portfolioGetRequestStatus = portfolioGetResponse.Result.Header.StatusCode
-        if portfolioGetRequestStatus != 1:
-            portfolioGetMoreDataAvailable = False
-
-        if portfolioGetResponse.Result.DataRows:
-            portfolioGetDataRows = portfolioGetResponse.Result.DataRows.DataRow
-
-            # For each portfolio, request the position details.
-            for portfolioGetDataRow in portfolioGetDataRows:
-                portfolioCode = portfolioGetDataRow.PortfolioCode
-                portfolioCount = portfolioCount + 1
-                portfolioPositionDetailGetRequestID = str(uuid.uuid4()) # Generate a request ID to support paging through the PortfolioPositionDetailGet method
-                portfolioPositionDetailGetMoreDataAvailable = True
-
-                # Get the Portfolio details for each portfolio
-                while portfolioPositionDetailGetMoreDataAvailable:
-                    try:
-                        #logInfo("Retrieving list of portfolios positions for PortfolioCode {}...".format(portfolioCode))
-                        
-                        portfolioPositionDetailGetResponse = iosPlusClient.service.PortfolioPositionDetailGet(iosPlusClientFactory.PortfolioPositionDetailGetInput(Header=iosPlusClientFactory.PortfolioPositionDetailGetInputHeader(ServiceSessionKey=serviceSessionKey, RequestID=portfolioPositionDetailGetRequestID), Parameters=iosPlusClientFactory.PortfolioPositionDetailGetInputParameters(AccessMode=0, PortfolioCodeArray=[portfolioCode], IncludePositionsFromPortfoliosWithSameCashAccountArray=[False])))
-
-                        # Check requet status to determine if there is any more data available after this response
-                        portfolioPositionDetailGetGetRequestStatus = portfolioPositionDetailGetResponse.Result.Header.StatusCode
-                        if portfolioPositionDetailGetGetRequestStatus != 1:
-                            portfolioPositionDetailGetMoreDataAvailable = False
-
-                        if portfolioPositionDetailGetResponse.Result.DataRows:
-                            for portfolioPositionDetailGetDataRow in portfolioPositionDetailGetResponse.Result.DataRows.DataRow:
-                                # If the position is greater than the threshold value provided on input, grab the details of the position and create an alert for it
-                                portfolioCode = portfolioPositionDetailGetDataRow.PortfolioCode
-                                securityCode = portfolioPositionDetailGetDataRow.SecurityCode
-                                exchange = portfolioPositionDetailGetDataRow.Exchange
-                                averagePriceSOD = portfolioPositionDetailGetDataRow.AveragePriceStartOfDay
-                                volumeSOD = portfolioPositionDetailGetDataRow.VolumeStartOfDay
-                                actualValue = portfolioPositionDetailGetDataRow.ActualValue
-                                
-                                absActualValue = abs(actualValue)
-                                if absActualValue > thresholdvalue_float:
-                                    alertsToCreateCount = alertsToCreateCount + 1
-
-                                    # Create a Quote alert. If position is short, create an alert to notify the user if the position has gone up by more than the specified amount.
-                                    # For longs, the alert will notify the user if position the has gone down by more than the specified amount.
-                                    if volumeSOD < 0:
-                                        alertOperator = ">="
-                                        alertPrice = shortMultiplier * averagePriceSOD
-                                    else:
-                                        alertOperator = "<="
-                                        alertPrice = longMultiplier * averagePriceSOD
-
-                                    # Create a quote alert for the position that exceeded threshold
-                                    if CreateQuoteAlert(iressClient, iressClientFactory, iressSessionKey, alertOperator, securityCode, exchange, alertPrice, portfolioCode, "PortfolioCode - {}".format(portfolioCode)):
-                                        alertsCreatedCount = alertsCreatedCount + 1                            
-                    except Exception as ex:
-                        logError("Portfolio position retrieval failed for PortfolioCode {}. Error: {}".format(portfolioCode, str(ex)))
-                    except:
-                        logError("Portfolio position retrieval failed for PortfolioCode {}. Error: Unspecified".format(portfolioCode))
-                    
-        else:
-            logInfo("No portfolios associated with the requesting user.")    
-            return
+    staleAlerts, alertsDeletedCount = DeleteStaleAlerts(iressClient, iressClientFactory, scheduler, sessionManager.getIressSessionKey(), existingAlerts, retrievalSummary, dryrun, alertbatchsize)
 
-    logInfo("Finished creating alerts. Portfolios scanned: {} Alerts to create: {} Alerts created successfully: {}".format(portfolioCount, alertsToCreateCount, alertsCreatedCount))
+    alertsToAddCount = alertsToCreateCount - alertsUnchangedCount
+    if dryrun:
+        logInfo("Finished dry run. Portfolios scanned: {} Alerts unchanged: {} Alerts to create: {} Alerts to delete: {}".format(portfolioCount, alertsUnchangedCount, alertsToAddCount, len(staleAlerts)))
+    else:
+        logInfo("Finished reconciling alerts. Portfolios scanned: {} Alerts unchanged: {} Alerts to create: {} Alerts created successfully: {} Alerts to delete: {} Alerts deleted successfully: {}".format(portfolioCount, alertsUnchangedCount, alertsToAddCount, alertsCreatedCount, len(staleAlerts), alertsDeletedCount))
+    ReportMetrics(metrics, metricsServer, metricsfile)
 
 def runMain():
     main()
@@ -0,0 +1,211 @@
+from requests import Session
+from requests.auth import HTTPBasicAuth
+from zeep.transports import Transport
+from zeep import Client, Settings
+from datetime import date, datetime, time as dayTime, timedelta
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+import sys
+import click
+
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), "..", "Common"))
+import wsdlCache
+import rawResponse
+from parquetExtract import DataRowSchema, ExtractPages, ExtractCheckpoint, DEFAULT_ROW_GROUP_SIZE
+from requestScheduler import RequestScheduler, InstallTransientStatusHook, DEFAULT_MAX_ATTEMPTS
+from sessionManager import SessionManager, DEFAULT_STORE_PATH, DEFAULT_SESSION_LIFETIME
+
+# Extracts a user's IOS+ trades, audit trail and order search results over a range of dates to Parquet files, as the
+# C# iosplus-download sample does for a single date. Each method and date is its own request, and --parallelism of
+# them run at a time across all the dates and methods. Every page is decoded by the raw response decoder as it arrives
+# and appended to that method and date's file, so a month long backfill never holds more than a few pages in memory.
+# Each request goes through a RequestScheduler, which retries the pages that fail transiently.
+#
+# The files are written to <output>/<Method>/<YYYY-MM-DD>.parquet, and checkpoint.json in the output directory records
+# the ones that are complete. A rerun only extracts the methods and dates that are missing. The current day is still
+# trading, so it is never recorded as complete, and is extracted again by the next run.
+
+# The methods that can be extracted, with the parameters their date range is passed in
+EXTRACT_METHODS = {
+    "TradeGetByUser": ("TradeDateTimeFrom", "TradeDateTimeTo"),
+    "AuditTrailGetByUser": ("AuditLogDateTimeFrom", "AuditLogDateTimeTo"),
+    "OrderSearchGetByUser": ("DateTimeFrom", "DateTimeTo"),
+}
+
+REQUEST_TIMEOUT = 60 # As in the C# sample
+
+def GetExtractFileName(outputDirectory, methodName, extractDate):
+    return os.path.join(outputDirectory, methodName, "{}.parquet".format(extractDate.isoformat()))
+
+def GetCheckpointKey(methodName, extractDate):
+    return "{}/{}".format(methodName, extractDate.isoformat())
+
+def ExtractDay(iosPlusClient, iosPlusClientFactory, scheduler, schedulerKey, serviceSessionKey, dataRowSchema, extractDate, fileName, pageSize, rowGroupSize):
+    # Write one method's rows for one day to fileName, paging through them with the same RequestID. Returns the number
+    # of rows written.
+    methodName = dataRowSchema.operationName
+    fromParameter, toParameter = EXTRACT_METHODS[methodName]
+    parameters = getattr(iosPlusClientFactory, methodName + "InputParameters")(**{ fromParameter: datetime.combine(extractDate, dayTime(0, 0, 0)), toParameter: datetime.combine(extractDate, dayTime(23, 59, 59, 999999)) })
+
+    def RequestPage(pagingHeader):
+        methodInput = getattr(iosPlusClientFactory, methodName + "Input")(Header=getattr(iosPlusClientFactory, methodName + "InputHeader")(ServiceSessionKey=serviceSessionKey, Updates=False, Timeout=REQUEST_TIMEOUT, **pagingHeader), Parameters=parameters)
+        return scheduler.call(schedulerKey, methodName, rawResponse.CallRaw, iosPlusClient, methodName, methodInput)
+
+    requestId = str(uuid.uuid4())
+    logging.info("Retrieving {} for {} using RequestID {}".format(methodName, extractDate, requestId))
+    return ExtractPages(RequestPage, dataRowSchema, fileName, rowGroupSize=rowGroupSize, pageSize=pageSize, requestId=requestId)
+
+def ExtractHistory(iosPlusClient, iosPlusClientFactory, scheduler, schedulerKey, sessionManager, checkpoint, outputDirectory, methodNames, fromDate, toDate, parallelism, pageSize, rowGroupSize):
+    # Extract every method for every date that is not already complete. Returns the number of extracts that failed.
+    dataRowSchemas = { methodName: DataRowSchema(iosPlusClient, methodName) for methodName in methodNames }
+    extracts = []
+    extractDate = fromDate
+    while extractDate <= toDate:
+        for methodName in methodNames:
+            if checkpoint.isComplete(GetCheckpointKey(methodName, extractDate), GetExtractFileName(outputDirectory, methodName, extractDate)):
+                logging.info("{} for {} is already extracted".format(methodName, extractDate))
+            else:
+                extracts.append((methodName, extractDate))
+        extractDate = extractDate + timedelta(days=1)
+
+    logging.info("Extracting {} method and date combinations from {} to {}".format(len(extracts), fromDate, toDate))
+    workerState = threading.local()
+
+    def InitialiseWorker():
+        # Each worker gets its own HTTP session, sharing the parsed WSDL and credentials of the main client
+        workerSession = Session()
+        workerSession.auth = iosPlusClient.transport.session.auth
+        InstallTransientStatusHook(workerSession)
+        sessionManager.installRestartHook(workerSession)
+        workerState.client = Client(iosPlusClient.wsdl, settings=iosPlusClient.settings, transport=Transport(session=workerSession))
+        workerState.client.set_ns_prefix("ns0", "http://webservices.iress.com.au/v4/")
+
+    def Extract(methodName, extractDate):
+        return ExtractDay(workerState.client, iosPlusClientFactory, scheduler, schedulerKey, sessionManager.getServiceSessionKey(), dataRowSchemas[methodName], extractDate, GetExtractFileName(outputDirectory, methodName, extractDate), pageSize, rowGroupSize)
+
+    failedCount = 0
+    with ThreadPoolExecutor(max_workers=parallelism, initializer=InitialiseWorker) as executor:
+        futures = { executor.submit(Extract, *extract): extract for extract in extracts }
+        for future in as_completed(futures):
+            methodName, extractDate = futures[future]
+            try:
+                rowCount = future.result()
+            except Exception as ex:
+                logging.error("{} for {} failed. Error: {}".format(methodName, extractDate, str(ex)))
+                failedCount = failedCount + 1
+                continue
+            except:
+                logging.error("{} for {} failed. Error: Unspecified".format(methodName, extractDate))
+                failedCount = failedCount + 1
+                continue
+
+            if extractDate < date.today():
+                checkpoint.markComplete(GetCheckpointKey(methodName, extractDate), rowCount)
+            logging.info("Extracted {} rows of {} for {}".format(rowCount, methodName, extractDate))
+    return failedCount
+
+# Use click library to process command line arguments - this way we can support the provision of a password and where not passed by user it will prompt them
+@click.command()
+@click.option('--username', '-u', prompt="IRESS User Name", help='The IRESS username to login to Web Services using.')
+@click.option('--companyname', '-c', prompt="Company Name", help='The company name to login to Web Services using.')
+@click.option('--password', '-p', prompt=True, confirmation_prompt=False, hide_input=True)
+@click.option('--iosname', '-i', prompt="IOS+ Server Name", help='The IOS+ server name to connect to.', default="IOSPLUSAPIRETAIL3")
+@click.option('--endpoint', '-e', prompt="Web Services WSDL Endpoint", help='The Web Services WSDL endpoint to connect to.', default="https://webservices.iress.com.au/v4/wsdl.aspx")
+@click.option('--methods', '-m', help='Comma separated methods to extract.', default=",".join(EXTRACT_METHODS))
+@click.option('--fromdate', help='The first date to extract, as YYYY-MM-DD. Defaults to the to date.', default=None)
+@click.option('--todate', help='The last date to extract, as YYYY-MM-DD. Defaults to yesterday.', default=None)
+@click.option('--output', '-o', help='The directory to write the Parquet files and checkpoint to.', default="extract")
+@click.option('--parallelism', '-n', help='The maximum number of method and date requests to run concurrently.', default=4)
+@click.option('--pagesize', help='The number of rows to request in each page of results.', default=1000)
+@click.option('--rowgroupsize', help='The number of rows to buffer into each Parquet row group.', default=DEFAULT_ROW_GROUP_SIZE)
+@click.option('--ratelimit', help='The most calls per second to make to the IOS+ server, or 0 for no limit.', default=0.0)
+@click.option('--maxattempts', help='The number of times to try a page that fails with a transient error, such as the server being busy.', default=DEFAULT_MAX_ATTEMPTS)
+@click.option('--wsdlcache', help='The directory to cache WSDLs in between runs.', default=wsdlCache.DEFAULT_CACHE_DIRECTORY)
+@click.option('--wsdlcachettl', help='The number of seconds a cached WSDL is used for before it is fetched again.', default=wsdlCache.DEFAULT_TTL)
+@click.option('--offline', is_flag=True, help='Only use WSDLs already in the WSDL cache directory, never fetch them from the endpoint.')
+@click.option('--sessionstore', help='The file that IRESS and IOS+ session keys are shared between runs through.', default=DEFAULT_STORE_PATH)
+@click.option('--sessionlifetime', help='The number of seconds the server keeps a session for. Sessions are renewed shortly before then, and sessions the server ends sooner are restarted when it rejects them.', default=DEFAULT_SESSION_LIFETIME)
+@click.option('--newsession', is_flag=True, help='Start new sessions rather than reusing the ones in the session store.')
+def main(username, companyname, password, iosname, endpoint, methods, fromdate, todate, output, parallelism, pagesize, rowgroupsize, ratelimit, maxattempts, wsdlcache, wsdlcachettl, offline, sessionstore, sessionlifetime, newsession):
+    # Work out where to store the logs - use the current hostname and date/time in the filename
+    logOutputFileName = 'historyextract_{}_{}.log'.format(socket.gethostname(), time.strftime("%Y%m%d-%H%M%S"))
+    logFileFullPath = os.path.join(os.path.dirname(os.path.realpath(__file__)), logOutputFileName)
+
+    # Setup logger
+    loggingDateTimeFormat = '%Y-%m-%d %H:%M:%S'
+    logging.basicConfig(filename=logFileFullPath,level=logging.DEBUG,format='%(asctime)s.%(msecs)03d %(message)s', datefmt=loggingDateTimeFormat)
+    consoleHandler = logging.StreamHandler()
+    consoleHandler.setLevel(logging.INFO)
+    consoleHandler.setFormatter(logging.Formatter('%(asctime)s.%(msecs)03d %(message)s', datefmt=loggingDateTimeFormat))
+    logging.getLogger('').addHandler(consoleHandler)
+
+    if parallelism < 1 or pagesize < 1 or rowgroupsize < 1:
+        logging.error("Parallelism, page size and row group size must be greater than 0.")
+        return
+
+    methodNames = [methodName.strip() for methodName in methods.split(",") if methodName.strip()]
+    unknownMethodNames = [methodName for methodName in methodNames if methodName not in EXTRACT_METHODS]
+    if not methodNames or unknownMethodNames:
+        logging.error("Methods must be some of {}.".format(", ".join(EXTRACT_METHODS)))
+        return
+
+    try:
+        toDate = date.fromisoformat(todate) if todate else date.today() - timedelta(days=1)
+        fromDate = date.fromisoformat(fromdate) if fromdate else toDate
+    except ValueError as ex:
+        logging.error("Invalid date. Error: {}".format(str(ex)))
+        return
+    if fromDate > toDate:
+        logging.error("The from date must not be after the to date.")
+        return
+
+    iosPlusMethodList = ",".join(methodNames)
+    try:
+        iosPlusSession = Session()
+        iosPlusSession.auth = HTTPBasicAuth(username + "@" + companyname, password)
+        InstallTransientStatusHook(iosPlusSession)
+        iosPlusWsdlLocation = wsdlCache.GetWsdl(iosPlusSession, endpoint, "IOSPlus", iosname, iosPlusMethodList, cacheDirectory=wsdlcache, ttl=wsdlcachettl, offline=offline)
+        iosPlusClient = Client(iosPlusWsdlLocation, settings=Settings(strict = False, xml_huge_tree = True), transport=Transport(session=iosPlusSession))
+        iosPlusClient.set_ns_prefix("ns0", "http://webservices.iress.com.au/v4/")
+        iosPlusClientFactory = iosPlusClient.type_factory('http://webservices.iress.com.au/v4/')
+    except Exception as ex:
+        logging.error("Accessing Web Services WSDL failed. Error: {}".format(str(ex)))
+        return
+    except:
+        logging.error("Accessing Web Services WSDL failed. Error: Unspecified")
+        return
+
+    try:
+        sessionManager = SessionManager(iosPlusClient, iosPlusClientFactory, endpoint, username, companyname, password, service="IOSPLUS", server=iosname, storePath=sessionstore, sessionLifetime=sessionlifetime)
+        if newsession:
+            sessionManager.invalidate()
+        sessionManager.getSessionKeys()
+        sessionManager.startRenewal()
+    except Exception as ex:
+        logging.error("Web Services session creation failed. Error: {}".format(str(ex)))
+        return
+    except:
+        logging.error("Web Services session creation failed. Error: Unspecified")
+        return
+
+    startTime = time.time()
+    scheduler = RequestScheduler(rate=ratelimit or None, maxConcurrency=parallelism, maxAttempts=maxattempts)
+    checkpoint = ExtractCheckpoint(os.path.join(output, "checkpoint.json"))
+    try:
+        failedCount = ExtractHistory(iosPlusClient, iosPlusClientFactory, scheduler, ("IOSPLUS", iosname), sessionManager, checkpoint, output, methodNames, fromDate, toDate, parallelism, pagesize, rowgroupsize)
+    finally:
+        sessionManager.close()
+
+    logging.info(scheduler.formatSummary())
+    logging.info("Finished in {:.2f}s with {} failed extracts. Files are in {}".format(time.time() - startTime, failedCount, os.path.abspath(output)))
+
+def runMain():
+    main()
+
+if __name__ == "__main__":
+    runMain()
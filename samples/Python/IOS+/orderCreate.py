@@ -1,14 +1,134 @@
 from requests import Session
 from requests.auth import HTTPBasicAuth
-from zeep.transports import Transport
-from zeep import Client, Settings
+from zeep import Settings
 import logging
 import os
 import time
 import click
 import socket
 import uuid
-import time
+import threading
+import sys
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), "..", "Common"))
+import wsdlCache
+from sessionManager import SessionManager, DEFAULT_STORE_PATH, DEFAULT_SESSION_LIFETIME
+from soapMetrics import SoapMetrics, MeteredClient, ServeMetrics
+from latencyStats import Percentile
+from requestScheduler import RequestScheduler, InstallTransientStatusHook, DEFAULT_MAX_ATTEMPTS
+
+# An order waiting to be sent. OrderIndex is the running order number used in the log messages.
+PendingOrder = namedtuple("PendingOrder", ["OrderIndex", "SideCode", "AccountCode", "SecurityCode", "Exchange", "Destination", "OrderVolume", "OrderPrice"])
+
+# Collects per-request latencies and order outcomes from the worker threads. Keeps both the full run and the current
+# reporting interval so that tail latency can be reported as the run progresses, not just once at the end. The
+# latencies are the OrderCreate3 call durations measured by soapMetrics.
+class OrderLatencyStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.allLatencies = []
+        self.allOrderCount = 0
+        self.allErrorCount = 0
+        self.intervalLatencies = []
+        self.intervalOrderCount = 0
+        self.intervalErrorCount = 0
+        self.intervalStartTime = time.perf_counter()
+
+    def recordCall(self, call):
+        # Observer of the SoapMetrics the workers' clients record their calls in
+        if call["Operation"] == "OrderCreate3":
+            with self.lock:
+                self.allLatencies.append(call["CallSeconds"])
+                self.intervalLatencies.append(call["CallSeconds"])
+
+    def recordOrders(self, orderCount, errorCount):
+        with self.lock:
+            self.allOrderCount = self.allOrderCount + orderCount
+            self.allErrorCount = self.allErrorCount + errorCount
+            self.intervalOrderCount = self.intervalOrderCount + orderCount
+            self.intervalErrorCount = self.intervalErrorCount + errorCount
+
+    def takeInterval(self):
+        with self.lock:
+            now = time.perf_counter()
+            intervalLatencies, intervalOrderCount, intervalErrorCount, intervalTime = self.intervalLatencies, self.intervalOrderCount, self.intervalErrorCount, now - self.intervalStartTime
+            self.intervalLatencies = []
+            self.intervalOrderCount = 0
+            self.intervalErrorCount = 0
+            self.intervalStartTime = now
+        return intervalLatencies, intervalOrderCount, intervalErrorCount, intervalTime
+
+def FormatLatencySummary(latencies, orderCount, errorCount, timeTaken):
+    sortedLatencies = sorted(latencies)
+    ordersPerSecond = orderCount / timeTaken if timeTaken > 0 else 0.0
+    errorRate = 100.0 * errorCount / orderCount if orderCount else 0.0
+    return "Orders: {} Requests: {} Orders/sec: {:.2f} Errors: {} ({:.2f}%) Request latency p50: {:.4f}s p95: {:.4f}s p99: {:.4f}s max: {:.4f}s".format(orderCount, len(sortedLatencies), ordersPerSecond, errorCount, errorRate, Percentile(sortedLatencies, 50), Percentile(sortedLatencies, 95), Percentile(sortedLatencies, 99), sortedLatencies[-1] if sortedLatencies else 0.0)
+
+def ReportIntervals(stats, reportInterval, stopEvent):
+    while not stopEvent.wait(reportInterval):
+        intervalLatencies, intervalOrderCount, intervalErrorCount, intervalTime = stats.takeInterval()
+        logging.info("Interval: {}".format(FormatLatencySummary(intervalLatencies, intervalOrderCount, intervalErrorCount, intervalTime)))
+
+def BatchOrders(orders, batchSize):
+    # Collect orders into lists of up to batchSize, each of which is sent as a single OrderCreate3 request.
+    batch = []
+    for order in orders:
+        batch.append(order)
+        if len(batch) == batchSize:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def CreateOrderBatch(iosPlusClient, iosPlusClientFactory, serviceSessionKey, batch, scheduler, schedulerKey):
+    # Send every order in the batch as one OrderCreate3 request using the parallel parameter arrays. The response holds
+    # one DataRow per order, in the same order as the request arrays, which is used to map each result back to its order.
+    # The request goes through the scheduler, which retries it with the same RequestID when it fails transiently.
+    # Returns the number of orders in the batch that failed.
+    orderCreateRequestID = str(uuid.uuid4()) # Generate a request ID to support paging through the OrderCreate3 method
+    orderCreateResponse = None
+    batchDescription = "#{}".format(batch[0].OrderIndex) if len(batch) == 1 else "#{}-#{}".format(batch[0].OrderIndex, batch[-1].OrderIndex)
+
+    try:
+        orderCreateInputParameters = iosPlusClientFactory.OrderCreate3InputParameters(SideCodeArray={"SideCode": [order.SideCode for order in batch]}, AccountCodeArray={"AccountCode": [order.AccountCode for order in batch]}, SecurityCodeArray={"SecurityCode": [order.SecurityCode for order in batch]}, ExchangeArray={"Exchange": [order.Exchange for order in batch]}, DestinationArray={"Destination": [order.Destination for order in batch]}, OrderVolumeArray={"OrderVolume": [order.OrderVolume for order in batch]}, OrderPriceArray={"OrderPrice": [order.OrderPrice for order in batch]})
+        orderCreateInput = iosPlusClientFactory.OrderCreate3Input(Header=iosPlusClientFactory.OrderCreate3InputHeader(ServiceSessionKey=serviceSessionKey, RequestID=orderCreateRequestID),Parameters=orderCreateInputParameters)
+        orderCreateResponse = scheduler.call(schedulerKey, "OrderCreate3", iosPlusClient.service.OrderCreate3, orderCreateInput, requestId=orderCreateRequestID, idempotent=False)
+    except Exception as ex:
+        logging.error("Order create {} failed. Error: {}".format(batchDescription, str(ex)))
+        return len(batch)
+    except:
+        logging.error("Order create {} failed. Error: Unspecified".format(batchDescription))
+        return len(batch)
+
+    # Check requet status to determine if there is any more data available after this response
+    orderCreateRequestStatus = orderCreateResponse.Result.Header.StatusCode
+    # Status codes: 1 - More data available, 2 - Finished, 3 - Watching for updates.
+    # In this script, should only ever hit 2.
+    if orderCreateRequestStatus != 2:
+        logging.error("Order create {} failed. Error: Unexpected request status [{}]".format(batchDescription, orderCreateRequestStatus))
+        return len(batch)
+
+    orderCreateDataRows = []
+    if orderCreateResponse.Result.DataRows:
+        orderCreateDataRows = orderCreateResponse.Result.DataRows.DataRow
+
+    failedCount = 0
+    for order, orderCreateDataRow in zip(batch, orderCreateDataRows):
+        errorMessage = orderCreateDataRow.ErrorMessage
+        if errorMessage:
+            logging.error("Order create #{} failed - Error: '{}'".format(order.OrderIndex, errorMessage))
+            failedCount = failedCount + 1
+        else:
+            logging.info("Order created #{} succeeded - Ord#: {} Destination: {} Account: {}".format(order.OrderIndex, orderCreateDataRow.OrderNumber, order.Destination, order.AccountCode))
+
+    # Any order without a matching DataRow has no result to report, so count it as failed.
+    for order in batch[len(orderCreateDataRows):]:
+        logging.error("Order create #{} failed. Error: No result returned for order".format(order.OrderIndex))
+        failedCount = failedCount + 1
+
+    return failedCount
 
 # Use click library to process command line arguments - this way we can support the provision of a password and where not passed by user it will prompt them
 @click.command()
@@ -17,13 +137,28 @@ import time
 @click.option('--password', '-p', prompt=True, confirmation_prompt=False, hide_input=True)
 @click.option('--iosname', '-i', prompt="IOS+ Server Name", help='The IOS+ server name to connect to.', default="IOSPLUSAPIRETAIL3")  
 @click.option('--endpoint', '-e', prompt="Web Services WSDL Endpoint", help='The Web Services WSDL endpoint to connect to.', default="https://webservices.iress.com.au/v4/wsdl.aspx")
-@click.option('--ordercount', '-o', prompt="Number of orders to create", help='The total number of orders to create (one at a time).', default="10")
+@click.option('--ordercount', '-o', prompt="Number of orders to create", help='The total number of orders to create (one at a time per worker).', default="10")
 @click.option('--securitycode', '-s', prompt="Security Code", help='The security code to use on order creation.', default="BHP")
 @click.option('--exchange', '-x', prompt="Exchange", help='The exchange to use on order creation.', default="ASX")
 @click.option('--destination', '-d', prompt="Destination", help='The destination to use on order creation.', default="DESK")
 @click.option('--accountcode', '-a', prompt="Account Code", help='The account code to use on order creation.', default="UNKNOWN")
+@click.option('--workers', '-w', prompt="Number of concurrent workers", help='The number of workers creating orders concurrently, each with its own HTTP session.', default="1")
+@click.option('--batchsize', '-b', help='The number of orders to send in each OrderCreate3 request.', default=1)
+@click.option('--ratelimit', help='The most OrderCreate3 requests per second to send to the IOS+ server, or 0 for no limit.', default=0.0)
+@click.option('--maxattempts', help='The number of times to try an OrderCreate3 request the server turned away as busy (HTTP 429 or 503) or that could not connect. Requests that time out or fail at a gateway are not retried, as the orders may have been created.', default=DEFAULT_MAX_ATTEMPTS)
+@click.option('--reportinterval', '-r', help='The interval in seconds at which to report latency percentiles, throughput and error rates.', default=5.0)
+@click.option('--standin', is_flag=True, help='Run against a local mock Web Services server (Common/mockWebServices.py) instead of the endpoint.')
+@click.option('--wsdlcache', help='The directory to cache WSDLs in between runs.', default=wsdlCache.DEFAULT_CACHE_DIRECTORY)
+@click.option('--wsdlcachettl', help='The number of seconds a cached WSDL is used for before it is fetched again.', default=wsdlCache.DEFAULT_TTL)
+@click.option('--metricsfile', help='A file to write the per-operation metrics to at the end of the run, in the Prometheus text format.', default=None)
+@click.option('--metricsport', help='A port to serve the per-operation metrics on for Prometheus to scrape while the run is in progress.', default=None, type=int)
+@click.option('--tracefile', help='A file to append a JSON line to for every Web Services call.', default=None)
+@click.option('--offline', is_flag=True, help='Only use WSDLs already in the WSDL cache directory, never fetch them from the endpoint.')
+@click.option('--sessionstore', help='The file that IRESS and IOS+ session keys are shared between runs through. Pass an empty value to start sessions for this run only, kicking the user\'s other sessions.', default=DEFAULT_STORE_PATH)
+@click.option('--sessionlifetime', help='The number of seconds the server keeps a session for. Sessions are renewed shortly before then, and sessions the server ends sooner are restarted when it rejects them.', default=DEFAULT_SESSION_LIFETIME)
+@click.option('--newsession', is_flag=True, help='Start new sessions rather than reusing the ones in the session store.')
 
-def main(username, companyname, password, iosname, endpoint, ordercount, securitycode, exchange, destination, accountcode):
+def main(username, companyname, password, iosname, endpoint, ordercount, securitycode, exchange, destination, accountcode, workers, batchsize, ratelimit, maxattempts, reportinterval, standin, wsdlcache, wsdlcachettl, metricsfile, metricsport, tracefile, offline, sessionstore, sessionlifetime, newsession):
     # Work out where to store the logs - use the current hostname and date/time in the filename
     hostname = socket.gethostname()
     timeFormatted = time.strftime("%Y%m%d-%H%M%S")
@@ -54,9 +189,32 @@ def main(username, companyname, password, iosname, endpoint, ordercount, securit
         else:
             nOrderCount = int(ordercount)
 
+    # Verify the worker count is a valid number
+    workersStr = str(workers)
+    if not workersStr.isdigit() or int(workersStr) < 1:
+        logging.error("Worker count needs to be provided as a whole number value greater than 0.")
+        return
+    nWorkerCount = int(workersStr)
+
+    if batchsize < 1:
+        logging.error("Batch size needs to be greater than 0.")
+        return
+
+    # Point at a local mock server when requested, so load can be generated without a real IOS+ server.
+    if standin:
+        import mockWebServices
+        standInServer, endpoint = mockWebServices.StartMockServer()
+        logging.info("Using mock Web Services endpoint {}".format(endpoint))
+        wsdlcache = None # The mock server runs on a different port each time, so its WSDL and sessions are not worth keeping
+        sessionstore = None
+
     # Configure Zeep settings
     settings = Settings(strict = False, xml_huge_tree = True)
 
+    # Every call made through the clients is recorded in the metrics, split into serialize, wire and parse time
+    metrics = SoapMetrics(tracefile)
+    metricsServer = ServeMetrics(metrics, metricsport) if metricsport else None
+
     # Work out IOS+ WSDL endpoint details
     iosPlusMethodList = "OrderCreate3"
     iosPlusWsdl = "{}?svc=IOSPlus&svr={}&mf={}".format(endpoint, iosname, iosPlusMethodList)
@@ -69,7 +227,8 @@ def main(username, companyname, password, iosname, endpoint, ordercount, securit
 
         iosPlusSession = Session()
         iosPlusSession.auth = HTTPBasicAuth(userCompany, password)
-        iosPlusClient = Client(iosPlusWsdl, settings=settings, transport=Transport(session=iosPlusSession))
+        iosPlusWsdlLocation = wsdlCache.GetWsdl(iosPlusSession, endpoint, "IOSPlus", iosname, iosPlusMethodList, cacheDirectory=wsdlcache, ttl=wsdlcachettl, offline=offline)
+        iosPlusClient = MeteredClient(iosPlusWsdlLocation, metrics, settings=settings, session=iosPlusSession)
 
         # Check that the service is healthy.
         if iosPlusClient.wsdl.messages == {}:
@@ -86,13 +245,14 @@ def main(username, companyname, password, iosname, endpoint, ordercount, securit
         logging.error("Accessing Web Services WSDL failed. WSDL URL: {} Error: Unspecified".format(iosPlusWsdl))
         return
     
-    # Start the IRESS and IOS+ Service session
+    # Start the IRESS and IOS+ Service session, or reuse the ones a previous run left in the session store. The session
+    # manager renews them in the background for long runs, and the workers always pick up the current keys from it.
     try:
-        appId = str(uuid.uuid4()) # Generate a application ID that is unique.
-        iressSessionStartResponse = iosPlusClient.service.IRESSSessionStart(iosPlusClientFactory.IRESSSessionStartInput(Header=iosPlusClientFactory.IRESSSessionStartInputHeader(Updates=False), Parameters=iosPlusClientFactory.IRESSSessionStartInputParameters(UserName=username, CompanyName=companyname, ApplicationID=appId, Password=password, SessionNumberToKick=-2, KickLikeSessions=True)))
-        iressSessionKey = iressSessionStartResponse.Result.DataRows.DataRow[0].IRESSSessionKey
-        serviceSessionStartResponse = iosPlusClient.service.ServiceSessionStart(iosPlusClientFactory.ServiceSessionStartInput(Parameters=iosPlusClientFactory.ServiceSessionStartInputParameters(IRESSSessionKey=iressSessionKey, Service= "IOSPLUS", Server=iosname)))
-        serviceSessionKey = serviceSessionStartResponse.Result.DataRows.DataRow[0].ServiceSessionKey
+        sessionManager = SessionManager(iosPlusClient, iosPlusClientFactory, endpoint, username, companyname, password, service="IOSPLUS", server=iosname, storePath=sessionstore or None, sessionLifetime=sessionlifetime, kickLikeSessions=True)
+        if newsession:
+            sessionManager.invalidate()
+        iressSessionKey, serviceSessionKey = sessionManager.getSessionKeys()
+        sessionManager.startRenewal()
     except Exception as ex:
         logging.error("Web Services session creation failed. Error: {}".format(str(ex)))
         return
@@ -100,44 +260,65 @@ def main(username, companyname, password, iosname, endpoint, ordercount, securit
         logging.error("Web Services session creation failed. Error: Unspecified")
         return
 
-    logging.info("Sessions created for user {}@{}, IRESS session key: {} Service Session Key: {}\n\nCreating orders...".format(username, companyname, iressSessionKey, serviceSessionKey))
+    logging.info("Using sessions for user {}@{}, IRESS session key: {} Service Session Key: {}\n\nCreating orders...".format(username, companyname, iressSessionKey, serviceSessionKey))
+
+    # Each worker gets its own requests Session and zeep Transport so connections are not shared between threads.
+    # The parsed WSDL is shared, so only the first client pays for loading it.
+    workerState = threading.local()
+
+    def InitialiseWorker():
+        workerSession = Session()
+        workerSession.auth = HTTPBasicAuth(userCompany, password)
+        InstallTransientStatusHook(workerSession)
+        sessionManager.installRestartHook(workerSession)
+        workerState.client = MeteredClient(iosPlusClient.wsdl, metrics, settings=settings, session=workerSession)
+        workerState.client.set_ns_prefix("ns0", "http://webservices.iress.com.au/v4/")
+
+    # Requests to the IOS+ server are rate limited and retried through the scheduler, which also lowers the number in
+    # flight below the worker count when the server slows down
+    scheduler = RequestScheduler(rate=ratelimit or None, maxConcurrency=nWorkerCount, maxAttempts=maxattempts)
+    schedulerKey = ("IOSPLUS", iosname)
+
+    def CreateAndCountOrderBatch(batch):
+        failedCount = CreateOrderBatch(workerState.client, iosPlusClientFactory, sessionManager.getServiceSessionKey(), batch, scheduler, schedulerKey)
+        stats.recordOrders(len(batch), failedCount)
+        return failedCount
+
+    orders = (PendingOrder(i, "1", accountcode, securitycode, exchange, destination, 100, 100) for i in range(1, nOrderCount + 1))
+
+    # Create orders across the workers, batchsize orders per request, and measure the latency of each request.
+    stats = OrderLatencyStats()
+    metrics.observers.append(stats.recordCall)
+    stopReporting = threading.Event()
+    reporterThread = threading.Thread(target=ReportIntervals, args=(stats, reportinterval, stopReporting), daemon=True)
 
-    # Create orders, one at a time, and measure average latency.
     start_time = time.time()
+    reporterThread.start()
+
+    with ThreadPoolExecutor(max_workers=nWorkerCount, initializer=InitialiseWorker) as executor:
+        failedCount = sum(executor.map(CreateAndCountOrderBatch, BatchOrders(orders, batchsize)))
 
-    for i in range(1, nOrderCount + 1):
-        orderCreateRequestID = str(uuid.uuid4()) # Generate a request ID to support paging through the OrderCreate3 method
-        orderCreateResponse = None
-
-        try:
-            orderCreateResponse = iosPlusClient.service.OrderCreate3(iosPlusClientFactory.OrderCreate3Input(Header=iosPlusClientFactory.OrderCreate3InputHeader(ServiceSessionKey=serviceSessionKey, RequestID=orderCreateRequestID),Parameters=iosPlusClientFactory.OrderCreate3InputParameters(SideCodeArray="1", AccountCodeArray=accountcode, SecurityCodeArray=securitycode, ExchangeArray=exchange, DestinationArray=destination, OrderVolumeArray=100, OrderPriceArray=100)))
-        except Exception as ex:
-            logging.error("Order create #{} failed. Error: {}".format(i, str(ex)))            
-        except:
-            logging.error("Order create #{} failed. Error: Unspecified".format(i))            
-
-        # Check requet status to determine if there is any more data available after this response
-        if orderCreateResponse:
-            orderCreateRequestStatus = orderCreateResponse.Result.Header.StatusCode
-            # Status codes: 1 - More data available, 2 - Finished, 3 - Watching for updates.
-            # In this script, should only ever hit 2.
-            if orderCreateRequestStatus == 2:
-                if orderCreateResponse.Result.DataRows:
-                    orderCreateDataRows = orderCreateResponse.Result.DataRows.DataRow
-
-                    for orderCreateDataRow in orderCreateDataRows:
-                        errorMessage = orderCreateDataRow.ErrorMessage
-                        if errorMessage:
-                            logging.error("Order create #{} failed - Error: '{}'".format(i, errorMessage))
-                        else:
-                            logging.info("Order created #{} succeeded - Ord#: {} Destination: {} Account: {}".format(i, orderCreateDataRow.OrderNumber, destination, accountcode))
-            else:
-                logging.error("Order create #{} failed. Error: Unexpected request status [{}]".format(i, orderCreateRequestStatus))
+    stopReporting.set()
+    reporterThread.join()
+    sessionManager.close()
 
     end_time = time.time()
     time_taken = end_time - start_time
 
-    logging.info("Finished creating {} orders. Overall time taken: {:.2f}s. Average time per order: {:.4f}s".format(i, time_taken, time_taken/i))
+    logging.info("Finished creating {} orders with {} workers in batches of {}. Overall time taken: {:.2f}s. Average time per order: {:.4f}s Failed orders: {}".format(nOrderCount, nWorkerCount, batchsize, time_taken, time_taken / max(nOrderCount, 1), failedCount))
+    logging.info("Overall: {}".format(FormatLatencySummary(stats.allLatencies, stats.allOrderCount, stats.allErrorCount, time_taken)))
+    for summaryLine in metrics.formatSummary():
+        logging.info(summaryLine)
+    logging.info(scheduler.formatSummary())
+
+    if metricsfile:
+        metrics.writeExposition(metricsfile)
+    if metricsServer:
+        metricsServer.shutdown()
+    metrics.close()
+
+    if standin:
+        standInServer.shutdown()
 
 def runMain():
     main()
@@ -0,0 +1,299 @@
+from requests import Session
+from requests.auth import HTTPBasicAuth
+from zeep.transports import Transport
+from zeep import Client, Settings
+import asyncio
+import functools
+import inspect
+import logging
+import os
+import socket
+import time
+import uuid
+import sys
+import click
+
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), "..", "Common"))
+import wsdlCache
+import pager
+import rawResponse
+from securityKey import SecurityKey
+from sessionManager import SessionManager, DEFAULT_STORE_PATH, DEFAULT_SESSION_LIFETIME
+from referenceDataCache import ReferenceDataCache, DEFAULT_STORE_PATH as DEFAULT_REFERENCE_DATA_STORE_PATH
+
+# Keeps an in-memory order book for a set of accounts up to date through OrderPadGetByAccountUpdates, rather than
+# downloading full OrderPadGetByAccount snapshots over and over. A snapshot is taken once with Updates=true, which
+# leaves the request watching for updates on the server (StatusCode 3). The same RequestID is then passed to
+# OrderPadGetByAccountUpdates, which waits for up to the Timeout header's number of seconds and returns only the orders
+# that changed. The changes are applied to the order book by order number and passed to the change callbacks.
+#
+# The order pad rows are wide, so they are decoded with Common/rawResponse.py, keeping only ORDER_FIELDS.
+#
+# Given a ReferenceDataCache, the securities of each snapshot and update are looked up with SecurityInformationGet
+# before the orders are applied, only for the securities the cache does not already hold. The callbacks can then read
+# their ISIN and SEDOL from the cache without calling the server.
+
+STATUS_MORE_DATA_AVAILABLE = 1
+STATUS_WATCHING_FOR_UPDATES = 3
+
+ORDER_FIELDS = ["OrderNumber", "RootParentOrderNumber", "ParentOrderNumber", "AccountCode", "SecurityCode", "Exchange", "Destination", "BuyOrSell", "PricingInstructions", "OrderState", "LastAction", "ActionStatus", "OrderVolume", "OrderPrice", "RemainingVolume", "DoneVolumeTotal", "DoneValueTotal", "AveragePrice", "StateDescription", "UpdateDateTime"]
+ORDER_COERCIONS = { "OrderNumber": int, "RootParentOrderNumber": int, "ParentOrderNumber": int, "OrderVolume": float, "OrderPrice": float, "RemainingVolume": float, "DoneVolumeTotal": float, "DoneValueTotal": float, "AveragePrice": float }
+Order = rawResponse.RowSchema("Order", ORDER_FIELDS)
+
+ORDER_ADDED = "Added"
+ORDER_CHANGED = "Changed"
+ORDER_REMOVED = "Removed"
+
+MAXIMUM_RETRY_DELAY = 30
+
+# Orders keyed by order number. Every change is passed to the callbacks as (changeType, order, previousOrder), where
+# previousOrder is None for an added order. Callbacks run on the event loop, so should not block. A callback may be a
+# coroutine function, in which case it is scheduled as a task. The tasks are held until they finish, as the event loop
+# only keeps a weak reference to them, and a task that fails has its error logged.
+class OrderBook:
+    def __init__(self):
+        self.orders = {}
+        self.callbacks = []
+        self.callbackTasks = set()
+
+    def addCallback(self, callback):
+        self.callbacks.append(callback)
+
+    def notify(self, changeType, order, previousOrder):
+        for callback in self.callbacks:
+            callbackResult = callback(changeType, order, previousOrder)
+            if inspect.isawaitable(callbackResult):
+                callbackTask = asyncio.ensure_future(callbackResult)
+                self.callbackTasks.add(callbackTask)
+                callbackTask.add_done_callback(self.callbackFinished)
+
+    def callbackFinished(self, callbackTask):
+        self.callbackTasks.discard(callbackTask)
+        if not callbackTask.cancelled() and callbackTask.exception() is not None:
+            logging.error("Order change callback failed. Error: {}".format(str(callbackTask.exception())))
+
+    def applyOrders(self, orders):
+        # Apply incremental rows. Rows that are the same as the order already held are not reported as changes.
+        changedCount = 0
+        for order in orders:
+            previousOrder = self.orders.get(order.OrderNumber)
+            if previousOrder == order:
+                continue
+            self.orders[order.OrderNumber] = order
+            self.notify(ORDER_CHANGED if previousOrder else ORDER_ADDED, order, previousOrder)
+            changedCount = changedCount + 1
+        return changedCount
+
+    def replaceOrders(self, orders):
+        # Apply a full snapshot, removing the orders that are no longer in it
+        orders = list(orders)
+        snapshotOrderNumbers = set(order.OrderNumber for order in orders)
+        changedCount = self.applyOrders(orders)
+        for orderNumber in [orderNumber for orderNumber in self.orders if orderNumber not in snapshotOrderNumbers]:
+            self.notify(ORDER_REMOVED, None, self.orders.pop(orderNumber))
+            changedCount = changedCount + 1
+        return changedCount
+
+class OrderPadSubscription:
+    def __init__(self, client, clientFactory, sessionManager, accountCodes, orderBook=None, pollTimeout=25, pageSize=1000, referenceDataCache=None):
+        self.client = client
+        self.clientFactory = clientFactory
+        self.sessionManager = sessionManager
+        self.accountCodes = accountCodes
+        self.orderBook = orderBook or OrderBook()
+        self.pollTimeout = pollTimeout
+        self.pageSize = pageSize
+        self.referenceDataCache = referenceDataCache
+        self.requestId = None
+        self.stopped = False
+
+    def callRaw(self, operationName, header, parameters):
+        inputType = getattr(self.clientFactory, operationName + "Input")
+        headerType = getattr(self.clientFactory, operationName + "InputHeader")
+        parametersType = getattr(self.clientFactory, operationName + "InputParameters")
+        return rawResponse.CallRaw(self.client, operationName, inputType(Header=headerType(ServiceSessionKey=self.sessionManager.getServiceSessionKey(), **header), Parameters=parametersType(**parameters)))
+
+    def decodeOrders(self, content, resultHeader):
+        return list(rawResponse.DecodeRows(content, Order, ORDER_COERCIONS, resultHeader))
+
+    def requestOrders(self, operationName, header, parameters):
+        # Make one call and decode its orders. Runs on a worker thread, as the zeep call blocks for up to pollTimeout.
+        resultHeader = {}
+        orders = self.decodeOrders(self.callRaw(operationName, header, parameters), resultHeader)
+        return resultHeader, orders
+
+    def requestSnapshot(self, header, parameters):
+        # Page through the snapshot with pager, under the subscription's RequestID. Returns the last page's result
+        # header, whose StatusCode says whether the server is watching the request, and the orders of every page.
+        resultHeader = {}
+        snapshotOrders = []
+        for resultHeader, orders in pager.GetRawResults(lambda pagingHeader: self.callRaw("OrderPadGetByAccount", dict(header, **pagingHeader), parameters), self.decodeOrders, self.pageSize, prefetch=False, requestId=self.requestId):
+            snapshotOrders.extend(orders)
+        return resultHeader, snapshotOrders
+
+    async def populateReferenceData(self, orders):
+        # A failed lookup is only logged, as the orders are still worth applying without their reference data
+        if self.referenceDataCache is None:
+            return
+        securityKeys = set(SecurityKey(order.SecurityCode, order.Exchange) for order in orders if order.SecurityCode and order.Exchange)
+        if not securityKeys:
+            return
+        try:
+            await asyncio.to_thread(self.referenceDataCache.populate, securityKeys)
+        except Exception as ex:
+            logging.warning("Security information lookup failed. Error: {}".format(str(ex)))
+
+    async def takeSnapshot(self):
+        # Take the full order pad with Updates=true, so the server keeps watching the request for changes
+        self.requestId = str(uuid.uuid4())
+        header = { "Updates": True, "Timeout": self.pollTimeout, "WaitForResponse": True }
+        parameters = { "AccountCodeArray": { "AccountCode": self.accountCodes }, "OrderFilter": 1, "DestinationExclude": False, "RetrieveSecurityDescription": False }
+        resultHeader, snapshotOrders = await asyncio.to_thread(self.requestSnapshot, header, parameters)
+        await self.populateReferenceData(snapshotOrders)
+        changedCount = self.orderBook.replaceOrders(snapshotOrders)
+        logging.info("Order pad snapshot for {}: {} orders, {} changed".format(", ".join(self.accountCodes), len(self.orderBook.orders), changedCount))
+        return resultHeader.get("StatusCode")
+
+    async def pollUpdates(self):
+        # Long-poll for updates to the snapshot's RequestID until the server stops watching it
+        header = { "RequestID": self.requestId, "PageSize": self.pageSize, "Timeout": self.pollTimeout, "WaitForResponse": True }
+        parameters = { "AccountCodeArray": { "AccountCode": self.accountCodes }, "DestinationExclude": False }
+        while not self.stopped:
+            resultHeader, orders = await asyncio.to_thread(self.requestOrders, "OrderPadGetByAccountUpdates", header, parameters)
+            if orders:
+                await self.populateReferenceData(orders)
+                self.orderBook.applyOrders(orders)
+            statusCode = resultHeader.get("StatusCode")
+            if statusCode not in (STATUS_MORE_DATA_AVAILABLE, STATUS_WATCHING_FOR_UPDATES):
+                logging.info("Order pad updates stopped with StatusCode {}, taking a new snapshot".format(statusCode))
+                return
+
+    async def run(self):
+        # Snapshot then long-poll, taking a new snapshot whenever the updates stop or fail. Failures are retried with
+        # an exponential backoff.
+        retryDelay = 1
+        while not self.stopped:
+            try:
+                if await self.takeSnapshot() == STATUS_WATCHING_FOR_UPDATES:
+                    retryDelay = 1
+                    await self.pollUpdates()
+                else:
+                    logging.warning("Order pad request is not watching for updates, taking a new snapshot in {}s".format(retryDelay))
+                    await asyncio.sleep(retryDelay)
+                    retryDelay = min(retryDelay * 2, MAXIMUM_RETRY_DELAY)
+            except asyncio.CancelledError:
+                raise
+            except Exception as ex:
+                logging.error("Order pad subscription failed, retrying in {}s. Error: {}".format(retryDelay, str(ex)))
+                await asyncio.sleep(retryDelay)
+                retryDelay = min(retryDelay * 2, MAXIMUM_RETRY_DELAY)
+
+    def stop(self):
+        # The subscription stops once the current long-poll returns
+        self.stopped = True
+
+def LogOrderChange(changeType, order, previousOrder, referenceDataCache=None):
+    order = order or previousOrder
+    referenceData = referenceDataCache.get(SecurityKey(order.SecurityCode, order.Exchange)) if referenceDataCache is not None and order.SecurityCode and order.Exchange else None
+    referenceDataText = " ISIN: {} SEDOL: {}".format(referenceData.ISIN, referenceData.SEDOL) if referenceData is not None else ""
+    logging.info("{} order {}: {} {} {}.{} {}/{} @ {} {}{}".format(changeType, order.OrderNumber, order.AccountCode, order.BuyOrSell, order.SecurityCode, order.Exchange, order.RemainingVolume, order.OrderVolume, order.OrderPrice, order.OrderState, referenceDataText))
+
+# Use click library to process command line arguments - this way we can support the provision of a password and where not passed by user it will prompt them
+@click.command()
+@click.option('--username', '-u', prompt="IRESS User Name", help='The IRESS username to login to Web Services using.')
+@click.option('--companyname', '-c', prompt="Company Name", help='The company name to login to Web Services using.')
+@click.option('--password', '-p', prompt=True, confirmation_prompt=False, hide_input=True)
+@click.option('--iosname', '-i', prompt="IOS+ Server Name", help='The IOS+ server name to connect to.', default="IOSPLUSAPIRETAIL3")
+@click.option('--endpoint', '-e', prompt="Web Services WSDL Endpoint", help='The Web Services WSDL endpoint to connect to.', default="https://webservices.iress.com.au/v4/wsdl.aspx")
+@click.option('--accountcodes', '-a', prompt="Account Codes", help='Comma separated account codes to watch the order pad of.', default="UNKNOWN")
+@click.option('--timeout', '-t', help='The number of seconds each long-poll for updates waits on the server.', default=25)
+@click.option('--pagesize', help='The number of orders to request in each page of the snapshot.', default=1000)
+@click.option('--referencedatastore', help='The SQLite file to keep the ISIN and SEDOL of the orders\' securities in between runs, or an empty value to not look them up.', default=DEFAULT_REFERENCE_DATA_STORE_PATH)
+@click.option('--wsdlcache', help='The directory to cache WSDLs in between runs.', default=wsdlCache.DEFAULT_CACHE_DIRECTORY)
+@click.option('--wsdlcachettl', help='The number of seconds a cached WSDL is used for before it is fetched again.', default=wsdlCache.DEFAULT_TTL)
+@click.option('--offline', is_flag=True, help='Only use WSDLs already in the WSDL cache directory, never fetch them from the endpoint.')
+@click.option('--sessionstore', help='The file that IRESS and IOS+ session keys are shared between runs through.', default=DEFAULT_STORE_PATH)
+@click.option('--sessionlifetime', help='The number of seconds the server keeps a session for. Sessions are renewed shortly before then, and sessions the server ends sooner are restarted when it rejects them.', default=DEFAULT_SESSION_LIFETIME)
+@click.option('--newsession', is_flag=True, help='Start new sessions rather than reusing the ones in the session store.')
+def main(username, companyname, password, iosname, endpoint, accountcodes, timeout, pagesize, referencedatastore, wsdlcache, wsdlcachettl, offline, sessionstore, sessionlifetime, newsession):
+    # Work out where to store the logs - use the current hostname and date/time in the filename
+    logOutputFileName = 'orderpadsubscription_{}_{}.log'.format(socket.gethostname(), time.strftime("%Y%m%d-%H%M%S"))
+    logFileFullPath = os.path.join(os.path.dirname(os.path.realpath(__file__)), logOutputFileName)
+
+    # Setup logger
+    loggingDateTimeFormat = '%Y-%m-%d %H:%M:%S'
+    logging.basicConfig(filename=logFileFullPath,level=logging.DEBUG,format='%(asctime)s.%(msecs)03d %(message)s', datefmt=loggingDateTimeFormat)
+    consoleHandler = logging.StreamHandler()
+    consoleHandler.setLevel(logging.INFO)
+    consoleHandler.setFormatter(logging.Formatter('%(asctime)s.%(msecs)03d %(message)s', datefmt=loggingDateTimeFormat))
+    logging.getLogger('').addHandler(consoleHandler)
+
+    iosPlusMethodList = "OrderPadGetByAccount,OrderPadGetByAccountUpdates"
+    try:
+        iosPlusSession = Session()
+        iosPlusSession.auth = HTTPBasicAuth(username + "@" + companyname, password)
+        iosPlusWsdlLocation = wsdlCache.GetWsdl(iosPlusSession, endpoint, "IOSPlus", iosname, iosPlusMethodList, cacheDirectory=wsdlcache, ttl=wsdlcachettl, offline=offline)
+
+        # The long-polls wait up to timeout seconds on the server, so allow for that on top of the usual request time
+        iosPlusClient = Client(iosPlusWsdlLocation, settings=Settings(strict = False, xml_huge_tree = True), transport=Transport(session=iosPlusSession, operation_timeout=timeout + 30))
+        iosPlusClient.set_ns_prefix("ns0", "http://webservices.iress.com.au/v4/")
+        iosPlusClientFactory = iosPlusClient.type_factory('http://webservices.iress.com.au/v4/')
+    except Exception as ex:
+        logging.error("Accessing Web Services WSDL failed. Error: {}".format(str(ex)))
+        return
+    except:
+        logging.error("Accessing Web Services WSDL failed. Error: Unspecified")
+        return
+
+    try:
+        sessionManager = SessionManager(iosPlusClient, iosPlusClientFactory, endpoint, username, companyname, password, service="IOSPLUS", server=iosname, storePath=sessionstore, sessionLifetime=sessionlifetime)
+        if newsession:
+            sessionManager.invalidate()
+        sessionManager.getSessionKeys()
+        sessionManager.startRenewal()
+    except Exception as ex:
+        logging.error("Web Services session creation failed. Error: {}".format(str(ex)))
+        return
+    except:
+        logging.error("Web Services session creation failed. Error: Unspecified")
+        return
+
+    # The reference data is looked up through the IRESS WSDL's SecurityInformationGet, with the IRESS session the
+    # session manager started
+    referenceDataCache = None
+    if referencedatastore:
+        try:
+            iressSession = Session()
+            iressSession.auth = iosPlusSession.auth
+            iressWsdlLocation = wsdlCache.GetWsdl(iressSession, endpoint, "IRESS", "", "SecurityInformationGet", cacheDirectory=wsdlcache, ttl=wsdlcachettl, offline=offline)
+            iressClient = Client(iressWsdlLocation, settings=Settings(strict = False, xml_huge_tree = True), transport=Transport(session=iressSession))
+            iressClient.set_ns_prefix("ns0", "http://webservices.iress.com.au/v4/")
+            referenceDataCache = ReferenceDataCache(iressClient, iressClient.type_factory('http://webservices.iress.com.au/v4/'), sessionManager, storePath=referencedatastore)
+        except Exception as ex:
+            logging.error("Accessing IRESS Web Services WSDL failed. Error: {}".format(str(ex)))
+            sessionManager.close()
+            return
+        except:
+            logging.error("Accessing IRESS Web Services WSDL failed. Error: Unspecified")
+            sessionManager.close()
+            return
+
+    orderBook = OrderBook()
+    orderBook.addCallback(functools.partial(LogOrderChange, referenceDataCache=referenceDataCache))
+    subscription = OrderPadSubscription(iosPlusClient, iosPlusClientFactory, sessionManager, [accountCode.strip() for accountCode in accountcodes.split(",")], orderBook, timeout, pagesize, referenceDataCache)
+
+    logging.info("Watching the order pad for {}. Press Ctrl+C to stop.".format(accountcodes))
+    try:
+        asyncio.run(subscription.run())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        sessionManager.close()
+        if referenceDataCache is not None:
+            referenceDataCache.close()
+
+def runMain():
+    main()
+
+if __name__ == "__main__":
+    runMain()
@@ -0,0 +1,297 @@
+from requests import Session
+from requests.auth import HTTPBasicAuth
+from zeep.transports import Transport
+from zeep import Client, Settings
+from array import array
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+import bisect
+import logging
+import os
+import socket
+import threading
+import time
+import sys
+import click
+
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), "..", "Common"))
+import wsdlCache
+import pager
+from sessionManager import SessionManager, DEFAULT_STORE_PATH, DEFAULT_SESSION_LIFETIME
+
+# Uploads a file to IPS through the upload methods: IPSUploadCreate1 creates the upload, IPSUploadDataSet1 sends the
+# file's lines in UploadTextArray chunks with UploadComplete set on the last one, IPSUploadRun1 starts processing it,
+# IPSUploadSummaryGet2 is polled until the run has finished, and IPSUploadErrorGet1 returns the lines that failed.
+#
+# The file is read lazily and sent in chunks of at most --chunklines lines and --chunkbytes bytes, with at most
+# --parallelism chunks in flight, so files of hundreds of thousands of lines are never held in memory. The first chunk,
+# which carries the <HeaderBegin>...<HeaderEnd> block, is sent on its own before the rest, and the last chunk is only
+# sent once every other chunk has been accepted. Each IPSUploadDataSet1 response returns the TotalRows uploaded so
+# far, which places that chunk's lines in the upload, so the errors can be reported against the lines of the source
+# file whatever order the chunks arrived in.
+
+# Upload statuses after which the run is no longer progressing
+FINISHED_UPLOAD_STATUSES = ["complete", "completed", "failed", "error", "cancelled", "aborted"]
+
+# The field of the IPSUploadErrorGet1 rows holding the line of the upload that failed
+ERROR_LINE_NUMBER_FIELD = "LineNumber"
+
+MAXIMUM_POLL_DELAY = 30
+
+def ReadUploadLines(uploadFile, textQualifier=None):
+    # Yield (source line number, text) for each record of the file. A record whose text qualifier is still open at the
+    # end of a line continues onto the next line, and is yielded as one record numbered by its first line.
+    recordLineNumber = None
+    record = None
+    for lineNumber, line in enumerate(uploadFile, 1):
+        line = line.rstrip("\r\n")
+        if record is None:
+            recordLineNumber = lineNumber
+            record = line
+        else:
+            record = record + "\n" + line
+        if not textQualifier or record.count(textQualifier) % 2 == 0:
+            yield recordLineNumber, record
+            record = None
+    if record is not None:
+        yield recordLineNumber, record
+
+def ChunkUploadLines(uploadLines, chunkLines, chunkBytes):
+    # Group the lines into chunks of at most chunkLines lines and, unless a single line is larger, chunkBytes bytes
+    chunk = []
+    chunkSize = 0
+    for uploadLine in uploadLines:
+        lineSize = len(uploadLine[1].encode("utf-8"))
+        if chunk and (len(chunk) == chunkLines or chunkSize + lineSize > chunkBytes):
+            yield chunk
+            chunk = []
+            chunkSize = 0
+        chunk.append(uploadLine)
+        chunkSize = chunkSize + lineSize
+    if chunk:
+        yield chunk
+
+# Maps the line numbers of the upload back to the lines of the source file, from where each chunk landed in the upload
+class UploadLineMap:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.chunkStarts = []
+        self.chunkSourceLineNumbers = []
+        self.lineCount = 0
+
+    def addChunk(self, totalRows, chunk):
+        with self.lock:
+            chunkStart = totalRows - len(chunk) + 1
+            index = bisect.bisect(self.chunkStarts, chunkStart)
+            self.chunkStarts.insert(index, chunkStart)
+            self.chunkSourceLineNumbers.insert(index, array("q", (sourceLineNumber for sourceLineNumber, text in chunk)))
+            self.lineCount = self.lineCount + len(chunk)
+
+    def getSourceLineNumber(self, uploadLineNumber):
+        index = bisect.bisect(self.chunkStarts, uploadLineNumber) - 1
+        if index < 0:
+            return None
+        offset = uploadLineNumber - self.chunkStarts[index]
+        sourceLineNumbers = self.chunkSourceLineNumbers[index]
+        return sourceLineNumbers[offset] if offset < len(sourceLineNumbers) else None
+
+def CreateUpload(ipsClient, ipsClientFactory, serviceSessionKey, fileType, uploadName, delimiter, textQualifier):
+    ipsUploadCreateResponse = ipsClient.service.IPSUploadCreate1(ipsClientFactory.IPSUploadCreate1Input(Header=ipsClientFactory.IPSUploadCreate1InputHeader(ServiceSessionKey=serviceSessionKey), Parameters=ipsClientFactory.IPSUploadCreate1InputParameters(FileType=fileType, UploadName=uploadName, Delimiter=delimiter, TextQualifier=textQualifier)))
+    return ipsUploadCreateResponse.Result.DataRows.DataRow[0].UploadID
+
+def SendUploadChunk(ipsClient, ipsClientFactory, serviceSessionKey, uploadId, chunk, uploadComplete):
+    # Send one chunk and return the TotalRows of the upload once it has been added
+    ipsUploadDataSetInputParameters = ipsClientFactory.IPSUploadDataSet1InputParameters(UploadID=uploadId, UploadTextArray={"UploadText": [text for sourceLineNumber, text in chunk]}, UploadComplete=uploadComplete)
+    ipsUploadDataSetResponse = ipsClient.service.IPSUploadDataSet1(ipsClientFactory.IPSUploadDataSet1Input(Header=ipsClientFactory.IPSUploadDataSet1InputHeader(ServiceSessionKey=serviceSessionKey), Parameters=ipsUploadDataSetInputParameters))
+    return ipsUploadDataSetResponse.Result.DataRows.DataRow[0].TotalRows
+
+def SendUploadFile(ipsClient, ipsClientFactory, sessionManager, uploadId, uploadLines, chunkLines, chunkBytes, parallelism):
+    # Send every line of the upload and return the UploadLineMap for it. Raises if any chunk fails, in which case the
+    # upload is left incomplete.
+    lineMap = UploadLineMap()
+    workerState = threading.local()
+    chunkSlots = threading.BoundedSemaphore(parallelism) # Stop reading the file when the requests fall behind
+    failures = []
+
+    def InitialiseWorker():
+        # Each worker gets its own HTTP session, sharing the parsed WSDL and credentials of the main client
+        workerSession = Session()
+        workerSession.auth = ipsClient.transport.session.auth
+        sessionManager.installRestartHook(workerSession)
+        workerState.client = Client(ipsClient.wsdl, settings=ipsClient.settings, transport=Transport(session=workerSession))
+        workerState.client.set_ns_prefix("ns0", "http://webservices.iress.com.au/v4/")
+
+    def SendChunk(chunk, uploadComplete, client=None):
+        totalRows = SendUploadChunk(client or workerState.client, ipsClientFactory, sessionManager.getServiceSessionKey(), uploadId, chunk, uploadComplete)
+        lineMap.addChunk(totalRows, chunk)
+        logging.debug("Sent source lines {} to {}, upload now has {} lines".format(chunk[0][0], chunk[-1][0], totalRows))
+
+    def SendQueuedChunk(chunk):
+        try:
+            if not failures:
+                SendChunk(chunk, False)
+        except Exception as ex:
+            failures.append("Sending source lines {} to {} failed. Error: {}".format(chunk[0][0], chunk[-1][0], str(ex)))
+        except:
+            failures.append("Sending source lines {} to {} failed. Error: Unspecified".format(chunk[0][0], chunk[-1][0]))
+        finally:
+            chunkSlots.release()
+
+    chunks = ChunkUploadLines(uploadLines, chunkLines, chunkBytes)
+    firstChunk = next(chunks, [])
+    lastChunk = next(chunks, None)
+    if lastChunk is None:
+        SendChunk(firstChunk, True, ipsClient)
+        return lineMap
+
+    SendChunk(firstChunk, False, ipsClient)
+    with ThreadPoolExecutor(max_workers=parallelism, initializer=InitialiseWorker) as executor:
+        # Always hold back the most recent chunk, as it may turn out to be the last one
+        for chunk in chunks:
+            chunkSlots.acquire()
+            if failures:
+                break
+            executor.submit(SendQueuedChunk, lastChunk)
+            lastChunk = chunk
+
+    if failures:
+        raise Exception(failures[0])
+    SendChunk(lastChunk, True, ipsClient)
+    return lineMap
+
+def RunUpload(ipsClient, ipsClientFactory, serviceSessionKey, uploadId):
+    ipsClient.service.IPSUploadRun1(ipsClientFactory.IPSUploadRun1Input(Header=ipsClientFactory.IPSUploadRun1InputHeader(ServiceSessionKey=serviceSessionKey), Parameters=ipsClientFactory.IPSUploadRun1InputParameters(UploadID=uploadId, UploadAction="Start")))
+
+def GetUploadSummary(ipsClient, ipsClientFactory, serviceSessionKey, uploadId, uploadDateTime):
+    ipsUploadSummaryGetResponse = ipsClient.service.IPSUploadSummaryGet2(ipsClientFactory.IPSUploadSummaryGet2Input(Header=ipsClientFactory.IPSUploadSummaryGet2InputHeader(ServiceSessionKey=serviceSessionKey), Parameters=ipsClientFactory.IPSUploadSummaryGet2InputParameters(UploadDateTime=uploadDateTime, UploadID=uploadId)))
+    if not ipsUploadSummaryGetResponse.Result.DataRows:
+        return None
+    return ipsUploadSummaryGetResponse.Result.DataRows.DataRow[0]
+
+def WaitForUploadRun(ipsClient, ipsClientFactory, sessionManager, uploadId, uploadDateTime, runTimeout):
+    # Poll the upload summary, backing off between polls, until the run has finished. Returns the last summary.
+    pollDelay = 1
+    timeoutTime = time.time() + runTimeout
+    while True:
+        uploadSummary = GetUploadSummary(ipsClient, ipsClientFactory, sessionManager.getServiceSessionKey(), uploadId, uploadDateTime)
+        if uploadSummary is not None and uploadSummary.RunCount and uploadSummary.LastRunUploadRunID and str(uploadSummary.UploadStatus).lower() in FINISHED_UPLOAD_STATUSES:
+            return uploadSummary
+        if time.time() + pollDelay > timeoutTime:
+            raise Exception("Upload {} did not finish running within {} seconds".format(uploadId, runTimeout))
+        logging.info("Upload {} status: {}".format(uploadId, uploadSummary.UploadStatus if uploadSummary is not None else "Unknown"))
+        time.sleep(pollDelay)
+        pollDelay = min(pollDelay * 2, MAXIMUM_POLL_DELAY)
+
+def GetUploadErrors(ipsClient, ipsClientFactory, serviceSessionKey, uploadRunId, lineMap, pageSize=pager.DEFAULT_PAGE_SIZE):
+    # Yield (source line number, error row) for each error of the run, as the pages arrive. The source line number is
+    # None when the error is not for a line of the upload.
+    ipsUploadErrorGetInputParameters = ipsClientFactory.IPSUploadErrorGet1InputParameters(UploadRunID=uploadRunId)
+    for errorRow in pager.GetDataRows(lambda pagingHeader: ipsClient.service.IPSUploadErrorGet1(ipsClientFactory.IPSUploadErrorGet1Input(Header=ipsClientFactory.IPSUploadErrorGet1InputHeader(ServiceSessionKey=serviceSessionKey, **pagingHeader), Parameters=ipsUploadErrorGetInputParameters)), pageSize):
+        uploadLineNumber = getattr(errorRow, ERROR_LINE_NUMBER_FIELD, None)
+        yield (lineMap.getSourceLineNumber(uploadLineNumber) if uploadLineNumber else None), errorRow
+
+def FormatErrorRow(errorRow):
+    return ", ".join("{}: {}".format(fieldName, errorRow[fieldName]) for fieldName in errorRow if fieldName != ERROR_LINE_NUMBER_FIELD)
+
+# Use click library to process command line arguments - this way we can support the provision of a password and where not passed by user it will prompt them
+@click.command()
+@click.option('--username', '-u', prompt="IRESS User Name", help='The IRESS username to login to Web Services using.')
+@click.option('--companyname', '-c', prompt="Company Name", help='The company name to login to Web Services using.')
+@click.option('--password', '-p', prompt=True, confirmation_prompt=False, hide_input=True)
+@click.option('--ipsname', '-i', prompt="IPS Server Name", help='The IPS server name to connect to.')
+@click.option('--endpoint', '-e', prompt="Web Services WSDL Endpoint", help='The Web Services WSDL endpoint to connect to.', default="https://webservices.iress.com.au/v4/wsdl.aspx")
+@click.option('--file', '-f', 'uploadfile', prompt="Upload file", help='The file to upload, in the IPS upload format for the file type.')
+@click.option('--filetype', '-t', prompt="File type", help='The IPS upload file type.', default="Security List")
+@click.option('--uploadname', '-n', help='The name of the upload. Defaults to the file name.', default=None)
+@click.option('--delimiter', '-d', help='The field delimiter used in the file.', default=",")
+@click.option('--textqualifier', '-q', help='The text qualifier used in the file, if any.', default=None)
+@click.option('--chunklines', help='The maximum number of lines to send in each IPSUploadDataSet1 call.', default=1000)
+@click.option('--chunkbytes', help='The maximum number of bytes of text to send in each IPSUploadDataSet1 call.', default=1000000)
+@click.option('--parallelism', help='The maximum number of IPSUploadDataSet1 calls to run concurrently.', default=4)
+@click.option('--runtimeout', help='The number of seconds to wait for the upload run to finish.', default=3600)
+@click.option('--pagesize', help='The number of errors to request in each page of IPSUploadErrorGet1 results.', default=pager.DEFAULT_PAGE_SIZE)
+@click.option('--wsdlcache', help='The directory to cache WSDLs in between runs.', default=wsdlCache.DEFAULT_CACHE_DIRECTORY)
+@click.option('--wsdlcachettl', help='The number of seconds a cached WSDL is used for before it is fetched again.', default=wsdlCache.DEFAULT_TTL)
+@click.option('--offline', is_flag=True, help='Only use WSDLs already in the WSDL cache directory, never fetch them from the endpoint.')
+@click.option('--sessionstore', help='The file that IRESS and IPS session keys are shared between runs through.', default=DEFAULT_STORE_PATH)
+@click.option('--sessionlifetime', help='The number of seconds the server keeps a session for. Sessions are renewed shortly before then, and sessions the server ends sooner are restarted when it rejects them.', default=DEFAULT_SESSION_LIFETIME)
+@click.option('--newsession', is_flag=True, help='Start new sessions rather than reusing the ones in the session store.')
+def main(username, companyname, password, ipsname, endpoint, uploadfile, filetype, uploadname, delimiter, textqualifier, chunklines, chunkbytes, parallelism, runtimeout, pagesize, wsdlcache, wsdlcachettl, offline, sessionstore, sessionlifetime, newsession):
+    # Work out where to store the logs - use the current hostname and date/time in the filename
+    logOutputFileName = 'ipsupload_{}_{}.log'.format(socket.gethostname(), time.strftime("%Y%m%d-%H%M%S"))
+    logFileFullPath = os.path.join(os.path.dirname(os.path.realpath(__file__)), logOutputFileName)
+
+    # Setup logger
+    loggingDateTimeFormat = '%Y-%m-%d %H:%M:%S'
+    logging.basicConfig(filename=logFileFullPath,level=logging.DEBUG,format='%(asctime)s.%(msecs)03d %(message)s', datefmt=loggingDateTimeFormat)
+    consoleHandler = logging.StreamHandler()
+    consoleHandler.setLevel(logging.INFO)
+    consoleHandler.setFormatter(logging.Formatter('%(asctime)s.%(msecs)03d %(message)s', datefmt=loggingDateTimeFormat))
+    logging.getLogger('').addHandler(consoleHandler)
+
+    if chunklines < 1 or chunkbytes < 1 or parallelism < 1 or pagesize < 1:
+        logging.error("Chunk lines, chunk bytes, parallelism and page size must be greater than 0.")
+        return
+
+    ipsMethodList = "IPSUploadCreate1,IPSUploadDataSet1,IPSUploadRun1,IPSUploadSummaryGet2,IPSUploadErrorGet1"
+    try:
+        ipsSession = Session()
+        ipsSession.auth = HTTPBasicAuth(username + "@" + companyname, password)
+        ipsWsdlLocation = wsdlCache.GetWsdl(ipsSession, endpoint, "IPS", ipsname, ipsMethodList, cacheDirectory=wsdlcache, ttl=wsdlcachettl, offline=offline)
+        ipsClient = Client(ipsWsdlLocation, settings=Settings(strict = False, xml_huge_tree = True), transport=Transport(session=ipsSession))
+        ipsClient.set_ns_prefix("ns0", "http://webservices.iress.com.au/v4/")
+        ipsClientFactory = ipsClient.type_factory('http://webservices.iress.com.au/v4/')
+    except Exception as ex:
+        logging.error("Accessing Web Services WSDL failed. Error: {}".format(str(ex)))
+        return
+    except:
+        logging.error("Accessing Web Services WSDL failed. Error: Unspecified")
+        return
+
+    try:
+        sessionManager = SessionManager(ipsClient, ipsClientFactory, endpoint, username, companyname, password, service="IPS", server=ipsname, storePath=sessionstore, sessionLifetime=sessionlifetime)
+        if newsession:
+            sessionManager.invalidate()
+        sessionManager.getSessionKeys()
+        sessionManager.startRenewal()
+    except Exception as ex:
+        logging.error("Web Services session creation failed. Error: {}".format(str(ex)))
+        return
+    except:
+        logging.error("Web Services session creation failed. Error: Unspecified")
+        return
+
+    startTime = time.time()
+    try:
+        uploadDateTime = datetime.now().astimezone()
+        uploadId = CreateUpload(ipsClient, ipsClientFactory, sessionManager.getServiceSessionKey(), filetype, uploadname or os.path.basename(uploadfile), delimiter, textqualifier)
+        logging.info("Created upload {} for {}".format(uploadId, uploadfile))
+
+        with open(uploadfile, "r", encoding="utf-8-sig", newline="") as uploadFile:
+            lineMap = SendUploadFile(ipsClient, ipsClientFactory, sessionManager, uploadId, ReadUploadLines(uploadFile, textqualifier), chunklines, chunkbytes, parallelism)
+        logging.info("Sent {} lines to upload {} in {:.2f}s".format(lineMap.lineCount, uploadId, time.time() - startTime))
+
+        RunUpload(ipsClient, ipsClientFactory, sessionManager.getServiceSessionKey(), uploadId)
+        uploadSummary = WaitForUploadRun(ipsClient, ipsClientFactory, sessionManager, uploadId, uploadDateTime, runtimeout)
+        logging.info("Upload {} run {} finished with status {}. Lines: {} Errors: {}".format(uploadId, uploadSummary.LastRunUploadRunID, uploadSummary.UploadStatus, uploadSummary.LastRunLineCount, uploadSummary.LastRunErrorCount))
+
+        if uploadSummary.LastRunErrorCount:
+            for sourceLineNumber, errorRow in GetUploadErrors(ipsClient, ipsClientFactory, sessionManager.getServiceSessionKey(), uploadSummary.LastRunUploadRunID, lineMap, pagesize):
+                if sourceLineNumber is None:
+                    logging.error("Upload error: {}".format(FormatErrorRow(errorRow)))
+                else:
+                    logging.error("Upload error on line {}: {}".format(sourceLineNumber, FormatErrorRow(errorRow)))
+    except Exception as ex:
+        logging.error("Upload of {} failed. Error: {}".format(uploadfile, str(ex)))
+    except:
+        logging.error("Upload of {} failed. Error: Unspecified".format(uploadfile))
+    finally:
+        sessionManager.close()
+
+    logging.info("Finished in {:.2f}s".format(time.time() - startTime))
+
+def runMain():
+    main()
+
+if __name__ == "__main__":
+    runMain()
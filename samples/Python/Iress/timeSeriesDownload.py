@@ -0,0 +1,202 @@
+from requests import Session
+from requests.auth import HTTPBasicAuth
+from zeep.transports import Transport
+from zeep import Client, Settings
+from datetime import date, timedelta
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import logging
+import os
+import socket
+import threading
+import time
+import sys
+import click
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), "..", "Common"))
+import wsdlCache
+import pager
+import rawResponse
+from timeSeriesStore import TimeSeriesStore, SplitRange, DecodeTimeSeries, DEFAULT_STORE_DIRECTORY
+from sessionManager import SessionManager, DEFAULT_STORE_PATH, DEFAULT_SESSION_LIFETIME
+from requestScheduler import RequestScheduler, InstallTransientStatusHook, DEFAULT_MAX_ATTEMPTS
+
+# Downloads TimeSeriesGet2 history for a list of securities into the local store in Common/timeSeriesStore.py. The
+# date range of each security is checked against the ranges already in the store, and only the missing ranges are
+# requested. These are split into requests of at most --chunkdays days, which run --parallelism at a time across all
+# of the securities. Each response is decoded straight into NumPy columns, without building zeep objects for the rows,
+# and added to the store as soon as it arrives, so an interrupted download resumes where it left off. Each page goes
+# through a RequestScheduler, which limits the rate of calls and retries the ones that fail transiently. Once the
+# requests have finished, the chunks each security's responses were added as are compacted into its series file.
+#
+# The current day is still trading, so it is never recorded as fetched, and is requested again by the next run.
+
+IRESS_SCHEDULER_KEY = ("IRESS", "")
+
+def ParseSecurities(securities, defaultExchange):
+    # Parse comma separated "SecurityCode.Exchange" entries, using defaultExchange for entries without one
+    parsedSecurities = []
+    for security in securities.split(","):
+        security = security.strip()
+        if security:
+            securityCode, separator, exchange = security.rpartition(".") if "." in security else (security, "", defaultExchange)
+            parsedSecurities.append((securityCode, exchange))
+    return parsedSecurities
+
+def RequestTimeSeries(iressClient, iressClientFactory, scheduler, iressSessionKey, securityCode, exchange, frequency, fromDate, toDate, pageSize):
+    # Return the rows for the inclusive date range as one array, paging through them with the same RequestID
+    timeSeriesGetInputParameters = iressClientFactory.TimeSeriesGet2InputParameters(SecurityCode=securityCode, Exchange=exchange, Frequency=frequency, TimeSeriesFromDate=fromDate.isoformat(), TimeSeriesToDate=toDate.isoformat())
+    return np.concatenate(list(pager.GetRawPages(lambda pagingHeader: scheduler.call(IRESS_SCHEDULER_KEY, "TimeSeriesGet2", rawResponse.CallRaw, iressClient, "TimeSeriesGet2", iressClientFactory.TimeSeriesGet2Input(Header=iressClientFactory.TimeSeriesGet2InputHeader(SessionKey=iressSessionKey, **pagingHeader), Parameters=timeSeriesGetInputParameters)), DecodeTimeSeries, pageSize, prefetch=False)))
+
+def DownloadTimeSeries(iressClient, iressClientFactory, scheduler, sessionManager, store, securities, frequency, fromDate, toDate, chunkDays, parallelism, pageSize):
+    # Fetch the ranges of each security that are missing from the store. Returns the number of requests that failed.
+    lastCompleteDate = min(toDate, date.today() - timedelta(days=1))
+    timeSeriesRequests = []
+    for securityCode, exchange in securities:
+        missingRanges = store.getMissingRanges(securityCode, exchange, frequency, fromDate, lastCompleteDate)
+        if toDate > lastCompleteDate:
+            missingRanges.append((max(fromDate, lastCompleteDate + timedelta(days=1)), toDate))
+        if not missingRanges:
+            logging.info("{}.{} is already stored from {} to {}".format(securityCode, exchange, fromDate, toDate))
+        for missingFromDate, missingToDate in missingRanges:
+            timeSeriesRequests.extend((securityCode, exchange, chunkFromDate, chunkToDate) for chunkFromDate, chunkToDate in SplitRange(missingFromDate, missingToDate, chunkDays))
+
+    logging.info("Requesting {} date ranges for {} securities".format(len(timeSeriesRequests), len(securities)))
+    workerState = threading.local()
+
+    def InitialiseWorker():
+        # Each worker gets its own HTTP session, sharing the parsed WSDL and credentials of the main client
+        workerSession = Session()
+        workerSession.auth = iressClient.transport.session.auth
+        InstallTransientStatusHook(workerSession)
+        sessionManager.installRestartHook(workerSession)
+        workerState.client = Client(iressClient.wsdl, settings=iressClient.settings, transport=Transport(session=workerSession))
+        workerState.client.set_ns_prefix("ns0", "http://webservices.iress.com.au/v4/")
+
+    def Request(securityCode, exchange, chunkFromDate, chunkToDate):
+        return RequestTimeSeries(workerState.client, iressClientFactory, scheduler, sessionManager.getIressSessionKey(), securityCode, exchange, frequency, chunkFromDate, chunkToDate, pageSize)
+
+    failedCount = 0
+    with ThreadPoolExecutor(max_workers=parallelism, initializer=InitialiseWorker) as executor:
+        futures = { executor.submit(Request, *request): request for request in timeSeriesRequests }
+        for future in as_completed(futures):
+            securityCode, exchange, chunkFromDate, chunkToDate = futures[future]
+            try:
+                rows = future.result()
+            except Exception as ex:
+                logging.error("TimeSeriesGet2 for {}.{} from {} to {} failed. Error: {}".format(securityCode, exchange, chunkFromDate, chunkToDate, str(ex)))
+                failedCount = failedCount + 1
+                continue
+            except:
+                logging.error("TimeSeriesGet2 for {}.{} from {} to {} failed. Error: Unspecified".format(securityCode, exchange, chunkFromDate, chunkToDate))
+                failedCount = failedCount + 1
+                continue
+
+            # Rows for the current day are kept, but the day is left uncovered so it is fetched again
+            store.add(securityCode, exchange, frequency, rows, chunkFromDate, min(chunkToDate, lastCompleteDate))
+            logging.info("Stored {} rows for {}.{} from {} to {}".format(len(rows), securityCode, exchange, chunkFromDate, chunkToDate))
+
+    for securityCode, exchange in securities:
+        store.compact(securityCode, exchange, frequency)
+    return failedCount
+
+# Use click library to process command line arguments - this way we can support the provision of a password and where not passed by user it will prompt them
+@click.command()
+@click.option('--username', '-u', prompt="IRESS User Name", help='The IRESS username to login to Web Services using.')
+@click.option('--companyname', '-c', prompt="Company Name", help='The company name to login to Web Services using.')
+@click.option('--password', '-p', prompt=True, confirmation_prompt=False, hide_input=True)
+@click.option('--endpoint', '-e', prompt="Web Services WSDL Endpoint", help='The Web Services WSDL endpoint to connect to.', default="https://webservices.iress.com.au/v4/wsdl.aspx")
+@click.option('--securities', '-s', prompt="Securities", help='Comma separated securities to download, as SecurityCode.Exchange or SecurityCode.', default="BHP.ASX")
+@click.option('--exchange', '-x', help='The exchange of securities given without one.', default="ASX")
+@click.option('--frequency', '-f', help='The TimeSeriesGet2 Frequency to download.', default="Daily")
+@click.option('--fromdate', help='The first date to download, as YYYY-MM-DD.', default=None)
+@click.option('--todate', help='The last date to download, as YYYY-MM-DD. Defaults to today.', default=None)
+@click.option('--chunkdays', help='The maximum number of days to request in each TimeSeriesGet2 call.', default=365)
+@click.option('--parallelism', help='The maximum number of TimeSeriesGet2 calls to run concurrently.', default=4)
+@click.option('--pagesize', help='The number of rows to request in each page of TimeSeriesGet2 results.', default=1000)
+@click.option('--ratelimit', help='The most TimeSeriesGet2 calls per second to make, or 0 for no limit.', default=0.0)
+@click.option('--maxattempts', help='The number of times to try a page that fails with a transient error, such as the server being busy.', default=DEFAULT_MAX_ATTEMPTS)
+@click.option('--store', help='The directory of the local time series store.', default=DEFAULT_STORE_DIRECTORY)
+@click.option('--wsdlcache', help='The directory to cache WSDLs in between runs.', default=wsdlCache.DEFAULT_CACHE_DIRECTORY)
+@click.option('--wsdlcachettl', help='The number of seconds a cached WSDL is used for before it is fetched again.', default=wsdlCache.DEFAULT_TTL)
+@click.option('--offline', is_flag=True, help='Only use WSDLs already in the WSDL cache directory, never fetch them from the endpoint.')
+@click.option('--sessionstore', help='The file that IRESS session keys are shared between runs through.', default=DEFAULT_STORE_PATH)
+@click.option('--sessionlifetime', help='The number of seconds the server keeps a session for. Sessions are renewed shortly before then, and sessions the server ends sooner are restarted when it rejects them.', default=DEFAULT_SESSION_LIFETIME)
+@click.option('--newsession', is_flag=True, help='Start a new session rather than reusing the one in the session store.')
+def main(username, companyname, password, endpoint, securities, exchange, frequency, fromdate, todate, chunkdays, parallelism, pagesize, ratelimit, maxattempts, store, wsdlcache, wsdlcachettl, offline, sessionstore, sessionlifetime, newsession):
+    # Work out where to store the logs - use the current hostname and date/time in the filename
+    logOutputFileName = 'timeseriesdownload_{}_{}.log'.format(socket.gethostname(), time.strftime("%Y%m%d-%H%M%S"))
+    logFileFullPath = os.path.join(os.path.dirname(os.path.realpath(__file__)), logOutputFileName)
+
+    # Setup logger
+    loggingDateTimeFormat = '%Y-%m-%d %H:%M:%S'
+    logging.basicConfig(filename=logFileFullPath,level=logging.DEBUG,format='%(asctime)s.%(msecs)03d %(message)s', datefmt=loggingDateTimeFormat)
+    consoleHandler = logging.StreamHandler()
+    consoleHandler.setLevel(logging.INFO)
+    consoleHandler.setFormatter(logging.Formatter('%(asctime)s.%(msecs)03d %(message)s', datefmt=loggingDateTimeFormat))
+    logging.getLogger('').addHandler(consoleHandler)
+
+    if chunkdays < 1 or parallelism < 1 or pagesize < 1:
+        logging.error("Chunk days, parallelism and page size must be greater than 0.")
+        return
+
+    try:
+        toDate = date.fromisoformat(todate) if todate else date.today()
+        fromDate = date.fromisoformat(fromdate) if fromdate else toDate - timedelta(days=365)
+    except ValueError as ex:
+        logging.error("Invalid date. Error: {}".format(str(ex)))
+        return
+    if fromDate > toDate:
+        logging.error("The from date must not be after the to date.")
+        return
+
+    iressMethodList = "TimeSeriesGet2"
+    try:
+        iressSession = Session()
+        iressSession.auth = HTTPBasicAuth(username + "@" + companyname, password)
+        InstallTransientStatusHook(iressSession)
+        iressWsdlLocation = wsdlCache.GetWsdl(iressSession, endpoint, "IRESS", "", iressMethodList, cacheDirectory=wsdlcache, ttl=wsdlcachettl, offline=offline)
+        iressClient = Client(iressWsdlLocation, settings=Settings(strict = False, xml_huge_tree = True), transport=Transport(session=iressSession))
+        iressClient.set_ns_prefix("ns0", "http://webservices.iress.com.au/v4/")
+        iressClientFactory = iressClient.type_factory('http://webservices.iress.com.au/v4/')
+    except Exception as ex:
+        logging.error("Accessing Web Services WSDL failed. Error: {}".format(str(ex)))
+        return
+    except:
+        logging.error("Accessing Web Services WSDL failed. Error: Unspecified")
+        return
+
+    try:
+        sessionManager = SessionManager(iressClient, iressClientFactory, endpoint, username, companyname, password, storePath=sessionstore, sessionLifetime=sessionlifetime)
+        if newsession:
+            sessionManager.invalidate()
+        sessionManager.getSessionKeys()
+        sessionManager.startRenewal()
+    except Exception as ex:
+        logging.error("Web Services session creation failed. Error: {}".format(str(ex)))
+        return
+    except:
+        logging.error("Web Services session creation failed. Error: Unspecified")
+        return
+
+    startTime = time.time()
+    scheduler = RequestScheduler(rate=ratelimit or None, maxConcurrency=parallelism, maxAttempts=maxattempts)
+    timeSeriesStore = TimeSeriesStore(store)
+    parsedSecurities = ParseSecurities(securities, exchange)
+    try:
+        failedCount = DownloadTimeSeries(iressClient, iressClientFactory, scheduler, sessionManager, timeSeriesStore, parsedSecurities, frequency, fromDate, toDate, chunkdays, parallelism, pagesize)
+    finally:
+        sessionManager.close()
+
+    logging.info(scheduler.formatSummary())
+    for securityCode, securityExchange in parsedSecurities:
+        rows = timeSeriesStore.read(securityCode, securityExchange, frequency)
+        if len(rows):
+            logging.info("{}.{} {}: {} rows stored from {} to {}".format(securityCode, securityExchange, frequency, len(rows), rows["TimeSeriesDate"][0], rows["TimeSeriesDate"][-1]))
+    logging.info("Finished in {:.2f}s with {} failed requests".format(time.time() - startTime, failedCount))
+
+def runMain():
+    main()
+
+if __name__ == "__main__":
+    runMain()
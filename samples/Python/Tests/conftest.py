@@ -0,0 +1,66 @@
+from requests import Session
+from requests.auth import HTTPBasicAuth
+from zeep.transports import Transport
+from zeep import Client, Settings
+import os
+import sys
+import pytest
+
+# The samples are scripts rather than a package, so their directories are put on the path the way the scripts put
+# Common on it. The tests run against Common/mockWebServices.py, started on a free port for each test that needs it.
+SAMPLES_DIRECTORY = os.path.join(os.path.dirname(os.path.realpath(__file__)), "..")
+for sampleDirectory in ["Common", "IOS+", "IPS", "Iress", "Cross-product"]:
+    sys.path.append(os.path.join(SAMPLES_DIRECTORY, sampleDirectory))
+
+import mockWebServices
+import wsdlCache
+from sessionManager import SessionManager
+
+IRESS_NAMESPACE = "http://webservices.iress.com.au/v4/"
+IOSPLUS_SERVER = "IOSPLUSAPIRETAIL3"
+USERNAME = "tester"
+COMPANYNAME = "tests"
+PASSWORD = "password"
+
+@pytest.fixture
+def startMockServer():
+    # Start a mock server with the given MockServer settings and return its WSDL endpoint. The servers are shut down
+    # once the test finishes.
+    servers = []
+
+    def StartMockServer(**settings):
+        server, endpoint = mockWebServices.StartMockServer(**settings)
+        servers.append(server)
+        return endpoint
+
+    yield StartMockServer
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+@pytest.fixture
+def buildClient():
+    # Build a zeep client and type factory for a service's methods on a mock server
+    def BuildClient(endpoint, service, server, methodList):
+        session = Session()
+        session.auth = HTTPBasicAuth(USERNAME + "@" + COMPANYNAME, PASSWORD)
+        client = Client(wsdlCache.BuildWsdlUrl(endpoint, service, server, methodList), settings=Settings(strict = False, xml_huge_tree = True), transport=Transport(session=session))
+        client.set_ns_prefix("ns0", IRESS_NAMESPACE)
+        return client, client.type_factory(IRESS_NAMESPACE)
+
+    return BuildClient
+
+@pytest.fixture
+def startSessions():
+    # Start sessions through a session manager that keeps them in memory, and close it once the test finishes
+    sessionManagers = []
+
+    def StartSessions(client, clientFactory, endpoint, service=None, server=None, **settings):
+        sessionManager = SessionManager(client, clientFactory, endpoint, USERNAME, COMPANYNAME, PASSWORD, service=service, server=server, storePath=None, **settings)
+        sessionManager.getSessionKeys()
+        sessionManagers.append(sessionManager)
+        return sessionManager
+
+    yield StartSessions
+    for sessionManager in sessionManagers:
+        sessionManager.close()
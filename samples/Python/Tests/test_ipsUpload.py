@@ -0,0 +1,59 @@
+import io
+
+import ipsUpload
+
+IPS_SERVER = "IPSTEST"
+IPS_METHOD_LIST = "IPSUploadCreate1,IPSUploadDataSet1,IPSUploadRun1,IPSUploadSummaryGet2,IPSUploadErrorGet1"
+
+def test_qualifiedRecordsContinueOntoTheNextLine():
+    uploadFile = io.StringIO('Code,Name\r\nBHP,"BHP\nGroup"\nCBA,Bank\n"Open\n')
+
+    assert list(ipsUpload.ReadUploadLines(uploadFile, '"')) == [(1, "Code,Name"), (2, 'BHP,"BHP\nGroup"'), (4, "CBA,Bank"), (5, '"Open')]
+    assert len(list(ipsUpload.ReadUploadLines(io.StringIO('BHP,"BHP\nGroup"\n')))) == 2
+
+def test_chunksAreLimitedByLinesAndBytes():
+    uploadLines = [(1, "aa"), (2, "bb"), (3, "cc"), (4, "d" * 10), (5, "ee")]
+
+    assert [[lineNumber for lineNumber, text in chunk] for chunk in ipsUpload.ChunkUploadLines(uploadLines, 2, 100)] == [[1, 2], [3, 4], [5]]
+    # A line larger than chunkBytes is sent in a chunk of its own
+    assert [[lineNumber for lineNumber, text in chunk] for chunk in ipsUpload.ChunkUploadLines(uploadLines, 10, 5)] == [[1, 2], [3], [4], [5]]
+    assert list(ipsUpload.ChunkUploadLines([], 10, 5)) == []
+
+def test_lineMapPlacesChunksAddedInAnyOrder():
+    lineMap = ipsUpload.UploadLineMap()
+    # Source lines 2 and 3 are one record, so the source and upload line numbers drift apart
+    lineMap.addChunk(2, [(1, "Header"), (2, "Record")])
+    lineMap.addChunk(5, [(6, "c"), (7, "d")])
+    lineMap.addChunk(3, [(4, "b")])
+
+    assert [lineMap.getSourceLineNumber(uploadLineNumber) for uploadLineNumber in range(0, 7)] == [None, 1, 2, 4, 6, 7, None]
+    assert lineMap.lineCount == 5
+
+def SendAndRunUpload(startMockServer, buildClient, startSessions, parallelism):
+    # Upload a file whose records after the header each span two source lines, and return its line map and errors
+    endpoint = startMockServer(ipsErrorEvery=7, ipsRunTime=0)
+    ipsClient, ipsClientFactory = buildClient(endpoint, "IPS", IPS_SERVER, IPS_METHOD_LIST)
+    sessionManager = startSessions(ipsClient, ipsClientFactory, endpoint, service="IPS", server=IPS_SERVER)
+    uploadFile = io.StringIO("Code,Name\n" + "".join('S{0},"Security\n{0}"\n'.format(index) for index in range(1, 51)))
+    uploadLines = ipsUpload.ReadUploadLines(uploadFile, '"')
+
+    uploadId = ipsUpload.CreateUpload(ipsClient, ipsClientFactory, sessionManager.getServiceSessionKey(), "Security List", "Test", ",", '"')
+    lineMap = ipsUpload.SendUploadFile(ipsClient, ipsClientFactory, sessionManager, uploadId, uploadLines, 3, 1000, parallelism)
+    ipsUpload.RunUpload(ipsClient, ipsClientFactory, sessionManager.getServiceSessionKey(), uploadId)
+    uploadSummary = ipsUpload.WaitForUploadRun(ipsClient, ipsClientFactory, sessionManager, uploadId, None, 10)
+    return lineMap, list(ipsUpload.GetUploadErrors(ipsClient, ipsClientFactory, sessionManager.getServiceSessionKey(), uploadSummary.LastRunUploadRunID, lineMap, pageSize=2))
+
+def test_errorsAreReportedAgainstSourceLines(startMockServer, buildClient, startSessions):
+    lineMap, errors = SendAndRunUpload(startMockServer, buildClient, startSessions, 1)
+
+    assert lineMap.lineCount == 51
+    # Upload line n is record n - 1, which starts on source line 2n - 2
+    assert [sourceLineNumber for sourceLineNumber, errorRow in errors] == [2 * uploadLineNumber - 2 for uploadLineNumber in range(7, 52, 7)]
+
+def test_chunksSentInParallelMapToEverySourceLineOnce(startMockServer, buildClient, startSessions):
+    # The server adds the chunks in the order they arrive, so only the first and last chunks have a fixed place
+    lineMap, errors = SendAndRunUpload(startMockServer, buildClient, startSessions, 4)
+
+    assert sorted(lineMap.getSourceLineNumber(uploadLineNumber) for uploadLineNumber in range(1, 52)) == [1] + list(range(2, 101, 2))
+    assert [lineMap.getSourceLineNumber(uploadLineNumber) for uploadLineNumber in [1, 2, 3, 49, 50, 51]] == [1, 2, 4, 96, 98, 100]
+    assert [sourceLineNumber for sourceLineNumber, errorRow in errors] == [lineMap.getSourceLineNumber(uploadLineNumber) for uploadLineNumber in range(7, 52, 7)]
@@ -0,0 +1,26 @@
+from orderCreate import BatchOrders
+from latencyStats import Percentile
+
+def test_ordersAreBatchedWithAShortFinalBatch():
+    assert list(BatchOrders(iter(range(7)), 3)) == [[0, 1, 2], [3, 4, 5], [6]]
+    assert list(BatchOrders(range(6), 3)) == [[0, 1, 2], [3, 4, 5]]
+    assert list(BatchOrders(range(2), 3)) == [[0, 1]]
+
+def test_noOrdersAreNoBatches():
+    assert list(BatchOrders([], 3)) == []
+
+def test_percentileIsTheNearestRank():
+    sortedValues = [float(value) for value in range(1, 101)]
+
+    assert Percentile(sortedValues, 50) == 50.0
+    assert Percentile(sortedValues, 95) == 95.0
+    assert Percentile(sortedValues, 99.5) == 100.0
+    assert Percentile([0.1, 0.2, 0.3], 50) == 0.2
+
+def test_percentileBounds():
+    sortedValues = [0.1, 0.2, 0.3, 0.4]
+
+    assert Percentile(sortedValues, 0) == 0.1
+    assert Percentile(sortedValues, 100) == 0.4
+    assert Percentile(sortedValues, 150) == 0.4
+    assert Percentile([], 99) == 0.0
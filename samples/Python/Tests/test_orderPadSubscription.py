@@ -0,0 +1,74 @@
+import asyncio
+
+from orderPadSubscription import OrderBook, Order, ORDER_FIELDS, ORDER_ADDED, ORDER_CHANGED, ORDER_REMOVED
+
+def MakeOrder(orderNumber, **fields):
+    order = dict.fromkeys(ORDER_FIELDS)
+    order.update(OrderNumber=orderNumber, AccountCode="ACC1", SecurityCode="BHP", Exchange="ASX", OrderState="Active", RemainingVolume=100.0)
+    order.update(fields)
+    return Order(**order)
+
+def RecordChanges(orderBook):
+    changes = []
+    orderBook.addCallback(lambda changeType, order, previousOrder: changes.append((changeType, order, previousOrder)))
+    return changes
+
+def test_updatesAddAndChangeOrders():
+    orderBook = OrderBook()
+    changes = RecordChanges(orderBook)
+    first = MakeOrder(1)
+    second = MakeOrder(2)
+
+    assert orderBook.applyOrders([first, second]) == 2
+    assert changes == [(ORDER_ADDED, first, None), (ORDER_ADDED, second, None)]
+
+    changes.clear()
+    filled = first._replace(RemainingVolume=0.0, OrderState="Complete")
+    # An update the same as the order held is not a change
+    assert orderBook.applyOrders([second, filled]) == 1
+    assert changes == [(ORDER_CHANGED, filled, first)]
+    assert orderBook.orders == { 1: filled, 2: second }
+
+def test_snapshotReplacesTheOrdersAndRemovesTheMissing():
+    orderBook = OrderBook()
+    first = MakeOrder(1)
+    second = MakeOrder(2)
+    third = MakeOrder(3)
+    orderBook.replaceOrders([first, second, third])
+    changes = RecordChanges(orderBook)
+    amended = second._replace(OrderPrice=1.5)
+    fourth = MakeOrder(4)
+
+    assert orderBook.replaceOrders(iter([amended, third, fourth])) == 3
+    assert changes == [(ORDER_CHANGED, amended, second), (ORDER_ADDED, fourth, None), (ORDER_REMOVED, None, first)]
+    assert orderBook.orders == { 2: amended, 3: third, 4: fourth }
+
+    changes.clear()
+    assert orderBook.replaceOrders([]) == 3
+    assert sorted(previousOrder.OrderNumber for changeType, order, previousOrder in changes if changeType == ORDER_REMOVED and order is None) == [2, 3, 4]
+    assert orderBook.orders == {}
+
+def test_coroutineCallbacksAreScheduledAndHeldUntilTheyFinish(caplog):
+    changes = []
+
+    async def RecordChange(changeType, order, previousOrder):
+        await asyncio.sleep(0)
+        changes.append((changeType, order.OrderNumber))
+
+    async def FailChange(changeType, order, previousOrder):
+        raise ValueError("Callback failed")
+
+    async def ApplyOrders():
+        orderBook = OrderBook()
+        orderBook.addCallback(RecordChange)
+        orderBook.addCallback(FailChange)
+        orderBook.applyOrders([MakeOrder(1)])
+        assert len(orderBook.callbackTasks) == 2 and changes == []
+        await asyncio.gather(*orderBook.callbackTasks, return_exceptions=True)
+        await asyncio.sleep(0)
+        return orderBook
+
+    orderBook = asyncio.run(ApplyOrders())
+    assert changes == [(ORDER_ADDED, 1)]
+    assert not orderBook.callbackTasks
+    assert "Order change callback failed. Error: Callback failed" in caplog.text
@@ -0,0 +1,81 @@
+from types import SimpleNamespace
+import pytest
+
+import pager
+import rawResponse
+from conftest import IOSPLUS_SERVER
+
+def BuildResult(statusCode, dataRows, pagingBookmark=None):
+    # A zeep-like Result for a page
+    return SimpleNamespace(Result=SimpleNamespace(Header=SimpleNamespace(StatusCode=statusCode, PagingBookmark=pagingBookmark), DataRows=SimpleNamespace(DataRow=dataRows) if dataRows else None))
+
+class FakeMethod:
+    # Answers the pages it was built with in turn, recording the paging header of each request
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.pagingHeaders = []
+
+    def __call__(self, pagingHeader):
+        self.pagingHeaders.append(pagingHeader)
+        response = self.responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+@pytest.mark.parametrize("prefetch", [True, False])
+def test_pagesAreRequestedWhileMoreDataIsAvailable(prefetch):
+    method = FakeMethod([BuildResult(1, [1, 2], "B1"), BuildResult(1, [], "B2"), BuildResult(0, [3])])
+
+    assert list(pager.GetDataRows(method, pageSize=2, prefetch=prefetch)) == [1, 2, 3]
+    assert [pagingHeader["PagingBookmark"] for pagingHeader in method.pagingHeaders] == [None, "B1", "B2"]
+    assert len({ pagingHeader["RequestID"] for pagingHeader in method.pagingHeaders }) == 1
+    assert all(pagingHeader["PageSize"] == 2 for pagingHeader in method.pagingHeaders)
+
+def test_pagingStopsAtAnyOtherStatusCode():
+    # StatusCode 2 is watching for updates, which has no more pages to request
+    method = FakeMethod([BuildResult(2, [1]), BuildResult(0, [2])])
+
+    assert list(pager.GetDataRows(method, prefetch=False)) == [1]
+    assert len(method.pagingHeaders) == 1
+
+def test_prefetchRaisesPageErrorAtThatPage():
+    method = FakeMethod([BuildResult(1, [1]), ValueError("Page failed")])
+    dataRows = pager.GetDataRows(method)
+
+    assert next(dataRows) == 1
+    with pytest.raises(ValueError, match="Page failed"):
+        next(dataRows)
+
+def test_abandonedPrefetchStopsRequestingPages():
+    method = FakeMethod([BuildResult(1, [index]) for index in range(10)])
+    dataRows = pager.GetDataRows(method)
+
+    assert next(dataRows) == 0
+    dataRows.close()
+    # At most the page after the one taken has been requested
+    assert len(method.pagingHeaders) <= 2
+
+def RequestOrderPadPage(client, clientFactory, serviceSessionKey, pagingHeader):
+    return rawResponse.CallRaw(client, "OrderPadGetByAccount", clientFactory.OrderPadGetByAccountInput(Header=clientFactory.OrderPadGetByAccountInputHeader(ServiceSessionKey=serviceSessionKey, **pagingHeader), Parameters=clientFactory.OrderPadGetByAccountInputParameters(AccountCodeArray={ "AccountCode": ["A001", "A002"] }, OrderFilter=1)))
+
+@pytest.mark.parametrize("prefetch", [True, False])
+def test_rawPagesAreRequestedUnderOneRequestId(startMockServer, buildClient, startSessions, prefetch):
+    endpoint = startMockServer()
+    client, clientFactory = buildClient(endpoint, "IOSPlus", IOSPLUS_SERVER, "OrderPadGetByAccount")
+    serviceSessionKey = startSessions(client, clientFactory, endpoint, service="IOSPLUS", server=IOSPLUS_SERVER).getSessionKeys()[1]
+    resultHeaders = []
+
+    def DecodePage(content, resultHeader):
+        orderNumbers = [values[0] for values in rawResponse.DecodeDataRowValues(content, ["OrderNumber"], resultHeader=resultHeader)]
+        resultHeaders.append(resultHeader)
+        return orderNumbers
+
+    wholeResult = DecodePage(RequestOrderPadPage(client, clientFactory, serviceSessionKey, { "PageSize": 1000 }), {})
+    resultHeaders.clear()
+    pages = list(pager.GetRawPages(lambda pagingHeader: RequestOrderPadPage(client, clientFactory, serviceSessionKey, pagingHeader), DecodePage, pageSize=3, prefetch=prefetch, requestId="TEST-REQUEST"))
+
+    assert len(wholeResult) > 3
+    assert [orderNumber for page in pages for orderNumber in page] == wholeResult
+    assert all(len(page) <= 3 for page in pages)
+    assert { resultHeader["RequestID"] for resultHeader in resultHeaders } == { "TEST-REQUEST" }
+    assert [resultHeader["StatusCode"] == pager.STATUS_MORE_DATA_AVAILABLE for resultHeader in resultHeaders] == [True] * (len(pages) - 1) + [False]
@@ -0,0 +1,78 @@
+from datetime import date, timedelta
+import glob
+import json
+import os
+import threading
+import pyarrow.parquet as pq
+import pytest
+
+from historyExtract import ExtractHistory, GetExtractFileName
+from parquetExtract import ExtractCheckpoint
+from requestScheduler import RequestScheduler
+from conftest import IOSPLUS_SERVER
+
+METHODS = ["TradeGetByUser", "AuditTrailGetByUser"]
+ROW_COUNT = 25
+PAGE_SIZE = 10
+
+class InterruptingScheduler(RequestScheduler):
+    # Fails the interruptedPage'th page call of an operation once, as if the run had been interrupted part way through
+    # that result set, and counts the page calls of each operation
+    def __init__(self, interruptedOperation=None, interruptedPage=0):
+        super().__init__(maxAttempts=1)
+        self.interruptedOperation = interruptedOperation
+        self.interruptedPage = interruptedPage
+        self.pageCalls = {}
+        self.pageCallsLock = threading.Lock()
+
+    def call(self, key, operationName, function, *args, **kwargs):
+        with self.pageCallsLock:
+            self.pageCalls[operationName] = self.pageCalls.get(operationName, 0) + 1
+            interrupted = operationName == self.interruptedOperation and self.pageCalls[operationName] == self.interruptedPage
+        if interrupted:
+            raise RuntimeError("Extract interrupted")
+        return super().call(key, operationName, function, *args, **kwargs)
+
+@pytest.fixture
+def extractHistory(startMockServer, buildClient, startSessions, tmp_path):
+    # Run the history extract against a mock server into tmp_path, over the two days before today
+    endpoint = startMockServer(rowCount=ROW_COUNT)
+    client, clientFactory = buildClient(endpoint, "IOSPLUS", IOSPLUS_SERVER, ",".join(METHODS))
+    sessionManager = startSessions(client, clientFactory, endpoint, service="IOSPLUS", server=IOSPLUS_SERVER)
+    fromDate = date.today() - timedelta(days=2)
+    toDate = date.today() - timedelta(days=1)
+
+    def ExtractHistoryRun(scheduler):
+        checkpoint = ExtractCheckpoint(str(tmp_path / "checkpoint.json"))
+        return ExtractHistory(client, clientFactory, scheduler, ("IOSPLUS", IOSPLUS_SERVER), sessionManager, checkpoint, str(tmp_path), METHODS, fromDate, toDate, 1, PAGE_SIZE, 1000)
+
+    return ExtractHistoryRun, [(methodName, extractDate) for extractDate in [fromDate, toDate] for methodName in METHODS]
+
+def test_interruptedExtractIsResumedWithoutDuplicates(extractHistory, tmp_path):
+    ExtractHistoryRun, extracts = extractHistory
+    interruptedMethod, interruptedDate = extracts[1]
+
+    # The second page of the first day's audit trail fails, after its first page has been written
+    assert ExtractHistoryRun(InterruptingScheduler("AuditTrailGetByUser", 2)) == 1
+    with open(str(tmp_path / "checkpoint.json")) as checkpointFile:
+        completed = json.load(checkpointFile)["Completed"]
+    assert sorted(completed) == sorted("{}/{}".format(methodName, extractDate.isoformat()) for methodName, extractDate in extracts if (methodName, extractDate) != (interruptedMethod, interruptedDate))
+    assert all(entry["Rows"] == ROW_COUNT for entry in completed.values())
+    assert not os.path.exists(GetExtractFileName(str(tmp_path), interruptedMethod, interruptedDate))
+    assert not glob.glob(str(tmp_path / "**" / "*.tmp"), recursive=True)
+
+    # The resumed run only extracts the interrupted file, from the start of its result set
+    resumingScheduler = InterruptingScheduler()
+    assert ExtractHistoryRun(resumingScheduler) == 0
+    assert resumingScheduler.pageCalls == { interruptedMethod: 3 }
+
+    for methodName, extractDate in extracts:
+        table = pq.read_table(GetExtractFileName(str(tmp_path), methodName, extractDate))
+        assert table.num_rows == ROW_COUNT
+        # The first column is the row's key, TradeNumber or AuditTrailNumber, so a page written twice would repeat keys
+        assert table.schema.names[0] == methodName.replace("GetByUser", "Number")
+        assert len(set(table.column(0).to_pylist())) == ROW_COUNT
+
+    rerunScheduler = InterruptingScheduler()
+    assert ExtractHistoryRun(rerunScheduler) == 0
+    assert rerunScheduler.pageCalls == {}
@@ -0,0 +1,109 @@
+from decimal import Decimal
+from types import SimpleNamespace
+import queue
+import threading
+
+import portfolioAlerter
+from portfolioAlerter import AlertKey, ParseToolAlert
+from requestScheduler import RequestScheduler
+from conftest import IOSPLUS_SERVER
+
+def BuildAlertRow(alertId, fieldNames, fieldOperators, fieldValues, alertMemo):
+    # A zeep-like AlertGet DataRow
+    return SimpleNamespace(AlertID=alertId, AlertFieldNames=fieldNames, AlertFieldOperators=fieldOperators, AlertFieldValues=fieldValues, AlertMemo=alertMemo)
+
+def test_toolAlertsAreParsed():
+    existingAlert = ParseToolAlert(BuildAlertRow(7, "Security;Last", "==;>=", "BHP.ASX;41.235", "PortfolioCode - P00001"))
+
+    assert existingAlert == portfolioAlerter.ExistingAlert(7, "BHP.ASX", "==", Decimal("41.235"), ">=", "PortfolioCode - P00001")
+    # The fields may be in any order
+    assert ParseToolAlert(BuildAlertRow(8, "Last;Security", ">=;==", "41.235;BHP.ASX", "PortfolioCode - P00001")).SecurityCode == "BHP.ASX"
+
+def test_otherAlertsAreIgnored():
+    assert ParseToolAlert(BuildAlertRow(1, "Security;Last", "==;<=", "BHP.ASX;10.000", "Created by hand")) is None
+    assert ParseToolAlert(BuildAlertRow(2, "Security;Last", "==;<=", "BHP.ASX;10.000", None)) is None
+    assert ParseToolAlert(BuildAlertRow(3, "Security;Bid", "==;<=", "BHP.ASX;10.000", "PortfolioCode - P00001")) is None
+
+def test_alertKeyMatchesTheAlertCreatedForAPosition():
+    # The alert is created with the price to three decimal places, and comes back from AlertGet as a Decimal
+    createdAlert = ParseToolAlert(BuildAlertRow(7, "Security;Last", "==;<=", "bhp.asx;{:.3f}".format(41.23456), "PortfolioCode - P00001"))
+    existingKey = AlertKey(createdAlert.SecurityCode, createdAlert.LastPriceOperator, createdAlert.LastPrice, createdAlert.AlertMemo)
+
+    assert AlertKey("BHP.ASX", "<=", 41.23456, "PortfolioCode - P00001") == existingKey
+    assert AlertKey("BHP.ASX", ">=", 41.23456, "PortfolioCode - P00001") != existingKey
+    assert AlertKey("BHP.ASX", "<=", 41.2356, "PortfolioCode - P00001") != existingKey
+    assert AlertKey("BHP.ASX", "<=", 41.23456, "PortfolioCode - P00002") != existingKey
+
+def test_existingAlertsAreIndexedAndDeleted(startMockServer, buildClient, startSessions):
+    endpoint = startMockServer(rowCount=25)
+    iressClient, iressClientFactory = buildClient(endpoint, "IRESS", "", "AlertGet,AlertDelete")
+    iressSessionKey = startSessions(iressClient, iressClientFactory, endpoint).getIressSessionKey()
+    scheduler = RequestScheduler()
+
+    existingAlerts = portfolioAlerter.GetExistingAlerts(iressClient, iressClientFactory, scheduler, iressSessionKey, pageSize=7)
+    alerts = [existingAlert for matchingAlerts in existingAlerts.values() for existingAlert in matchingAlerts]
+
+    assert len(alerts) == 25
+    assert all(AlertKey(alert.SecurityCode, alert.LastPriceOperator, alert.LastPrice, alert.AlertMemo) == key for key, matchingAlerts in existingAlerts.items() for alert in matchingAlerts)
+    assert portfolioAlerter.DeleteAlerts(iressClient, iressClientFactory, scheduler, iressSessionKey, alerts[:10]) == 10
+
+class FailingGroupSessionManager:
+    # Passes calls on to a session manager, except that the first portfolio group to ask for a service session key
+    # gets an error, as though the session could not be restarted
+    def __init__(self, sessionManager):
+        self.sessionManager = sessionManager
+        self.lock = threading.Lock()
+        self.failed = False
+
+    def installRestartHook(self, session):
+        self.sessionManager.installRestartHook(session)
+
+    def getServiceSessionKey(self):
+        with self.lock:
+            # The groups run on the executor's threads, PortfolioGet on the caller's and the pager's
+            if threading.current_thread().name.startswith("ThreadPoolExecutor") and not self.failed:
+                self.failed = True
+                raise Exception("Session restart failed")
+        return self.sessionManager.getServiceSessionKey()
+
+def RetrievePositions(startMockServer, buildClient, startSessions, failGroup):
+    # Retrieve the positions of the mock's portfolios in groups of 2, and return the retrieval summary
+    endpoint = startMockServer(rowCount=6)
+    iosPlusClient, iosPlusClientFactory = buildClient(endpoint, "IOSPlus", IOSPLUS_SERVER, "PortfolioGet,PortfolioPositionDetailGet")
+    sessionManager = startSessions(iosPlusClient, iosPlusClientFactory, endpoint, service="IOSPLUS", server=IOSPLUS_SERVER)
+    if failGroup:
+        sessionManager = FailingGroupSessionManager(sessionManager)
+    positionQueue = queue.Queue()
+    retrievalSummary = { "PortfolioCount": 0, "Failed": False, "GroupFailed": False }
+
+    portfolioAlerter.RetrievePortfolioPositions(iosPlusClient, iosPlusClientFactory, RequestScheduler(), ("IOSPLUS", IOSPLUS_SERVER), sessionManager, 2, 2, positionQueue, retrievalSummary)
+    pages = []
+    while True:
+        page = positionQueue.get_nowait()
+        if page is portfolioAlerter.END_OF_POSITIONS:
+            return retrievalSummary, pages
+        pages.append(page)
+
+def DeleteExistingAlerts(startMockServer, buildClient, startSessions, retrievalSummary):
+    endpoint = startMockServer(rowCount=5)
+    iressClient, iressClientFactory = buildClient(endpoint, "IRESS", "", "AlertGet,AlertDelete")
+    iressSessionKey = startSessions(iressClient, iressClientFactory, endpoint).getIressSessionKey()
+    scheduler = RequestScheduler()
+    existingAlerts = portfolioAlerter.GetExistingAlerts(iressClient, iressClientFactory, scheduler, iressSessionKey)
+    return portfolioAlerter.DeleteStaleAlerts(iressClient, iressClientFactory, scheduler, iressSessionKey, existingAlerts, retrievalSummary, False, 2)
+
+def test_staleAlertsAreDeletedOnceEveryGroupIsRetrieved(startMockServer, buildClient, startSessions):
+    retrievalSummary, pages = RetrievePositions(startMockServer, buildClient, startSessions, False)
+    staleAlerts, alertsDeletedCount = DeleteExistingAlerts(startMockServer, buildClient, startSessions, retrievalSummary)
+
+    assert retrievalSummary == { "PortfolioCount": 6, "Failed": False, "GroupFailed": False }
+    assert { dataRow.PortfolioCode for page in pages for dataRow in page } == { "P{:05d}".format(index) for index in range(6) }
+    assert len(staleAlerts) == 5 and alertsDeletedCount == 5
+
+def test_noAlertsAreDeletedWhenAGroupRaises(startMockServer, buildClient, startSessions):
+    retrievalSummary, pages = RetrievePositions(startMockServer, buildClient, startSessions, True)
+    staleAlerts, alertsDeletedCount = DeleteExistingAlerts(startMockServer, buildClient, startSessions, retrievalSummary)
+
+    assert retrievalSummary == { "PortfolioCount": 6, "Failed": False, "GroupFailed": True }
+    assert len({ dataRow.PortfolioCode for page in pages for dataRow in page }) == 4
+    assert len(staleAlerts) == 5 and alertsDeletedCount == 0
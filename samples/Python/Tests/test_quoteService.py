@@ -0,0 +1,90 @@
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+import pytest
+
+import quoteService
+from quoteService import QuoteCache, QuoteService
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    fakeClock = FakeClock()
+    monkeypatch.setattr(quoteService, "time", SimpleNamespace(monotonic=fakeClock.monotonic))
+    return fakeClock
+
+def test_quotesExpireAfterTtl(clock):
+    cache = QuoteCache(ttl=5)
+    cache.put("BHP.ASX", "BHP quote")
+    # A security that cannot be quoted is cached as None, which is found like any other quote
+    cache.put("XXX.ASX", None)
+
+    clock.now = clock.now + 4.9
+    assert cache.get("BHP.ASX") == (True, "BHP quote")
+    assert cache.get("XXX.ASX") == (True, None)
+    clock.now = clock.now + 0.1
+    assert cache.get("BHP.ASX") == (False, None)
+    assert "BHP.ASX" not in cache.entries
+
+def test_leastRecentlyUsedQuoteIsDropped(clock):
+    cache = QuoteCache(maxSize=2)
+    cache.put("BHP.ASX", 1)
+    cache.put("CBA.ASX", 2)
+    cache.get("BHP.ASX")
+    cache.put("NAB.ASX", 3)
+
+    assert cache.get("CBA.ASX") == (False, None)
+    assert cache.get("BHP.ASX") == (True, 1)
+    assert cache.get("NAB.ASX") == (True, 3)
+
+def test_refreshedQuoteGetsANewTtl(clock):
+    cache = QuoteCache(ttl=5)
+    cache.put("BHP.ASX", 1)
+    clock.now = clock.now + 4
+    cache.put("BHP.ASX", 2)
+    clock.now = clock.now + 4
+
+    assert cache.get("BHP.ASX") == (True, 2)
+
+@pytest.fixture
+def startQuoteService(startMockServer, buildClient, startSessions):
+    services = []
+
+    def StartQuoteService(latency=0.0, **settings):
+        endpoint = startMockServer(latency=latency)
+        client, clientFactory = buildClient(endpoint, "IRESS", "", "PricingQuoteGet")
+        service = QuoteService(client, clientFactory, startSessions(client, clientFactory, endpoint), **settings)
+        services.append(service)
+        return service
+
+    yield StartQuoteService
+    for service in services:
+        service.close()
+
+def test_keysAreDeduplicatedBatchedAndCached(startQuoteService):
+    service = startQuoteService(batchSize=2)
+
+    quotes = service.getQuotes(["bhp.asx", "BHP.ASX", "CBA.ASX", "NAB.ASX", "WBC.ASX", "ANZ.ASX"])
+    assert list(quotes) == ["bhp.asx", "BHP.ASX", "CBA.ASX", "NAB.ASX", "WBC.ASX", "ANZ.ASX"]
+    assert quotes["bhp.asx"] is quotes["BHP.ASX"]
+    assert [quote.SecurityCode for quote in quotes.values()] == ["BHP", "BHP", "CBA", "NAB", "WBC", "ANZ"]
+    assert service.statistics["Calls"] == 3
+
+    assert service.getQuote("CBA.ASX") is quotes["CBA.ASX"]
+    assert service.statistics["Calls"] == 3
+    assert service.statistics["CacheHits"] == 1
+
+def test_concurrentLookupsShareTheCallInFlight(startQuoteService):
+    service = startQuoteService(latency=0.3)
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        results = list(executor.map(lambda index: service.getQuote("BHP.ASX"), range(8)))
+
+    assert all(quote is results[0] for quote in results)
+    assert service.statistics["Calls"] == 1
+    assert service.statistics["Coalesced"] + service.statistics["CacheHits"] == 7
@@ -0,0 +1,76 @@
+from datetime import datetime
+from decimal import Decimal
+import pytest
+
+import rawResponse
+
+RESPONSE = b"""<?xml version="1.0" encoding="utf-8"?>
+<soap:Envelope xmlns:soap="http://schemas.xmlsoap.org/soap/envelope/" xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance">
+ <soap:Body>
+  <OrderPadGetByAccountResponse xmlns="http://webservices.iress.com.au/v4/">
+   <Output>
+    <Result>
+     <Header>
+      <RequestID>REQUEST-1</RequestID>
+      <StatusCode>1</StatusCode>
+      <PagingBookmark><OrderNumber>42</OrderNumber><Sequence xsi:nil="true"/></PagingBookmark>
+     </Header>
+     <DataRows>
+      <DataRow><OrderNumber>41</OrderNumber><Price>1.25</Price><Active>true</Active><UpdatedDateTime>2024-05-01T10:30:00</UpdatedDateTime><Destination>ASX</Destination></DataRow>
+      <DataRow><OrderNumber>42</OrderNumber><Price xsi:nil="true"/><Active>0</Active><Destination/></DataRow>
+     </DataRows>
+    </Result>
+   </Output>
+  </OrderPadGetByAccountResponse>
+ </soap:Body>
+</soap:Envelope>"""
+
+FAULT = b"""<?xml version="1.0" encoding="utf-8"?>
+<soap:Envelope xmlns:soap="http://schemas.xmlsoap.org/soap/envelope/">
+ <soap:Body><soap:Fault><faultcode>soap:Server</faultcode><faultstring>Invalid account code</faultstring></soap:Fault></soap:Body>
+</soap:Envelope>"""
+
+FIELDS = ["OrderNumber", "Price", "Active", "UpdatedDateTime", "Destination", "Missing"]
+COERCIONS = { "OrderNumber": int, "Price": Decimal, "Active": rawResponse.ParseBoolean, "UpdatedDateTime": rawResponse.ParseDateTime }
+
+def test_valuesAreCoercedAndNilOrMissingFieldsAreNone():
+    rows = list(rawResponse.DecodeDataRowValues(RESPONSE, FIELDS, COERCIONS))
+
+    assert rows == [
+        [41, Decimal("1.25"), True, datetime(2024, 5, 1, 10, 30), "ASX", None],
+        [42, None, False, None, "", None],
+    ]
+
+def test_resultHeaderIsFilledWithACopyOfThePagingBookmark():
+    resultHeader = {}
+    rows = list(rawResponse.DecodeDataRowValues(RESPONSE, ["OrderNumber"], resultHeader=resultHeader))
+
+    assert len(rows) == 2
+    assert resultHeader == { "RequestID": "REQUEST-1", "StatusCode": 1, "PagingBookmark": { "OrderNumber": "42", "Sequence": None } }
+
+def test_emptyPagingBookmarkIsEmpty():
+    resultHeader = {}
+    list(rawResponse.DecodeDataRowValues(RESPONSE.replace(b"<PagingBookmark><OrderNumber>42</OrderNumber><Sequence xsi:nil=\"true\"/></PagingBookmark>", b"<PagingBookmark/>"), ["OrderNumber"], resultHeader=resultHeader))
+
+    assert not resultHeader["PagingBookmark"]
+
+def test_rowsAndColumnsHoldOnlyTheirFields():
+    rowSchema = rawResponse.RowSchema("Order", ["OrderNumber", "Destination"])
+
+    assert list(rawResponse.DecodeRows(RESPONSE, rowSchema, { "OrderNumber": int })) == [rowSchema(41, "ASX"), rowSchema(42, "")]
+    assert rawResponse.DecodeColumns(RESPONSE, ["OrderNumber", "Active"], { "Active": rawResponse.ParseBoolean }) == { "OrderNumber": ["41", "42"], "Active": [True, False] }
+
+def test_faultIsRaised():
+    with pytest.raises(rawResponse.RawResponseError, match="Invalid account code"):
+        list(rawResponse.DecodeDataRowValues(FAULT, FIELDS))
+
+def test_truncatedResponseIsRaisedNotCutShort():
+    truncatedResponse = RESPONSE[:RESPONSE.index(b"<Destination/>")]
+    rows = rawResponse.DecodeDataRowValues(truncatedResponse, FIELDS, COERCIONS)
+
+    # The rows before the damage are still yielded as they are read, but the response as a whole fails
+    assert next(rows)[0] == 41
+    with pytest.raises(rawResponse.RawResponseError, match="could not be parsed"):
+        next(rows)
+    with pytest.raises(rawResponse.RawResponseError):
+        rawResponse.DecodeColumns(truncatedResponse, FIELDS)
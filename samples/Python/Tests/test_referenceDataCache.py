@@ -0,0 +1,76 @@
+import pytest
+
+from referenceDataCache import ReferenceDataCache
+from requestScheduler import RequestScheduler
+from securityKey import SecurityKey, ParseSecurityKey
+
+def test_securityKeysSplitAtTheLastDot():
+    assert ParseSecurityKey("BHP.1.ASX") == ("BHP.1", "ASX")
+    assert SecurityKey("bhp", "asx") == "BHP.ASX"
+    for key in ["BHP", ".ASX", "BHP."]:
+        with pytest.raises(ValueError):
+            ParseSecurityKey(key)
+
+@pytest.fixture
+def openReferenceDataCache(startMockServer, buildClient, startSessions):
+    # Open caches on one mock server, sharing a client and sessions, and close them once the test finishes
+    caches = []
+    connection = {}
+
+    def OpenReferenceDataCache(storePath, busyRate=0.0, **settings):
+        if not connection:
+            endpoint = startMockServer(busyRate=busyRate)
+            client, clientFactory = buildClient(endpoint, "IRESS", "", "SecurityInformationGet")
+            connection.update(client=client, clientFactory=clientFactory, sessionManager=startSessions(client, clientFactory, endpoint))
+        cache = ReferenceDataCache(connection["client"], connection["clientFactory"], connection["sessionManager"], storePath=storePath, **settings)
+        caches.append(cache)
+        return cache
+
+    yield OpenReferenceDataCache
+    for cache in caches:
+        cache.close()
+
+def test_securitiesAreStoredAndLookedUp(openReferenceDataCache):
+    scheduler = RequestScheduler()
+    cache = openReferenceDataCache(None, batchSize=2, scheduler=scheduler)
+
+    assert cache.populate(["bhp.asx", "BHP.ASX", "CBA.ASX", "BHP.1.ASX", "UNKNOWN1.ASX"]) == 4
+    assert scheduler.statistics["Calls"] == 2
+
+    bhp = cache.get("BHP.ASX")
+    assert (bhp.SecurityCode, bhp.Exchange, bhp.SecurityDescription) == ("BHP", "ASX", "BHP Mock Security")
+    assert bhp.ISIN and bhp.SEDOL
+    assert cache.get("bhp.asx") is bhp
+    assert cache.get("BHP.1.ASX").SecurityCode == "BHP.1"
+    assert cache.findByIsin(bhp.ISIN) == [bhp]
+    assert cache.findBySedol(bhp.SEDOL) == [bhp]
+    # Unknown securities are stored, so they are not requested again, but are not found
+    assert cache.get("UNKNOWN1.ASX") is None
+    assert cache.get("NAB.ASX") is None
+    assert cache.populate(["UNKNOWN1.ASX", "CBA.ASX"]) == 0
+    assert cache.getMany(["CBA.ASX", "NAB.ASX"])["NAB.ASX"].ISIN
+
+def test_storeIsKeptAcrossRunsUntilMaxAge(openReferenceDataCache, tmp_path):
+    storePath = str(tmp_path / "referencedata.db")
+    firstRun = openReferenceDataCache(storePath)
+    assert firstRun.populate(["BHP.ASX", "CBA.ASX", "UNKNOWN1.ASX"]) == 3
+    isin = firstRun.get("BHP.ASX").ISIN
+    firstRun.close()
+
+    secondRun = openReferenceDataCache(storePath)
+    assert secondRun.populate(["BHP.ASX", "CBA.ASX", "UNKNOWN1.ASX"]) == 0
+    assert secondRun.get("BHP.ASX").ISIN == isin
+    secondRun.close()
+
+    refreshingRun = openReferenceDataCache(storePath, maxAge=0)
+    assert refreshingRun.populate(["BHP.ASX", "CBA.ASX", "UNKNOWN1.ASX"]) == 3
+    assert refreshingRun.get("BHP.ASX").ISIN == isin
+
+def test_busyServerCallsAreRetried(openReferenceDataCache):
+    scheduler = RequestScheduler(maxAttempts=20, baseDelay=0.01)
+    cache = openReferenceDataCache(None, busyRate=0.5, batchSize=1, scheduler=scheduler)
+
+    assert cache.populate(["S{}.ASX".format(index) for index in range(10)]) == 10
+    assert all(cache.get("S{}.ASX".format(index)) is not None for index in range(10))
+    assert scheduler.statistics["Retries"] > 0
+    assert scheduler.statistics["Failures"] == 0
@@ -0,0 +1,205 @@
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import time
+import pytest
+import requests
+import urllib3.exceptions
+import zeep.exceptions
+
+import rawResponse
+import requestScheduler
+from requestScheduler import AdaptiveConcurrencyLimit, RequestScheduler, TokenBucket, IsTransient, IsNotDelivered
+
+class FakeClock:
+    # Stands in for the time module, with sleep moving the clock on rather than waiting
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    def perf_counter(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now = self.now + seconds
+
+@pytest.fixture
+def clock(monkeypatch):
+    fakeClock = FakeClock()
+    monkeypatch.setattr(requestScheduler, "time", fakeClock)
+    return fakeClock
+
+def HttpError(statusCode):
+    response = requests.Response()
+    response.status_code = statusCode
+    return requests.exceptions.HTTPError(response=response)
+
+def ConnectionFailure(reason):
+    return requests.exceptions.ConnectionError(urllib3.exceptions.MaxRetryError(None, "/", reason))
+
+def test_bucketAllowsABurstThenTheRate(clock):
+    bucket = TokenBucket(rate=2, burst=3)
+
+    assert [bucket.tryAcquire() for attempt in range(4)] == [True, True, True, False]
+    clock.now = clock.now + 0.5
+    assert bucket.tryAcquire()
+    assert not bucket.tryAcquire()
+    # A long idle period refills the bucket only up to its burst
+    clock.now = clock.now + 60
+    assert [bucket.tryAcquire() for attempt in range(4)] == [True, True, True, False]
+
+def test_bucketWaitsForTheNextToken(clock):
+    bucket = TokenBucket(rate=4)
+    for attempt in range(4):
+        bucket.acquire()
+    bucket.acquire()
+
+    assert clock.sleeps == [pytest.approx(0.25)]
+
+def test_limitGrowsByOneCallPerLimitsWorthOfCalls(clock):
+    concurrencyLimit = AdaptiveConcurrencyLimit(maxConcurrency=8)
+    concurrencyLimit.limit = 4.0
+    for call in range(4):
+        concurrencyLimit.acquire()
+        concurrencyLimit.release(0.1)
+
+    assert concurrencyLimit.limit == pytest.approx(5.0, abs=0.1)
+    for call in range(100):
+        concurrencyLimit.acquire()
+        concurrencyLimit.release(0.1)
+    assert concurrencyLimit.limit == 8.0
+
+def test_limitIsCutOncePerRecentLatency(clock):
+    concurrencyLimit = AdaptiveConcurrencyLimit(maxConcurrency=10, minConcurrency=2)
+    concurrencyLimit.release(0.5)
+    concurrencyLimit.inFlight = 0
+
+    # The calls that were in flight together fail together, and cut the limit once between them
+    for call in range(5):
+        concurrencyLimit.acquire()
+    for call in range(5):
+        concurrencyLimit.release(overloaded=True)
+    assert concurrencyLimit.limit == pytest.approx(9.0)
+
+    clock.now = clock.now + 0.5
+    concurrencyLimit.acquire()
+    concurrencyLimit.release(overloaded=True)
+    assert concurrencyLimit.limit == pytest.approx(8.1)
+
+    for cut in range(50):
+        clock.now = clock.now + 1
+        concurrencyLimit.acquire()
+        concurrencyLimit.release(overloaded=True)
+    assert concurrencyLimit.limit == 2.0
+
+def test_slowCallsCutTheLimit(clock):
+    concurrencyLimit = AdaptiveConcurrencyLimit(maxConcurrency=10, latencyTolerance=2.0)
+    for call in range(10):
+        concurrencyLimit.acquire()
+        concurrencyLimit.release(0.1)
+    limit = concurrencyLimit.limit
+    for call in range(20):
+        clock.now = clock.now + 1
+        concurrencyLimit.acquire()
+        concurrencyLimit.release(1.0)
+
+    assert concurrencyLimit.limit < limit
+
+@pytest.mark.parametrize("ex, transient, notDelivered", [
+    (HttpError(503), True, True),
+    (HttpError(429), True, True),
+    (HttpError(504), True, False),
+    (HttpError(500), False, False),
+    (requests.exceptions.ConnectTimeout(), True, True),
+    (requests.exceptions.ReadTimeout(), True, False),
+    (ConnectionFailure(urllib3.exceptions.NewConnectionError(None, "Connection refused")), True, True),
+    (ConnectionFailure(urllib3.exceptions.ProtocolError("Connection aborted")), True, False),
+    (requests.exceptions.ConnectionError("Connection reset"), True, False),
+    (zeep.exceptions.TransportError(status_code=503), True, True),
+    (zeep.exceptions.TransportError(status_code=502), True, False),
+    (zeep.exceptions.TransportError(status_code=404), False, False),
+    (zeep.exceptions.Fault("Server is busy, try again later"), True, False),
+    (zeep.exceptions.Fault("Invalid account code A001"), False, False),
+    (rawResponse.RawResponseError("Server busy", 503), True, True),
+    (rawResponse.RawResponseError("Request timed out", 500), True, False),
+    (rawResponse.RawResponseError("Invalid account code A001", 500), False, False),
+    (ValueError("Server busy"), False, False),
+])
+def test_failuresAreClassified(ex, transient, notDelivered):
+    assert IsTransient(ex) == transient
+    assert IsNotDelivered(ex) == notDelivered
+
+class FailingCall:
+    # Raises each of the failures in turn, then returns the number of calls made
+    def __init__(self, *failures):
+        self.failures = list(failures)
+        self.calls = 0
+
+    def __call__(self):
+        self.calls = self.calls + 1
+        if self.failures:
+            raise self.failures.pop(0)
+        return self.calls
+
+def test_transientFailuresAreRetriedUpToMaxAttempts(clock):
+    scheduler = RequestScheduler(maxAttempts=3)
+
+    assert scheduler.call("IRESS", "AlertGet", FailingCall(HttpError(503), requests.exceptions.ReadTimeout())) == 3
+    with pytest.raises(requests.exceptions.HTTPError):
+        scheduler.call("IRESS", "AlertGet", FailingCall(HttpError(503), HttpError(503), HttpError(503)))
+    with pytest.raises(zeep.exceptions.Fault):
+        scheduler.call("IRESS", "AlertGet", FailingCall(zeep.exceptions.Fault("Invalid account code")))
+    assert scheduler.statistics == { "Calls": 1, "Retries": 4, "Failures": 2, "Repeats": 0 }
+
+def test_callsThatAreNotIdempotentAreOnlyRetriedWhenNotDelivered(clock):
+    scheduler = RequestScheduler()
+
+    assert scheduler.call("IRESS", "AlertCreate", FailingCall(HttpError(503)), idempotent=False) == 2
+    call = FailingCall(requests.exceptions.ReadTimeout())
+    with pytest.raises(requests.exceptions.ReadTimeout):
+        scheduler.call("IRESS", "AlertCreate", call, idempotent=False)
+    assert call.calls == 1
+
+def test_concurrentCallsWithARequestIdAreCoalesced():
+    scheduler = RequestScheduler()
+    callStarted = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def BlockingCall():
+        calls.append(len(calls) + 1)
+        callStarted.set()
+        release.wait(5)
+        return len(calls)
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        first = executor.submit(scheduler.call, "IRESS", "AlertCreate", BlockingCall, requestId="REQUEST-1")
+        callStarted.wait(5)
+        repeat = executor.submit(scheduler.call, "IRESS", "AlertCreate", BlockingCall, requestId="REQUEST-1")
+        while scheduler.statistics["Repeats"] == 0:
+            time.sleep(0.01)
+        release.set()
+        assert (first.result(), repeat.result()) == (1, 1)
+
+    # Only calls in flight are shared, so once the first call completes its RequestID is called again
+    assert scheduler.call("IRESS", "AlertCreate", BlockingCall, requestId="REQUEST-1") == 2
+    assert scheduler.statistics["Calls"] == 2
+    assert scheduler.statistics["Repeats"] == 1
+
+def test_busyServerCallsAreRetried(startMockServer, buildClient, startSessions):
+    endpoint = startMockServer(busyRate=0.5)
+    client, clientFactory = buildClient(endpoint, "IRESS", "", "AlertGet")
+    requestScheduler.InstallTransientStatusHook(client.transport.session)
+    sessionKey = startSessions(client, clientFactory, endpoint).getIressSessionKey()
+    scheduler = RequestScheduler(maxAttempts=20, baseDelay=0.01)
+
+    for call in range(10):
+        content = scheduler.call(("IRESS", ""), "AlertGet", rawResponse.CallRaw, client, "AlertGet", clientFactory.AlertGetInput(Header=clientFactory.AlertGetInputHeader(SessionKey=sessionKey), Parameters=clientFactory.AlertGetInputParameters()))
+        assert len(list(rawResponse.DecodeDataRowValues(content, ["AlertID"]))) > 0
+
+    assert scheduler.statistics["Calls"] == 10
+    assert scheduler.statistics["Retries"] > 0
+    assert scheduler.statistics["Failures"] == 0
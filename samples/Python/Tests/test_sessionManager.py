@@ -0,0 +1,42 @@
+import time
+import pytest
+
+import rawResponse
+from sessionManager import INVALID_SESSION_PATTERN
+from conftest import IOSPLUS_SERVER
+
+def RequestOrderPad(client, clientFactory, serviceSessionKey):
+    return rawResponse.CallRaw(client, "OrderPadGetByAccount", clientFactory.OrderPadGetByAccountInput(Header=clientFactory.OrderPadGetByAccountInputHeader(ServiceSessionKey=serviceSessionKey, PageSize=10), Parameters=clientFactory.OrderPadGetByAccountInputParameters(AccountCodeArray={ "AccountCode": ["A001"] }, OrderFilter=1)))
+
+def test_invalidSessionPatternMatchesSessionFaultsOnly():
+    assert INVALID_SESSION_PATTERN.search("Session key 1234-ABCD@MOCK is invalid or has expired")
+    assert INVALID_SESSION_PATTERN.search("Invalid session key")
+    assert INVALID_SESSION_PATTERN.search("The session was kicked by another login")
+    assert not INVALID_SESSION_PATTERN.search("Invalid account code A001")
+    assert not INVALID_SESSION_PATTERN.search("Session limit reached for the user")
+
+def test_expiredSessionIsRestartedAndCallResent(startMockServer, buildClient, startSessions):
+    endpoint = startMockServer(sessionLifetime=1)
+    client, clientFactory = buildClient(endpoint, "IOSPlus", IOSPLUS_SERVER, "OrderPadGetByAccount")
+    sessionManager = startSessions(client, clientFactory, endpoint, service="IOSPLUS", server=IOSPLUS_SERVER)
+    expiredKeys = sessionManager.getSessionKeys()
+    time.sleep(1.5)
+
+    content = RequestOrderPad(client, clientFactory, expiredKeys[1])
+    assert len(list(rawResponse.DecodeDataRowValues(content, ["OrderNumber"]))) > 0
+    restartedKeys = sessionManager.getSessionKeys()
+    assert restartedKeys[0] != expiredKeys[0] and restartedKeys[1] != expiredKeys[1]
+
+    # A later call made with the key that was rejected is resent with the new key without another restart
+    RequestOrderPad(client, clientFactory, expiredKeys[1])
+    assert sessionManager.getSessionKeys() == restartedKeys
+
+def test_callWithAnotherSessionKeyIsNotResent(startMockServer, buildClient, startSessions):
+    endpoint = startMockServer(sessionLifetime=60)
+    client, clientFactory = buildClient(endpoint, "IOSPlus", IOSPLUS_SERVER, "OrderPadGetByAccount")
+    sessionManager = startSessions(client, clientFactory, endpoint, service="IOSPLUS", server=IOSPLUS_SERVER)
+    sessionKeys = sessionManager.getSessionKeys()
+
+    with pytest.raises(rawResponse.RawResponseError, match="invalid"):
+        RequestOrderPad(client, clientFactory, "UNKNOWN-KEY@MOCK")
+    assert sessionManager.getSessionKeys() == sessionKeys
@@ -0,0 +1,111 @@
+from requests import Session
+from requests.auth import HTTPBasicAuth
+from zeep import Settings
+import json
+import pytest
+import requests
+import zeep.exceptions
+
+import pager
+import wsdlCache
+from soapMetrics import SoapMetrics, MeteredClient, ServeMetrics
+from conftest import IRESS_NAMESPACE, USERNAME, COMPANYNAME, PASSWORD
+
+def test_expositionRendersCountersAndCumulativeHistograms():
+    metrics = SoapMetrics()
+    metrics.record({ "Operation": "AlertGet", "RequestID": "R1", "StatusCode": 1, "RequestBytes": 100, "ResponseBytes": 1000, "CallSeconds": 0.004, "WireSeconds": 0.003 })
+    metrics.record({ "Operation": "AlertGet", "RequestID": "R1", "StatusCode": 0, "RequestBytes": 120, "ResponseBytes": 500, "CallSeconds": 0.02, "WireSeconds": 0.01 })
+    metrics.record({ "Operation": 'Odd"Name', "Error": "Server busy", "RequestBytes": 50, "CallSeconds": 40.0 })
+    lines = metrics.formatExposition().splitlines()
+
+    assert lines[:6] == [
+        "# HELP webservices_calls_total Web Services operation calls by StatusCode, or error when the call failed.",
+        "# TYPE webservices_calls_total counter",
+        'webservices_calls_total{operation="AlertGet",status_code="0"} 1',
+        'webservices_calls_total{operation="AlertGet",status_code="1"} 1',
+        'webservices_calls_total{operation="Odd\\"Name",status_code="error"} 1',
+        "# HELP webservices_request_bytes_total Bytes sent in Web Services requests.",
+    ]
+    assert 'webservices_request_bytes_total{operation="AlertGet"} 220' in lines
+    assert 'webservices_response_bytes_total{operation="AlertGet"} 1500' in lines
+    assert "# TYPE webservices_call_duration_seconds histogram" in lines
+    assert 'webservices_call_duration_seconds_bucket{operation="AlertGet",le="0.0025"} 0' in lines
+    assert 'webservices_call_duration_seconds_bucket{operation="AlertGet",le="0.005"} 1' in lines
+    assert 'webservices_call_duration_seconds_bucket{operation="AlertGet",le="0.025"} 2' in lines
+    assert 'webservices_call_duration_seconds_bucket{operation="AlertGet",le="+Inf"} 2' in lines
+    assert 'webservices_call_duration_seconds_sum{operation="AlertGet"} 0.024' in lines
+    assert 'webservices_call_duration_seconds_count{operation="AlertGet"} 2' in lines
+    assert 'webservices_call_duration_seconds_bucket{operation="Odd\\"Name",le="30.0"} 0' in lines
+    assert 'webservices_call_duration_seconds_bucket{operation="Odd\\"Name",le="+Inf"} 1' in lines
+    # The two pages of R1 are one request, and a call without a RequestID is not a page of any
+    assert 'webservices_request_pages_bucket{operation="AlertGet",le="1"} 0' in lines
+    assert 'webservices_request_pages_bucket{operation="AlertGet",le="2"} 1' in lines
+    assert 'webservices_request_pages_count{operation="AlertGet"} 1' in lines
+    assert not any(line.startswith('webservices_request_pages_count{operation="Odd') for line in lines)
+
+def test_expositionFileAndTraceAreWritten(tmp_path):
+    metrics = SoapMetrics(str(tmp_path / "trace.jsonl"))
+    metrics.record({ "Operation": "AlertGet", "RequestID": "R1", "StatusCode": 0, "CallSeconds": 0.01 })
+    metrics.writeExposition(str(tmp_path / "metrics.prom"))
+    metrics.close()
+
+    assert (tmp_path / "metrics.prom").read_text() == metrics.formatExposition()
+    assert [json.loads(line) for line in (tmp_path / "trace.jsonl").read_text().splitlines()] == [{ "Operation": "AlertGet", "RequestID": "R1", "StatusCode": 0, "CallSeconds": 0.01, "Page": 1 }]
+
+@pytest.fixture
+def meteredClient(startMockServer, startSessions):
+    # A MeteredClient for the mock server's IRESS alert methods, with its sessions started, and its metrics
+    def BuildMeteredClient(**settings):
+        endpoint = startMockServer(**settings)
+        session = Session()
+        session.auth = HTTPBasicAuth(USERNAME + "@" + COMPANYNAME, PASSWORD)
+        metrics = SoapMetrics()
+        client = MeteredClient(wsdlCache.BuildWsdlUrl(endpoint, "IRESS", "", "AlertGet,AlertDelete"), metrics, settings=Settings(strict = False, xml_huge_tree = True), session=session)
+        client.set_ns_prefix("ns0", IRESS_NAMESPACE)
+        clientFactory = client.type_factory(IRESS_NAMESPACE)
+        return client, clientFactory, startSessions(client, clientFactory, endpoint).getIressSessionKey(), metrics
+
+    return BuildMeteredClient
+
+def test_pagedCallsAreCountedAndTimed(meteredClient):
+    client, clientFactory, sessionKey, metrics = meteredClient(rowCount=25)
+    alertGetInputParameters = clientFactory.AlertGetInputParameters()
+
+    alerts = list(pager.GetDataRows(lambda pagingHeader: client.service.AlertGet(clientFactory.AlertGetInput(Header=clientFactory.AlertGetInputHeader(SessionKey=sessionKey, **pagingHeader), Parameters=alertGetInputParameters)), pageSize=10, prefetch=False))
+    labels = (("operation", "AlertGet"),)
+    callCounts = { dict(counterLabels)["status_code"]: count for (name, counterLabels), count in metrics.counters.items() if name == "webservices_calls_total" and dict(counterLabels)["operation"] == "AlertGet" }
+
+    assert len(alerts) == 25
+    assert callCounts["1"] == 2 and sum(callCounts.values()) == 3
+    assert metrics.counters[("webservices_request_bytes_total", labels)] > 0
+    assert metrics.counters[("webservices_response_bytes_total", labels)] > 0
+    for name in ["webservices_call_duration_seconds", "webservices_serialize_duration_seconds", "webservices_wire_duration_seconds", "webservices_parse_duration_seconds"]:
+        assert metrics.histograms[(name, labels)].count == 3
+    callHistogram = metrics.histograms[("webservices_call_duration_seconds", labels)]
+    assert metrics.histograms[("webservices_wire_duration_seconds", labels)].sum <= callHistogram.sum
+    pagesHistogram = metrics.histograms[("webservices_request_pages", labels)]
+    assert (pagesHistogram.count, pagesHistogram.sum) == (1, 3)
+    # The session start calls made through the client are recorded as well
+    assert ("webservices_call_duration_seconds", (("operation", "IRESSSessionStart"),)) in metrics.histograms
+
+def test_failedCallsAreCountedAsErrors(meteredClient):
+    client, clientFactory, sessionKey, metrics = meteredClient(errorRate=1.0, errorOperations=["AlertDelete"])
+
+    with pytest.raises(zeep.exceptions.Fault):
+        client.service.AlertDelete(clientFactory.AlertDeleteInput(Header=clientFactory.AlertDeleteInputHeader(SessionKey=sessionKey), Parameters=clientFactory.AlertDeleteInputParameters(AlertIDArray={ "AlertID": [1] })))
+
+    assert metrics.counters[("webservices_calls_total", (("operation", "AlertDelete"), ("status_code", "error")))] == 1
+    assert "AlertDelete: Calls: 1 Errors: 1" in metrics.formatSummary()[0]
+
+def test_metricsAreServedForScraping():
+    metrics = SoapMetrics()
+    metrics.record({ "Operation": "AlertGet", "StatusCode": 0, "CallSeconds": 0.01 })
+    server = ServeMetrics(metrics, 0, "127.0.0.1")
+    try:
+        response = requests.get("http://127.0.0.1:{}/metrics".format(server.server_address[1]))
+        assert response.status_code == 200
+        assert response.text == metrics.formatExposition()
+        assert requests.get("http://127.0.0.1:{}/other".format(server.server_address[1])).status_code == 404
+    finally:
+        server.shutdown()
+        server.server_close()
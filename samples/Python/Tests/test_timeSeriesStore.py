@@ -0,0 +1,56 @@
+from datetime import date
+import os
+import numpy as np
+
+import timeSeriesStore
+from timeSeriesStore import TimeSeriesStore
+
+def BuildRows(closePrices):
+    # Rows for a dict of ISO date to ClosePrice
+    rows = np.full(len(closePrices), np.nan, dtype=timeSeriesStore.TIME_SERIES_DTYPE)
+    rows["TimeSeriesDate"] = np.array(list(closePrices), dtype="datetime64[s]")
+    rows["ClosePrice"] = list(closePrices.values())
+    return rows
+
+def ClosePrices(rows):
+    return { str(timeSeriesDate.astype("datetime64[D]")): closePrice for timeSeriesDate, closePrice in zip(rows["TimeSeriesDate"], rows["ClosePrice"]) }
+
+def test_missingRangesSkipCoveredDates():
+    coveredRanges = [(date(2024, 1, 5), date(2024, 1, 10)), (date(2024, 1, 11), date(2024, 1, 12)), (date(2024, 1, 20), date(2024, 1, 25))]
+
+    assert timeSeriesStore.GetMissingRanges(coveredRanges, date(2024, 1, 1), date(2024, 1, 31)) == [(date(2024, 1, 1), date(2024, 1, 4)), (date(2024, 1, 13), date(2024, 1, 19)), (date(2024, 1, 26), date(2024, 1, 31))]
+    assert timeSeriesStore.GetMissingRanges(coveredRanges, date(2024, 1, 6), date(2024, 1, 12)) == []
+
+def test_rowsAddedLastWinForADate():
+    merged = timeSeriesStore.MergeRows([BuildRows({ "2024-01-02": 1.0, "2024-01-03": 2.0 }), BuildRows({ "2024-01-03": 3.0, "2024-01-01": 4.0 }), BuildRows({ "2024-01-03": 5.0 })])
+
+    assert ClosePrices(merged) == { "2024-01-01": 4.0, "2024-01-02": 1.0, "2024-01-03": 5.0 }
+    assert list(merged["TimeSeriesDate"]) == sorted(merged["TimeSeriesDate"])
+
+def test_chunksAreReadMergedAndCompacted(tmp_path):
+    store = TimeSeriesStore(str(tmp_path))
+    store.add("BHP", "ASX", "Daily", BuildRows({ "2024-01-02": 1.0, "2024-01-03": 2.0 }), date(2024, 1, 1), date(2024, 1, 3))
+    # A range that returned no rows is still recorded as covered
+    store.add("BHP", "ASX", "Daily", BuildRows({}), date(2024, 1, 6), date(2024, 1, 7))
+    store.add("BHP", "ASX", "Daily", BuildRows({ "2024-01-03": 3.0, "2024-01-04": 4.0 }), date(2024, 1, 3), date(2024, 1, 4))
+    seriesPath = store.getSeriesPath("BHP", "ASX", "Daily")
+
+    assert ClosePrices(store.read("BHP", "ASX", "Daily")) == { "2024-01-02": 1.0, "2024-01-03": 3.0, "2024-01-04": 4.0 }
+    assert store.getCoveredRanges("BHP", "ASX", "Daily") == [(date(2024, 1, 1), date(2024, 1, 4)), (date(2024, 1, 6), date(2024, 1, 7))]
+    assert len(os.listdir(seriesPath + ".chunks")) == 2
+
+    assert store.compact("BHP", "ASX", "Daily") == 3
+    assert os.listdir(seriesPath + ".chunks") == []
+    compactedRows = store.read("BHP", "ASX", "Daily")
+    assert isinstance(compactedRows, np.memmap)
+    assert ClosePrices(compactedRows) == { "2024-01-02": 1.0, "2024-01-03": 3.0, "2024-01-04": 4.0 }
+
+def test_seriesIsCompactedAtMaxChunks(tmp_path):
+    store = TimeSeriesStore(str(tmp_path), maxChunks=3)
+    for day in range(1, 5):
+        store.add("BHP.1", "ASX", "Daily", BuildRows({ "2024-01-0{}".format(day): float(day) }), date(2024, 1, day), date(2024, 1, day))
+
+    assert store.readIndex(store.getSeriesPath("BHP.1", "ASX", "Daily"))["Chunks"] == ["4.npy"]
+    assert ClosePrices(store.read("BHP.1", "ASX", "Daily")) == { "2024-01-01": 1.0, "2024-01-02": 2.0, "2024-01-03": 3.0, "2024-01-04": 4.0 }
+    # A security named like a chunk file of another is a series of its own
+    assert len(store.read("BHP", "ASX", "Daily")) == 0
@@ -0,0 +1,86 @@
+from requests import Session
+import os
+import time
+import pytest
+import requests
+
+import wsdlCache
+from wsdlCache import GetWsdl, WsdlCacheError
+
+METHODS = "AlertGet,AlertDelete"
+
+class CountingSession(Session):
+    # A requests session that counts the WSDL fetches, and fails them once failing is set
+    def __init__(self):
+        super().__init__()
+        self.fetches = 0
+        self.failing = False
+
+    def get(self, url, **kwargs):
+        self.fetches = self.fetches + 1
+        if self.failing:
+            raise requests.ConnectionError("Endpoint unavailable")
+        return super().get(url, **kwargs)
+
+@pytest.fixture
+def wsdlEndpoint(startMockServer):
+    return startMockServer()
+
+def Expire(fileName, age):
+    modifiedTime = time.time() - age
+    os.utime(fileName, (modifiedTime, modifiedTime))
+
+def test_freshWsdlIsFetchedOnceAndReused(wsdlEndpoint, tmp_path):
+    session = CountingSession()
+
+    fileName = GetWsdl(session, wsdlEndpoint, "IRESS", "", METHODS, cacheDirectory=str(tmp_path))
+    assert os.path.dirname(fileName) == str(tmp_path)
+    assert wsdlCache.IsValidWsdl(wsdlCache.ReadFile(fileName), METHODS)
+    # The method list is keyed in sorted order, so the same methods in another order are the same WSDL
+    assert GetWsdl(session, wsdlEndpoint, "IRESS", "", "AlertDelete, AlertGet", cacheDirectory=str(tmp_path)) == fileName
+    assert session.fetches == 1
+    assert GetWsdl(session, wsdlEndpoint, "IRESS", "", "AlertGet", cacheDirectory=str(tmp_path)) != fileName
+    assert session.fetches == 2
+
+def test_expiredWsdlIsFetchedAgain(wsdlEndpoint, tmp_path):
+    session = CountingSession()
+    fileName = GetWsdl(session, wsdlEndpoint, "IRESS", "", METHODS, cacheDirectory=str(tmp_path), ttl=60)
+    Expire(fileName, 61)
+
+    assert GetWsdl(session, wsdlEndpoint, "IRESS", "", METHODS, cacheDirectory=str(tmp_path), ttl=60) == fileName
+    assert session.fetches == 2
+    assert time.time() - os.path.getmtime(fileName) < 60
+    assert GetWsdl(session, wsdlEndpoint, "IRESS", "", METHODS, cacheDirectory=str(tmp_path), ttl=60) == fileName
+    assert session.fetches == 2
+
+def test_failedFetchFallsBackToTheExpiredCopy(wsdlEndpoint, tmp_path):
+    session = CountingSession()
+    fileName = GetWsdl(session, wsdlEndpoint, "IRESS", "", METHODS, cacheDirectory=str(tmp_path), ttl=60)
+    Expire(fileName, 61)
+    session.failing = True
+
+    assert GetWsdl(session, wsdlEndpoint, "IRESS", "", METHODS, cacheDirectory=str(tmp_path), ttl=60) == fileName
+    assert session.fetches == 2
+    # Without a copy to fall back to, the failure is raised
+    with pytest.raises(requests.ConnectionError):
+        GetWsdl(session, wsdlEndpoint, "IRESS", "", "AlertGet", cacheDirectory=str(tmp_path), ttl=60)
+
+def test_invalidWsdlIsNotCached(wsdlEndpoint, tmp_path):
+    session = CountingSession()
+
+    with pytest.raises(WsdlCacheError, match="does not support the methods"):
+        GetWsdl(session, wsdlEndpoint, "IRESS", "", "AlertGet,NoSuchMethod", cacheDirectory=str(tmp_path))
+    assert os.listdir(str(tmp_path)) == []
+
+def test_offlineUsesAnyCachedWsdlWithoutFetching(wsdlEndpoint, tmp_path):
+    session = CountingSession()
+    fileName = GetWsdl(session, wsdlEndpoint, "IRESS", "", METHODS, cacheDirectory=str(tmp_path), ttl=60)
+    Expire(fileName, 61)
+    session.failing = True
+
+    assert GetWsdl(session, wsdlEndpoint, "IRESS", "", METHODS, cacheDirectory=str(tmp_path), ttl=60, offline=True) == fileName
+    # Another endpoint's key is not cached, but the WSDL on disk supports a subset of its methods
+    assert GetWsdl(session, "http://elsewhere/wsdl.aspx", "IRESS", "", "AlertGet", cacheDirectory=str(tmp_path), offline=True) == fileName
+    assert session.fetches == 1
+    with pytest.raises(WsdlCacheError, match="No cached WSDL"):
+        GetWsdl(session, wsdlEndpoint, "IRESS", "", "PricingQuoteGet", cacheDirectory=str(tmp_path), offline=True)